@@ -27,7 +27,12 @@
 #      this script's db_user, db_pass and db_name variables MUST
 #      be used. If a database is to be used, it is expected to
 #      contain an 'ingestions' and a 'steps' tables, even if 
-#      empty.
+#      empty. The indexes the ingestor relies on are added to an
+#      existing 'ingestions' table by the scripts in sql/.
+#
+#      Alternatively, '--db-backend sqlite' keeps the same tables in
+#      a local SQLite database (db_file) that is created on first use
+#      and needs no database server at all.
 #
 import os
 import re
@@ -35,17 +40,42 @@ import sys
 import pwd
 import grp
 import time
+import zlib
+import errno
+import shutil
 import atexit
 import signal
 import socket
 import tarfile
+import fnmatch
+import glob
 import inspect
+import tempfile
+import copy
+import imp
+import traceback
+import ctypes
+import ctypes.util
+import struct
+import select
+import resource
+import json
+import hashlib
 import optparse
 import platform
+import threading
+import itertools
+import multiprocessing
 from pprint import pprint
 import subprocess
-from SocketServer import *
+import Queue
+import asyncore
+import asynchat
+import bz2
+from cStringIO import StringIO
 from lib.CText import *
+from lib import PBzip2
+from lib import GzIndex
 
 
 DB = ''
@@ -54,9 +84,15 @@ basedir = '/mnt/carbon-steel'
 uplddir = os.path.join(basedir, 'upload')
 ingddir = os.path.join(basedir, 'ingested')
 linkdir = os.path.join(ingddir, 'links')
+trshdir = os.path.join(ingddir, '.trash')
+casdir = os.path.join(ingddir, '.cas')
 clardir = os.path.join(basedir, 'collector_archive')
+mdxdir = os.path.join(basedir, '.bundle_index')
+cidxdir = os.path.join(basedir, '.content_index')
 scrpdir = os.path.join(currdir, 'ingestion-scripts')
 bdlpath = ''
+bdlhash = ''
+bdlidx = None
 ing_ver = '1.0.0'
 dbginfo = 0
 timedbg = 0
@@ -79,14 +115,63 @@ logfile = sysfile + '.log'
 tcpaddr = '127.0.0.1'
 tcpport = 12345
 tcpresp = ''
+tcpsts = 1
+tcpmaxl = 4096
+xbufsz = 1 << 20
+cspatt = "\S*collector\.stats$"
+xdpatt = "^(\S+)/(collector[a-zA-Z0-9_.-]*)/\S*$"
+scrjobs = 4
+scrcost = {}
+bz2jobs = multiprocessing.cpu_count()
+wrkrs = 4
+jobqmax = 16
+wrkpool = None
+iwrkrs = 2
+iqmax = 64
+bwrkrs = 1
+bnice = 10
+mdxmax = 4096
+wqtime = 2.0
+ingown = 'ftp'
+inggrps = ['nexentians', 'staff']
+ingids = None
+fmode = 0660
+dmode = 0770
+trshjobs = 2
+trshq = None
+incrmtl = False
+clkfn = None
+pyinproc = True
+pymods = {}
+zygote = None
+zygwrks = None
+zygjobs = 64
+casdedup = True
+casbuf = 8 << 20
+selectv = False
+idxspan = GzIndex.SPAN
+packarc = True
+packwait = 3600.0
+packmin = 7 * 86400
+packskp = os.path.join(clardir, '.recompress_skipped')
 month = dict(Jan='01', Feb='02', Mar='03', Apr='04',
              May='05', Jun='06', Jul='07', Aug='08',
              Sep='09', Oct='10', Nov='11', Dec='12')
-commands = ['peek', 'ingest', 'reingest']
+commands = ['peek', 'ingest', 'reingest', 'dbt']
+lanes = ['interactive', 'ingest', 'bulk']
+lanecmd = dict(peek='interactive', status='interactive', dbt='interactive',
+               ingest='ingest', reingest='bulk')
 db_enable = False
 db_user = 'root'
 db_pass = 'nexenta'
 db_name = 'cookbook'
+db_back = 'mysql'
+db_file = os.path.join(basedir, 'ingestions.db')
+db_con = None
+db_pid = 0
+db_lock = threading.RLock()
+db_stpq = None
+dbflush = 5.0
 OS = ''
 PyV = ''
 
@@ -110,7 +195,6 @@ def stop(e):
 def log(lname, msg):
     global PyV
 
-    print PyV
     if PyV < '2.7.3':
         ln = time.strftime("%a %b %d %H:%M:%S %Y", time.strptime(time.ctime()))
         ft = ln + msg
@@ -122,6 +206,23 @@ def log(lname, msg):
         os.write(f.fileno(), ft)
 
 
+class Activity_Log(object):
+    """
+    #
+    # log() to a file that is kept open for the whole run
+    #
+    """
+    def __init__(self, lname):
+        self.fd = os.open(lname, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+            fmode)
+
+    def write(self, msg):
+        os.write(self.fd, time.ctime() + msg)
+
+    def close(self):
+        os.close(self.fd)
+
+
 def usage(p, msg):
     if msg:
         print_warn(msg, True)
@@ -137,6 +238,34 @@ def usage(p, msg):
 #
 # Time Manipulation Helper Functions
 #
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def monotime():
+    """
+    #
+    # CLOCK_MONOTONIC seconds (wall clock if it cannot be had), for
+    # measuring durations that a clock adjustment must not skew
+    #
+    """
+    global clkfn
+
+    if clkfn is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            clkfn = libc.clock_gettime
+            clkfn.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        except (OSError, AttributeError):
+            clkfn = False
+
+    if clkfn:
+        ts = timespec()
+        if clkfn(1, ctypes.byref(ts)) == 0:             # CLOCK_MONOTONIC
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+    return time.time()
+
+
 def now():
     return time.ctime(time.time())
 
@@ -211,29 +340,193 @@ def caller():
     return inspect.stack()[2][3]        # Name of caller function
 
 
+#
+# DataBase Backends
+#
+class DB_MySQL_Backend(object):
+    """
+    #
+    # MySQL server identified by db_user, db_pass and db_name
+    #
+    """
+    def __init__(self):
+        import MySQLdb
+        self.Error = MySQLdb.Error
+        self.driver = MySQLdb
+
+    def connect(self, user, passwd, dbname):
+        return self.driver.connect('localhost', user, passwd, dbname)
+
+    def ping(self, con):
+        con.ping()
+
+    def sql(self, stmt):
+        return stmt
+
+    def upsert(self, cur, tab, cols, ent):
+        p = ', '.join(['%s'] * len(ent))
+        sql = 'INSERT INTO %s (%s) VALUES (%s) ' % (tab, ', '.join(cols), p) +\
+            'ON DUPLICATE KEY UPDATE id=LAST_INSERT_ID(id), ' +            \
+            'uploaded_fullpath=VALUES(uploaded_fullpath), ' +              \
+            'tarball_fullpath=VALUES(tarball_fullpath), ' +                \
+            'final_fullpath=VALUES(final_fullpath), ' +                    \
+            'last_updated_at=VALUES(last_updated_at);'
+        cur.execute(sql, ent)
+        return cur.lastrowid, 'insert' if cur.rowcount == 1 else 'update'
+
+
+class DB_SQLite_Backend(object):
+    """
+    #
+    # Embedded database in db_file, with the same tables and indexes
+    # as the MySQL instance (created on first use). The database is in
+    # WAL mode so readers never block the writer; writes are serialized
+    # and committed in batches by their callers.
+    #
+    """
+    schema = '''
+        CREATE TABLE IF NOT EXISTS ingestions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uploaded_fullpath VARCHAR(255),
+            tarball_fullpath VARCHAR(255),
+            final_fullpath VARCHAR(255),
+            created_at DATETIME,
+            last_updated_at DATETIME,
+            current_step INTEGER);
+        CREATE UNIQUE INDEX IF NOT EXISTS ingestions_tarball_fullpath
+            ON ingestions (tarball_fullpath);
+        CREATE UNIQUE INDEX IF NOT EXISTS ingestions_uploaded_fullpath
+            ON ingestions (uploaded_fullpath);
+        CREATE INDEX IF NOT EXISTS ingestions_step_updated
+            ON ingestions (current_step, last_updated_at);
+        CREATE TABLE IF NOT EXISTS steps (
+            id INTEGER PRIMARY KEY,
+            name VARCHAR(255));
+    '''
+
+    def __init__(self):
+        import sqlite3
+        self.Error = sqlite3.Error
+        self.driver = sqlite3
+
+    def connect(self, user, passwd, dbname):
+        con = self.driver.connect(db_file, timeout=30)
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('PRAGMA synchronous=NORMAL')
+        con.executescript(self.schema)
+        return con
+
+    def ping(self, con):
+        pass
+
+    def sql(self, stmt):
+        return stmt.replace('%s', '?')
+
+    def upsert(self, cur, tab, cols, ent):
+        p = ', '.join(['?'] * len(ent))
+        sql = 'INSERT OR IGNORE INTO %s (%s) VALUES (%s);' %                \
+            (tab, ', '.join(cols), p)
+        cur.execute(sql, ent)
+        if cur.rowcount == 1:
+            return cur.lastrowid, 'insert'
+
+        #
+        # One row only, as ON DUPLICATE KEY does: the one of the bundle's
+        # tarball_fullpath, or else the one its upload path clashed with
+        #
+        c = dict(zip(cols, ent))
+        row = None
+        for key in ('tarball_fullpath', 'uploaded_fullpath'):
+            cur.execute('SELECT id FROM %s WHERE %s=?;' % (tab, key),
+                (c[key],))
+            row = cur.fetchone()
+            if row is not None:
+                break
+        cur.execute('UPDATE %s SET uploaded_fullpath=?, tarball_fullpath=?, '
+            % tab + 'final_fullpath=?, last_updated_at=? WHERE id=?;',
+            (c['uploaded_fullpath'], c['tarball_fullpath'],
+            c['final_fullpath'], c['last_updated_at'], row[0]))
+        return row[0], 'update'
+
+
+db_backends = {'mysql': DB_MySQL_Backend, 'sqlite': DB_SQLite_Backend}
+
+
+def db_backend(name):
+    """
+    #
+    # Load backend 'name'; DB is set to it and db_connect() et al.
+    # talk to it from then on
+    #
+    """
+    global DB
+
+    DB = db_backends[name]()
+    return DB
+
+
 #
 # DataBase Related Helper Functions
 #
 def db_connect(user, passwd, dbname):
-    try:
-        con = DB.connect('localhost', user, passwd, dbname)
-        cur = con.cursor()
+    """
+    #
+    # Hand out the connection of this process, (re)connecting only
+    # when there is none yet or it went away. Forked workers get a
+    # connection of their own rather than sharing the parent's.
+    #
+    """
+    global db_con
+    global db_pid
 
-    except DB.Error, e:
-        print "Error %d: %s" % (e.args[0], e.args[1])
-        sys.exit(1)
+    with db_lock:
+        if db_con is not None and db_pid == os.getpid():
+            try:
+                DB.ping(db_con)
+                return db_con, db_con.cursor()
+            except DB.Error:
+                db_con = None
+
+        try:
+            con = DB.connect(user, passwd, dbname)
+            cur = con.cursor()
+
+        except DB.Error, e:
+            print "Error: %s" % ', '.join(str(a) for a in e.args)
+            sys.exit(1)
+
+        if db_pid != os.getpid():
+            atexit.register(db_disconnect)
+        db_con = con
+        db_pid = os.getpid()
 
     return con, cur
 
 
-def db_execute(cur, cmd, echo):
+def db_disconnect():
+    global db_con
+
+    with db_lock:
+        if db_con is not None and db_pid == os.getpid():
+            db_flush()
+            try:
+                db_con.close()
+            except DB.Error:
+                pass
+        db_con = None
+    return
+
+
+def db_execute(cur, cmd, echo, args=None):
     """
     #
-    # do_execute returns tuple of tuples
+    # do_execute returns tuple of tuples; values are passed in 'args'
+    # and bound by the driver, never formatted into 'cmd'
     #
     """
-    cur.execute(cmd)
-    res = cur.fetchall()
+    with db_lock:
+        cur.execute(DB.sql(cmd), args or ())
+        res = cur.fetchall()
     if echo:
         for r in res:
             print_bcmplx(r, 'green', True)
@@ -256,8 +549,8 @@ def db_show_table(cur, con, dbtab):
 def db_print(tab, key, val):
     con, cur = db_connect(db_user, db_pass, db_name)
 
-    sql = 'SELECT * from %s WHERE %s=%d;' % (tab, key, val)
-    for r in db_execute(cur, sql, False):
+    sql = 'SELECT * from %s WHERE %s=%%s;' % (tab, key)
+    for r in db_execute(cur, sql, False, (val,)):
         print_pass('Ingestions @ %s=%d' % (key, val))
 
     return
@@ -266,9 +559,9 @@ def db_print(tab, key, val):
 def db_find_entry(tab, key, val):
     con, cur = db_connect(db_user, db_pass, db_name)
 
-    sql = 'SELECT id FROM %s WHERE %s="%s";' % (tab, key, val)
+    sql = 'SELECT id FROM %s WHERE %s=%%s;' % (tab, key)
     try:
-        idx = db_execute(cur, sql, False)
+        idx = db_execute(cur, sql, False, (val,))
 
     except NameError as e:
         pprint(e)
@@ -279,96 +572,138 @@ def db_find_entry(tab, key, val):
     return None
 
 
+class DB_Step_Queue(object):
+    """
+    #
+    # Write-behind queue for ingestion step updates. Only the latest
+    # step of every row is kept; pending steps are written in a single
+    # transaction every 'dbflush' seconds and when flushed explicitly.
+    # Flushes run one at a time, so a row never goes back to an older
+    # step, and steps that fail to be written are kept for the next.
+    #
+    """
+    def __init__(self, period):
+        self.period = period
+        self.steps = {}
+        self.lock = threading.Lock()
+        self.flushing = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, tab, indx, step):
+        with self.lock:
+            self.steps[(tab, indx)] = (step, fnow())
+
+    def run(self):
+        while True:
+            self.wake.wait(self.period)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception, e:
+                print_warn('Step update flush failed: %s' % e, True)
+
+    def flush(self):
+        with self.flushing:
+            with self.lock:
+                steps = self.steps
+                self.steps = {}
+            if not steps:
+                return
+
+            tabs = {}
+            for (tab, indx), (step, when) in steps.iteritems():
+                tabs.setdefault(tab, []).append((when, int(step), indx))
+
+            try:
+                con, cur = db_connect(db_user, db_pass, db_name)
+                with db_lock:
+                    for tab, rows in tabs.iteritems():
+                        sql = 'UPDATE %s SET last_updated_at=%%s, ' %   \
+                            tab + 'current_step=%s WHERE id=%s;'
+                        cur.executemany(DB.sql(sql), rows)
+                    con.commit()
+            except:
+                #
+                # Put them back, unless a newer step came in meanwhile
+                #
+                with self.lock:
+                    for key, ent in steps.iteritems():
+                        self.steps.setdefault(key, ent)
+                raise
+        return
+
+
 def db_update_entry(tab, indx, step):
-    con, cur = db_connect(db_user, db_pass, db_name)
+    """
+    #
+    # Queue a step update; it reaches the DB on the next flush
+    #
+    """
+    global db_stpq
 
-    s = 'UPDATE %s SET last_updated_at=\'%s\', ' % (tab, fnow())
-    q = 'current_step = %s WHERE id = %d;' % (step, indx)
-    sql = s + q
+    with db_lock:
+        if db_stpq is None or not db_stpq.thread.is_alive():
+            db_stpq = DB_Step_Queue(dbflush)
+    db_stpq.put(tab, indx, step)
+    return
 
-    try:
-        db_execute(cur, sql, False)
-        con.commit()
 
-    except NameError as e:
-        pprint(e)
-        stop(99)
+def db_flush():
+    """
+    #
+    # Write out all queued step updates now
+    #
+    """
+    if db_stpq is not None:
+        try:
+            db_stpq.flush()
 
+        except NameError as e:
+            pprint(e)
+            stop(99)
     return
 
 
-def db_insert_entry(tab, ent):
+def db_upsert_entry(tab, ent):
+    """
+    #
+    # Insert the ingestion entry, or refresh the existing row of the
+    # same bundle (tarball_fullpath and uploaded_fullpath are unique,
+    # see sql/001-ingestions-indexes.sql). Returns the row id and
+    # whether it was an 'insert' or an 'update'.
+    #
+    """
     con, cur = db_connect(db_user, db_pass, db_name)
 
-    t = 'INSERT INTO %s ' % tab
-    p = '(id, uploaded_fullpath, tarball_fullpath, ' +\
-        'final_fullpath, created_at, last_updated_at, current_step) VALUES '
-    s = "(%d, \'%s\', \'%s\', \'%s\', \'%s\', \'%s\', %d)" %\
-        (0, ent[0], ent[1], ent[2], ent[3], ent[4], ent[5])
-    sql = t + p + s + ";"
+    cols = ['uploaded_fullpath', 'tarball_fullpath', 'final_fullpath',
+        'created_at', 'last_updated_at', 'current_step']
 
     if dbdebug:
-        print "sql: ", sql
+        print "upsert: ", tab, ent
 
     try:
-        db_execute(cur, sql, False)
-        con.commit()
+        with db_lock:
+            indx, actn = DB.upsert(cur, tab, cols, tuple(ent))
+            con.commit()
 
     except NameError as e:
         pprint(e)
         sys.exit(99)
 
-    db_show_table(cur, con, tab)
-    return
-
-
-#
-# db_scan() checks for existing entries that have the exact same
-# 'tarball_fullpath'; if one exists, then db_actn will be set to
-# 'update'. If none exist, db_actn will be set to 'insert' a new
-# entry.
-#
-def db_scan():
-    global db_actn
-    global db_indx
-    global fqtd
-
-    if dbdebug:
-        print_warn('Start DB Debug', True)
-
-    dbt = 'ingestions'
-    key = 'tarball_fullpath'
-    ne = 0
-    idx = db_find_entry(dbt, key, fqtd)
-    if idx is not None:
-        for i in idx:
-            ne += 1
-
-    if ne == 0:
-        db_actn = 'insert'
-        if dbdebug:
-            print_pass('New Entry to be Inserted')
-    elif ne == 1:
-        db_actn = 'update'
-        db_indx = i[0]
-        if dbdebug:
-            print_pass('Entry to be Updated...')
-            db_print(dbt, 'id', db_indx)
-    else:
-        print_warn('DB Entries Found: ' + str(ne), False)
-        print_fail('Unable to continue.... DB inconsistency')
-        stop(111)
-
-    if dbdebug:
-        print_warn('End DB Debug', True)
-
-    return
+    return indx, actn
 
 
-def db_new_entry():
+def db_new_entry(trfp=None, fdir=None):
     """
     #
-    # Insert a new ingestion entry in DB
+    # Record the ingestion in the DB (one upsert) and remember its
+    # row in db_indx for the step updates that follow. db_actn tells
+    # whether the bundle was new ('insert') or seen before ('update').
+    # 'trfp' stands in for fqtd as the ingestion dir and 'fdir' for the
+    # archived bundle (see dedup_bundle()).
     #
     """
     global bdlpath
@@ -376,6 +711,8 @@ def db_new_entry():
     global cs_date
     global clardir
     global date
+    global db_actn
+    global db_indx
 
     table = 'ingestions'
     tarb = os.path.basename(bdlpath)
@@ -384,11 +721,11 @@ def db_new_entry():
         bdir = uplddir
 
     upfp = os.path.join(bdir, tarb)
-    trfp = fqtd
-    fdir = os.path.join(os.path.join(clardir, date), tarb)
+    trfp = trfp or fqtd
+    fdir = fdir or os.path.join(os.path.join(clardir, date), tarb)
     crtd = cst2dbt(cs_date)
     uptd = fnow()
-    step = 9
+    step = 0
     entry = [upfp, trfp, fdir, crtd, uptd, step]
     if dbdebug:
         print "Table: ", table
@@ -396,21 +733,22 @@ def db_new_entry():
         for e in entry:
             print '\t', e
 
-    db_insert_entry(table, entry)
+    db_indx, db_actn = db_upsert_entry(table, entry)
+    if dbdebug:
+        print_pass('Entry %d: %s' % (db_indx, db_actn))
 
 
 def DBShowTab(dbtab, cc):
     con, cur = db_connect(db_user, db_pass, db_name)
     db_show_table(cur, con, dbtab)
-    con.close()
     return
 
 
 def DBTabEntry(dbtab, idx, cc):
     con, cur = db_connect(db_user, db_pass, db_name)
-    sql = 'select * from %s where id = %d;' % (dbtab, idx[0])
+    sql = 'select * from %s where id = %%s;' % dbtab
     try:
-        db_execute(cur, sql, True)
+        db_execute(cur, sql, True, (idx[0],))
 
     except NameError as e:
         pprint(e)
@@ -450,6 +788,8 @@ def TCP_Handle_Request(rqst):
     #   peek     - get bundle creation date from the collector.stat file
     #   ingest   - perform initial ingestion and execute all ingestor scripts
     #   reingest - redo ingestion of a previously ingested collector bundle
+    #   dbt      - test if the bundle already exists in the database
+    #   status   - lane occupancy (answered by the daemon, see Worker_Lanes)
     #
     # Expected TCP pkt format:
     #
@@ -458,11 +798,20 @@ def TCP_Handle_Request(rqst):
     #   where: collector-bundle-path MUST be a Fully Qualified Collector
     #       Bundle (fqcb) name or it may be of type "filename.tar.gz" if
     #       it is KNOWN to already exist in the '/mnt/carbon-steel/upload'
-    #       directory of the ftp server.
+    #       directory of the ftp server. Everything after the first blank
+    #       is taken as the path, so paths may contain spaces.
+    #
+    # Returns the reply; tcpsts is left 0 if the request succeeded.
     """
     global date
     global bdlpath
-    cmd, arg = rqst.split(' ')
+    global tcpsts
+
+    tcpsts = 1
+    try:
+        cmd, arg = rqst.strip().split(' ', 1)
+    except ValueError:
+        return 'Pid %d: malformed request \"%s\"' % (os.getpid(), rqst)
 
     bdlpath = arg
     resp = ''
@@ -482,6 +831,7 @@ def TCP_Handle_Request(rqst):
         if cmd == 'peek':
             Peek(arg, cc)
             resp = '%s %s created on %s' % (pds, tcpresp, date)
+            tcpsts = 0
             return resp
 
         elif cmd == 'ingest':
@@ -489,6 +839,7 @@ def TCP_Handle_Request(rqst):
                 resp = tcpresp
             else:
                 resp = '%s %s ingested on %s' % (pds, tard, now())
+                tcpsts = 0
             return resp
 
         elif cmd == 'reingest':
@@ -496,6 +847,20 @@ def TCP_Handle_Request(rqst):
                 resp = tcpresp
             else:
                 resp = '%s %s reingested on %s' % (pds, tard, now())
+                tcpsts = 0
+            return resp
+
+        elif cmd == 'dbt':
+            if not db_enable:
+                return '%s database not enabled' % pds
+            final = Peek(arg, cc)
+            lst = db_find_entry('ingestions', 'tarball_fullpath', final)
+            if not lst:
+                resp = '%s %s does NOT exist in the DB' % (pds, final)
+            else:
+                resp = '%s %s in the DB as id %s' % (pds, final,
+                    ', '.join(str(i[0]) for i in lst))
+            tcpsts = 0
             return resp
 
         else:
@@ -506,36 +871,415 @@ def TCP_Handle_Request(rqst):
     return resp
 
 
-class TCP_Ingestion_Handler(StreamRequestHandler):
-    def handle(self):
-        print(self.client_address, now())
+def job_reset():
+    """
+    #
+    # Forget what the previous job of a long lived worker left in the
+    # per-bundle globals, so a job failing early never works on them
+    #
+    """
+    global fqtd
+    global tard
+    global date
+    global tskip
+    global cs_date
+    global cs_host
+    global cs_lkey
+    global db_actn
+    global db_indx
+    global bdlpath
+    global bdlhash
+    global bdlidx
+    global tcpresp
+    global tcpsts
+
+    fqtd = tard = date = ''
+    cs_date = cs_host = cs_lkey = ''
+    tskip = 0
+    db_actn = ''
+    db_indx = 0
+    bdlpath = bdlhash = ''
+    bdlidx = None
+    tcpresp = ''
+    tcpsts = 1
+
+
+def ingest_worker(jobs, results, nice=0):
+    """
+    #
+    # Body of an ingestion worker process: pull requests off the
+    # shared job queue, run them one at a time and post replies,
+    # along with their status (see TCP_Handle_Request()).
+    #
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if nice:
+        os.nice(nice)
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        jid, rqst = job
+        results.put(('start', jid, os.getpid()))
+
+        job_reset()
+        try:
+            reply = TCP_Handle_Request(rqst)
+            sts = tcpsts
+        except SystemExit as e:
+            sts = 1
+            reply = 'Pid %d: \"%s\" stopped (%s) %s' % \
+                (os.getpid(), rqst, e.code, tcpresp)
+        except Exception as e:
+            sts = 1
+            reply = 'Pid %d: \"%s\" failed: %s' % (os.getpid(), rqst, e)
+        os.chdir(currdir)
+
+        results.put(('done', jid, (reply, sts)))
+
+
+class Ingest_Worker_Pool(object):
+    """
+    #
+    # Fixed-size pool of ingestion worker processes fed from a
+    # bounded job queue. At most 'nworkers' extract/ingest runs
+    # proceed concurrently and at most 'qmax' more may wait for
+    # a free worker; anything beyond that is refused right away
+    # so the submitter can back off and retry. Job ids come from
+    # 'jids', which pools may share; workers run at niceness 'nice'.
+    #
+    """
+    def __init__(self, nworkers, qmax, jids=None, nice=0):
+        self.nworkers = nworkers
+        self.qmax = qmax
+        self.nice = nice
+        self.jobs = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.running = {}
+        self.workers = []
+        self.closing = False
+        self.jids = jids or itertools.count(1)
+
+        for i in range(nworkers):
+            self.spawn()
+
+        t = threading.Thread(target=self.collect)
+        t.daemon = True
+        t.start()
+
+    def spawn(self):
+        p = multiprocessing.Process(target=ingest_worker,
+            args=(self.jobs, self.results, self.nice))
+        p.start()
+        self.workers.append(p)
+
+    def busy(self):
+        return len(self.pending) >= self.nworkers + self.qmax
+
+    def submit(self, rqst, callback):
+        """
+        #
+        # Queue 'rqst' and return its job id, or None if the job
+        # queue is full. callback(jid, reply, sts) fires on completion;
+        # 'sts' is 0 if the request succeeded.
+        #
+        """
+        with self.lock:
+            if self.busy():
+                return None
+            jid = next(self.jids)
+            self.pending[jid] = callback
+        self.jobs.put((jid, rqst))
+        return jid
+
+    def finish(self, jid, reply, sts):
+        with self.lock:
+            cb = self.pending.pop(jid, None)
+        if cb is not None:
+            cb(jid, reply, sts)
+
+    def reap(self):
+        #
+        # A worker that died mid-job (crash, OOM kill) never posts
+        # its reply; fail the job it held and put a new worker in
+        # its place so the pool stays at full strength.
+        #
+        for p in self.workers[:]:
+            if p.is_alive():
+                continue
+            p.join()
+            self.workers.remove(p)
+            for jid, pid in self.running.items():
+                if pid == p.pid:
+                    del self.running[jid]
+                    self.finish(jid, 'Pid %d: worker died (exit %s)' %
+                        (pid, p.exitcode), 1)
+            with self.lock:
+                if not self.closing:
+                    self.spawn()
+
+    def collect(self):
+        while True:
+            try:
+                msg = self.results.get(timeout=1)
+            except Queue.Empty:
+                self.reap()
+                continue
+
+            what, jid, arg = msg
+            if what == 'start':
+                self.running[jid] = arg
+            else:
+                self.running.pop(jid, None)
+                self.finish(jid, *arg)
+
+    def shutdown(self):
+        #
+        # No respawns from reap() once the workers are being stopped
+        #
+        with self.lock:
+            self.closing = True
+        for p in self.workers:
+            if p.is_alive():
+                p.terminate()
+        for p in self.workers:
+            p.join()
+
+
+class Worker_Lanes(object):
+    """
+    #
+    # One Ingest_Worker_Pool per scheduling lane ('lanecmd' says which
+    # lane a command goes to), each with workers and a job queue of
+    # its own, so a request only ever waits behind those of its lane:
+    # a peek is never stuck behind multi-minute ingests, nor a new
+    # ingest behind a bulk reingest. 'limits' gives every lane its
+    # (workers, queue max, niceness). 'status', unknown commands and
+    # malformed requests are answered right away, by the daemon
+    # itself. Only one ingest or reingest of a bundle is in flight at
+    # any time, whatever lanes they go to.
+    #
+    """
+    def __init__(self, limits):
+        self.jids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.inflight = set()
+        self.pools = {}
+        for lane in lanes:
+            nworkers, qmax, nice = limits[lane]
+            self.pools[lane] = Ingest_Worker_Pool(nworkers, qmax,
+                self.jids, nice)
+
+    def lane(self, rqst):
+        return lanecmd.get(rqst.split(' ', 1)[0])
+
+    def bundle(self, rqst):
+        """
+        #
+        # Key of the bundle an ingest or reingest request works on, or
+        # None for other requests. The upload and its archived copy go
+        # by different paths (and a recompressed one by a .bz2 name),
+        # so the key is the bundle name without compression suffix.
+        #
+        """
+        cmd, arg = (rqst.split(' ', 1) + [''])[:2]
+        if cmd not in ('ingest', 'reingest'):
+            return None
+        return re.sub('\.(gz|bz2)$', '', os.path.basename(arg.strip()))
+
+    def submit(self, rqst, callback):
+        """
+        #
+        # Queue 'rqst' on its lane and return its job id, or None if it
+        # is turned away for now (see busy()). callback(jid, reply, sts)
+        # fires on completion.
+        #
+        """
+        cmd = rqst.split(' ', 1)[0]
+        reply, sts = None, 1
+        if cmd == 'status':
+            reply, sts = self.status(), 0
+        elif cmd not in lanecmd:
+            reply = 'Pid %d: %s: no such command' % (os.getpid(), cmd)
+        elif len(rqst.split(' ', 1)) < 2:
+            reply = 'Pid %d: malformed request \"%s\"' % (os.getpid(),
+                rqst)
+        if reply is not None:
+            jid = next(self.jids)
+            callback(jid, reply, sts)
+            return jid
+
+        key = self.bundle(rqst)
+        if key is None:
+            return self.pools[self.lane(rqst)].submit(rqst, callback)
+
+        def done(jid, reply, sts):
+            with self.lock:
+                self.inflight.discard(key)
+            callback(jid, reply, sts)
+
+        with self.lock:
+            if key in self.inflight:
+                return None
+            self.inflight.add(key)
+        jid = self.pools[self.lane(rqst)].submit(rqst, done)
+        if jid is None:
+            with self.lock:
+                self.inflight.discard(key)
+        return jid
+
+    def busy(self, rqst):
+        """
+        #
+        # Why submit() turned 'rqst' away
+        #
+        """
+        with self.lock:
+            if self.bundle(rqst) in self.inflight:
+                return 'bundle already in progress'
+        return '%s lane full' % self.lane(rqst)
+
+    def status(self):
+        st = []
+        for lane in lanes:
+            pool = self.pools[lane]
+            with pool.lock:
+                npend = len(pool.pending)
+            nrun = min(pool.nworkers, npend)
+            st.append('%s %d/%d running, %d/%d queued' % (lane, nrun,
+                pool.nworkers, npend - nrun, pool.qmax))
+        return 'Pid %d: %s' % (os.getpid(), '; '.join(st))
+
+    def shutdown(self):
+        for lane in lanes:
+            self.pools[lane].shutdown()
+
+
+class TCP_Async_Trigger(asyncore.file_dispatcher):
+    """
+    #
+    # Job completions arrive on the worker pool's collector thread;
+    # they are queued here and the event loop is woken through a
+    # pipe so that replies are only ever pushed from the loop itself.
+    #
+    """
+    def __init__(self, cmap):
+        self.rfd, self.wfd = os.pipe()
+        asyncore.file_dispatcher.__init__(self, self.rfd, cmap)
+        self.done = Queue.Queue()
+
+    def pull(self, chan, line):
+        self.done.put((chan, line))
+        os.write(self.wfd, 'x')
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(512)
         while True:
-            data = self.request.recv(1024)
-            if not data:
+            try:
+                chan, line = self.done.get_nowait()
+            except Queue.Empty:
                 break
-            reply = TCP_Handle_Request(data)
-            self.request.send(reply.encode())
-        try:
-            self.request.close()
-        except:
-            pass
+            if chan.connected:
+                chan.push(line)
+
+
+class TCP_Async_Channel(asynchat.async_chat):
+    """
+    #
+    # One notifier connection. Requests are newline framed and may be
+    # pipelined; each is acknowledged right away with its job id and
+    # its completion is sent later, in whatever order jobs finish:
+    #
+    #   -> 'ingest /mnt/carbon-steel/upload/foo bar.tar.gz'
+    #   <- 'ACK 17 ingest /mnt/carbon-steel/upload/foo bar.tar.gz'
+    #   <- 'DONE 17 Pid 1234 executing "ingest" ... ingested on ...'
+    #
+    # A request that does not fit in the job queue of its lane, or
+    # for a bundle that is already being (re)ingested (see
+    # Worker_Lanes), is answered with 'BUSY cmd path why' and is not
+    # retried by the daemon.
+    #
+    """
+    def __init__(self, sock, cmap, trigger):
+        asynchat.async_chat.__init__(self, sock, cmap)
+        self.set_terminator('\n')
+        self.trigger = trigger
+        self.ibuf = []
+        self.ilen = 0
+
+    def collect_incoming_data(self, data):
+        self.ibuf.append(data)
+        self.ilen += len(data)
+        if self.ilen > tcpmaxl:
+            self.push('ERR request exceeds %d bytes\n' % tcpmaxl)
+            self.close_when_done()
+            self.ibuf = []
+            self.ilen = 0
+
+    def found_terminator(self):
+        rqst = ''.join(self.ibuf).strip()
+        self.ibuf = []
+        self.ilen = 0
+        if not rqst:
+            return
 
+        def complete(jid, reply, sts):
+            if isinstance(reply, unicode):      # names off the JSON indexes
+                reply = reply.encode('utf-8')
+            line = 'DONE %d %s\n' % (jid, ' '.join(reply.splitlines()))
+            self.trigger.pull(self, line)
+
+        jid = wrkpool.submit(rqst, complete)
+        if jid is None:
+            self.push('BUSY %s %s; retry later\n' % (rqst,
+                wrkpool.busy(rqst)))
+        else:
+            self.push('ACK %d %s\n' % (jid, rqst))
+
+    def handle_close(self):
+        self.close()
+
+
+class TCP_Async_Server(asyncore.dispatcher):
+    def __init__(self, addr):
+        self.cmap = {}
+        asyncore.dispatcher.__init__(self, map=self.cmap)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(addr)
+        self.listen(64)
+        self.trigger = TCP_Async_Trigger(self.cmap)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        sock, addr = pair
+        print(addr, now())
+        TCP_Async_Channel(sock, self.cmap, self.trigger)
 
-class TCP_Forking_Server(ForkingTCPServer):
     def serve_forever(self):
         def sigterm_handler(signo, frame):
             sys.stderr.write('\nSIGINT Detected\n')
             raise SystemExit(1)
         signal.signal(signal.SIGINT, sigterm_handler)
 
-        while True:
-            self.handle_request()
-
-    def collect_children(self):
-        pass
+        asyncore.loop(timeout=30, use_poll=True, map=self.cmap)
 
 
 def collector_stats(fd):
+    global cs_lkey
+    global cs_host
     global cs_date
     global date
 
@@ -655,124 +1399,2366 @@ def reingest_post(sfile, ffile):
     return
 
 
-def extract_bundle(fname, cc):
+#
+# Bundle Metadata Index Helper Functions
+#
+def mdx_path(fqbn, st=None):
     """
     #
-    # Before bundle extraction, we MUST make sure this is
-    # a bonafide collector bundle. If so, we go ahead and
-    # extract in the 'ingested/YYYY-MM-DD' directory
+    # Index entry of a bundle file; the key is its (path, size, mtime)
+    # so a bundle that gets replaced or touched is a cache miss. 'st'
+    # stands in for its stat, should it no longer be at 'fqbn'.
     #
     """
-    global fqtd
-    global tard
-    global date
-    global tskip
-    global OS
-    global db_enable
+    st = st or os.stat(fqbn)
+    key = '%s\0%d\0%d' % (os.path.realpath(fqbn), st.st_size,
+        int(st.st_mtime))
+    return os.path.join(mdxdir, hashlib.sha1(key).hexdigest() + '.json')
+
 
+def mdx_load(fqbn):
+    """
     #
-    # Create fully qualified tar extraction directory
-    # and perform the extraction there. We have to do
-    # a bit of shell hand-waving as the tarfile module
-    # is not able to readily strip 'var/tmp' prefix.
+    # Cached metadata of bundle 'fqbn', or None. A hit bumps the
+    # entry's mtime, which is what eviction goes by.
     #
-    fqbn = fqcb(fname, cc)
-    if fqbn is None:
-        return
-
-    tard = derive_xdir(fqbn, cc)
-    if not os.path.exists(ingddir):
-        os.mkdir(ingddir)
-    ddir = os.path.join(ingddir, date)
-    if not os.path.exists(ddir):
-        os.mkdir(ddir)
-    fqtd = os.path.join(ddir, tard)
-
-    if db_enable and OS == 'Linux':
-        db_scan()
+    """
+    try:
+        path = mdx_path(fqbn)
+        with open(path) as f:
+            md = json.load(f)
+        os.utime(path, None)
+    except (EnvironmentError, ValueError):
+        return None
 
-    cs = [is_compressed(fname), ' < ', fqbn, ' | ', '( cd ', ddir,
-           '; tar --strip-components=' + str(tskip), ' -xpf - )']
-    cmd = "".join(cs)
-    os.popen(cmd)
+    if md.get('path') != os.path.realpath(fqbn):
+        return None
+    return md
 
-    jinged = os.path.join(fqtd, '.just_ingested')
-    jinged_at = jinged + '_at'
-    flags = os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_TRUNC
 
-    if caller() == 'Reingest':
-        reingest_prep(jinged)
+def mdx_store(fqbn, **kw):
+    """
+    #
+    # Merge 'kw' into the index entry of 'fqbn'. Entries are written
+    # to a temp file and renamed into place, so concurrent workers
+    # never see a partial one; the last writer wins.
+    #
+    """
+    md = mdx_load(fqbn) or {}
+    md.update(kw)
+    md['path'] = os.path.realpath(fqbn)
 
     try:
-        os.close(os.open(jinged, flags, 0644))
-    except:
-        errmsg = 'Fatal Error: file ' + jinged + ' already exists'
-        if cc == 'cli':
-            print_fail(errmsg)
-            raise SystemExit(1)
-        else:
-            tcpresp = errmsg
-            return
+        if not os.path.isdir(mdxdir):
+            os.makedirs(mdxdir)
+        fd, tmp = tempfile.mkstemp(prefix='.mdx-', dir=mdxdir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(md, f)
+        os.rename(tmp, mdx_path(fqbn))
+        mdx_evict()
+    except EnvironmentError, e:
+        if dbginfo:
+            print_warn('Bundle index not updated: %s' % e, True)
+    return
 
-    if dbginfo:
-        print_debug('\nTarfile: %s extracted in %s\n' % (fname, fqtd), True)
 
+def mdx_move(old, new):
+    """
     #
-    # Create links
+    # Carry the index entry of bundle 'old' over to 'new', the path it
+    # has just been renamed to (the archive, see extract_bundle())
     #
-    if not os.path.exists(linkdir):
-        os.mkdir(linkdir)
-    os.chdir(linkdir)
+    """
+    if os.path.realpath(old) == os.path.realpath(new):
+        return
+
     try:
-        os.symlink(fqtd, tard)
-    except:
-        None
-    os.chdir(currdir)
+        path = mdx_path(old, os.stat(new))
+        with open(path) as f:
+            md = json.load(f)
+        os.unlink(path)
+    except (EnvironmentError, ValueError):
+        return
+    md.pop('path', None)
+    mdx_store(new, **md)
+    return
+
 
+def mdx_evict():
+    """
     #
-    # Move Collector Bundle to "collector_archive" directory.
+    # Keep at most 'mdxmax' entries, dropping the least recently used
     #
-    if not os.path.exists(clardir):
-        os.mkdir(clardir)
+    """
+    ents = [e for e in os.listdir(mdxdir) if e.endswith('.json')]
+    if len(ents) <= mdxmax:
+        return
 
-    dest = os.path.join(clardir, date)
-    if not os.path.exists(dest):
-        os.mkdir(dest)
-    os.chdir(dest)
+    aged = []
+    for e in ents:
+        try:
+            aged.append((os.stat(os.path.join(mdxdir, e)).st_mtime, e))
+        except OSError:
+            pass
+    aged.sort()
+    for mt, e in aged[:len(aged) - mdxmax]:
+        try:
+            os.unlink(os.path.join(mdxdir, e))
+        except OSError:
+            pass
+    return
+
+
+def mdx_stats(fqbn):
+    """
+    #
+    # Restore what collector_stats() and derive_xdir() would have set
+    # from the index; returns tard, or None on a miss.
+    #
+    """
+    global cs_lkey
+    global cs_host
+    global cs_date
+    global date
+    global tskip
+
+    md = mdx_load(fqbn)
+    if not md or not md.get('tard'):
+        return None
+
+    cs_lkey = md.get('cs_lkey')
+    cs_host = md.get('cs_host')
+    cs_date = md['cs_date']
+    tskip = md['tskip']
+    date = fmt_time(cs_date, 'ymd')
+    return md['tard']
+
+
+#
+# Content Index Helper Functions
+#
+class Digest_File(object):
+    """
+    #
+    # Bundle file object that keeps the SHA-256 of what is read from
+    # it. Reading it again from the start (see PBzip2.Reader) does not
+    # hash anything twice.
+    #
+    """
+    def __init__(self, fqbn):
+        self.fd = open(fqbn, 'rb')
+        self.sha = hashlib.sha256()
+        self.pos = 0
+        self.hashed = 0
+
+    def read(self, n=-1):
+        data = self.fd.read(n)
+        end = self.pos + len(data)
+        if end > self.hashed:
+            self.sha.update(data[self.hashed - self.pos:])
+            self.hashed = end
+        self.pos = end
+        return data
+
+    def seek(self, off, whence=0):
+        self.fd.seek(off, whence)
+        self.pos = self.fd.tell()
+
+    def tell(self):
+        return self.pos
+
+    def hexdigest(self):
+        """
+        #
+        # Digest of the whole file; whatever the decompressor left
+        # unread (trailing padding) is read here
+        #
+        """
+        self.seek(self.hashed)
+        while self.read(xbufsz):
+            pass
+        return self.sha.hexdigest()
+
+    def close(self):
+        self.fd.close()
+
+
+def file_digest(fqbn):
+    h = hashlib.sha256()
+    with open(fqbn, 'rb') as f:
+        for data in iter(lambda: f.read(xbufsz), ''):
+            h.update(data)
+    return h.hexdigest()
+
+
+def cidx_path(size, digest):
+    return os.path.join(cidxdir, '%d-%s.json' % (size, digest))
+
+
+def cidx_store(fqbn, digest, **kw):
+    """
+    #
+    # Record that the bundle whose contents hash to 'digest' (and has
+    # the size of 'fqbn') was ingested as described by 'kw'. Written
+    # like mdx_store(); never evicted, as entries are what makes an
+    # upload a duplicate.
+    #
+    """
+    try:
+        size = os.stat(fqbn).st_size
+        if not os.path.isdir(cidxdir):
+            os.makedirs(cidxdir)
+        ent = dict(kw, size=size, sha256=digest)
+        fd, tmp = tempfile.mkstemp(prefix='.cidx-', dir=cidxdir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(ent, f)
+        os.rename(tmp, cidx_path(size, digest))
+    except EnvironmentError, e:
+        if dbginfo:
+            print_warn('Content index not updated: %s' % e, True)
+    return
+
+
+def cidx_lookup(fqbn):
+    """
+    #
+    # Index entry of an already ingested bundle with the same contents
+    # as 'fqbn', or None. The upload is only hashed up front when some
+    # ingested bundle has its exact size; otherwise its digest comes
+    # for free during extraction (see stream_extract()). Entries whose
+    # ingestion dir is gone are dropped.
+    #
+    """
+    try:
+        size = os.stat(fqbn).st_size
+        if not [e for e in os.listdir(cidxdir)
+                if e.startswith('%d-' % size)]:
+            return None
+
+        path = cidx_path(size, file_digest(fqbn))
+        with open(path) as f:
+            ent = json.load(f)
+    except (EnvironmentError, ValueError):
+        return None
+
+    if not os.path.isdir(ent.get('fqtd', '')):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        return None
+    return ent
+
+
+def dedup_bundle(fqbn, cc):
+    """
+    #
+    # If upload 'fqbn' has the contents of a bundle ingested before,
+    # make it a link to that ingestion instead of a second one: a
+    # 'links/<bundle>' symlink to its dir, the upload replaced by a
+    # symlink to the archived bundle, and a DB entry of its own.
+    # Returns True if it was such a duplicate.
+    #
+    """
+    global fqtd
+    global tard
+    global date
+    global cs_date
+    global cs_host
+    global cs_lkey
+    global tcpresp
+
+    if fqbn is None:
+        return False
+    ent = cidx_lookup(fqbn)
+    if ent is None:
+        return False
+
+    fqtd = ent['fqtd']
+    tard = ent['tard']
+    date = ent['date']
+    cs_date = ent['cs_date']
+    cs_host = ent.get('cs_host')
+    cs_lkey = ent.get('cs_lkey')
+
+    bnm = os.path.basename(fqbn)
+    name = re.sub('(\.tar)?\.[^.]+$', '', bnm)
+    link = os.path.join(linkdir, name)
+    if not os.path.exists(linkdir):
+        os.mkdir(linkdir)
+    if not os.path.lexists(link):
+        os.symlink(fqtd, link)
+
+    dest = os.path.join(clardir, date)
+    if not os.path.exists(dest):
+        os.makedirs(dest)
+    dest = os.path.join(dest, bnm)
+    arch = ent.get('archive', '')
+    if not os.path.exists(arch):
+        os.rename(fqbn, dest)           # original is gone; keep this one
+        cidx_store(dest, ent['sha256'], **dict(ent, archive=dest))
+    else:
+        if is_compressed(arch) != is_compressed(dest):
+            dest = pack_name(dest)      # recompressed (see pack_bundle())
+        if dest != arch:
+            tmp = dest + '.dup-%d' % os.getpid()
+            os.symlink(arch, tmp)
+            os.rename(tmp, dest)
+        if os.path.realpath(fqbn) != os.path.realpath(arch):
+            os.unlink(fqbn)
+
+    msg = '%s: duplicate of %s' % (bnm, fqtd)
+    if cc == 'cli':
+        print_bold('Duplicate:\t', 'white', False)
+        print msg
+    else:
+        tcpresp = msg
+
+    if db_enable:
+        db_new_entry(link, dest)
+        db_update_entry('ingestions', db_indx, '9')
+        db_flush()
+        db_print('ingestions', 'id', db_indx)
+    return True
+
+
+#
+# Content Addressed Store Helper Functions
+#
+def cas_path(digest):
+    return os.path.join(casdir, digest[:2], digest)
+
+
+def cas_off(e):
+    """
+    #
+    # The store cannot be used on this file system (no hard links,
+    # different device); go on without it
+    #
+    """
+    global casdedup
+
+    if e.errno in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP):
+        casdedup = False
+        if dbginfo:
+            print_warn('Content store disabled: %s' % e, True)
+
+
+def cas_link(ent, path):
+    """
+    #
+    # Hard link store entry 'ent' as 'path'; False if there is no
+    # such entry or it has run out of links (EMLINK)
+    #
+    """
+    try:
+        os.link(ent, path)
+        return True
+    except OSError as e:
+        cas_off(e)
+        return False
+
+
+def cas_add(ent, path):
+    """
+    #
+    # Make freshly written 'path' store entry 'ent'. An entry that
+    # is already there (out of links, or added concurrently) is
+    # replaced; the files linked to it keep their inode.
+    #
+    """
+    tmp = '%s.%d' % (ent, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(ent)):
+            os.makedirs(os.path.dirname(ent))
+    except OSError:
+        pass
+    try:
+        os.link(path, tmp)
+        os.rename(tmp, ent)
+    except OSError as e:
+        cas_off(e)
+
+
+def cas_attrs(mtime):
+    """
+    #
+    # (uid, gid, mode, mtime) of a store file: the ingested bundle
+    # owner (whoever writes it, without root), 'fmode' without write
+    # permission and 'mtime'
+    #
+    """
+    if os.geteuid() == 0:
+        uid, gid = ingest_ids()
+    else:
+        uid, gid = os.geteuid(), os.getegid()
+    return uid, gid, fmode & ~0222, int(mtime)
+
+
+def cas_same(ent, attrs):
+    """
+    #
+    # Does store entry 'ent' have attributes 'attrs' (see cas_attrs())?
+    # None if there is no such entry.
+    #
+    """
+    try:
+        st = os.stat(ent)
+    except OSError:
+        return None
+    return (st.st_uid, st.st_gid, st.st_mode & 07777,
+        int(st.st_mtime)) == attrs
+
+
+def cas_write(src, size, path, mtime):
+    """
+    #
+    # Write the 'size' bytes of file object 'src' as 'path', sharing
+    # the inode of an identical file in the store. Up to 'casbuf'
+    # bytes are hashed before anything is written, so a file that is
+    # in the store costs no data writes at all; larger ones are hashed
+    # as they are written and swapped for the store copy afterwards.
+    # Store files are read-only (see cas_attrs()), and one with
+    # another owner or mtime than 'path' should have is not shared:
+    # 'path' is then a private copy with the usual owner and mode
+    # (see own_path()).
+    # Either way 'path' is given all of its attributes here. Returns
+    # True if 'path' is now a store inode that existed before.
+    #
+    """
+    attrs = cas_attrs(mtime)
+    h = hashlib.sha256()
+    if size <= casbuf:
+        data = src.read()
+        h.update(data)
+        ent = cas_path(h.hexdigest())
+        same = cas_same(ent, attrs)
+        if same and cas_link(ent, path):
+            return True
+        with open(path, 'wb') as f:
+            f.write(data)
+    else:
+        with open(path, 'wb') as f:
+            for data in iter(lambda: src.read(xbufsz), ''):
+                h.update(data)
+                f.write(data)
+        ent = cas_path(h.hexdigest())
+        same = cas_same(ent, attrs)
+        tmp = '%s.cas-%d' % (path, os.getpid())
+        if same and cas_link(ent, tmp):
+            os.rename(tmp, path)
+            return True
+
+    if not casdedup or same is False:
+        own_path(path, False)
+        os.utime(path, (mtime, mtime))
+        return False
+
+    if os.geteuid() == 0:
+        os.lchown(path, attrs[0], attrs[1])
+    os.chmod(path, attrs[2])
+    os.utime(path, (mtime, mtime))
+    cas_add(ent, path)
+    return False
+
+
+def CasPrune(cc):
+    """
+    # CasPrune
+    #
+    # NZA_Ingestor --cas-prune
+    #
+    # Remove the content store entries that no ingested file links
+    # to any more (a link count of 1 is the store's own) and report
+    # how much the remaining ones save.
+    """
+    me = whoami()
+    kept = pruned = freed = saved = 0
+
+    for d, dnames, fnames in os.walk(casdir, topdown=False):
+        for fn in fnames:
+            path = os.path.join(d, fn)
+            try:
+                st = os.lstat(path)
+                if st.st_nlink > 1:
+                    kept += 1
+                    saved += st.st_size * (st.st_nlink - 2)
+                    continue
+                os.unlink(path)
+            except OSError:
+                continue
+            pruned += 1
+            freed += st.st_size
+        if d != casdir:
+            try:
+                os.rmdir(d)             # only goes if empty
+            except OSError:
+                pass
+
+    print_bold('%s:\t' % me, 'white', False)
+    print '%d entries pruned (%d bytes freed), %d kept (%d bytes saved)' % \
+        (pruned, freed, kept, saved)
+    return 0
+
+
+#
+# Ownership Helper Functions
+#
+def ingest_ids():
+    """
+    #
+    # (uid, gid) everything in an ingested bundle belongs to: ingown
+    # and the first group of inggrps that exists
+    #
+    """
+    global ingids
+
+    if ingids is None:
+        grpid = 10
+        for g in inggrps:
+            try:
+                grpid = grp.getgrnam(g).gr_gid
+                break
+            except KeyError:
+                pass
+        ingids = (pwd.getpwnam(ingown).pw_uid, grpid)
+    return ingids
+
+
+def own_path(path, isdir):
+    """
+    #
+    # Give 'path' the ingested bundle owner and mode (dirs 'dmode',
+    # everything else 'fmode'); ownership needs root.
+    #
+    """
+    if os.geteuid() == 0:
+        os.lchown(path, *ingest_ids())
+    if not os.path.islink(path):
+        os.chmod(path, dmode if isdir else fmode)
+    return
+
+
+def as_ingest_owner():
+    """
+    #
+    # Popen preexec_fn: run the child as the bundle owner with a umask
+    # that leaves what it creates at 'dmode'/'fmode'
+    #
+    """
+    if os.geteuid() == 0:
+        uid, gid = ingest_ids()
+        os.setgroups([gid])
+        os.setgid(gid)
+        os.setuid(uid)
+    os.umask(0777 & ~dmode)
+
+
+#
+# Bundle Stream Helper Functions
+#
+class Bundle_Stream(object):
+    """
+    #
+    # Sequential reader over a compressed collector bundle, handing
+    # out the decompressed tar stream. Concatenated gzip members and
+    # bzip2 streams are followed through, as gunzip/bunzip2 would.
+    # Reads of the whole bundle may decode bzip2 on 'nproc' processes
+    # (see PBzip2.Reader) and have a gzip bundle indexed on the way
+    # ('index', see GzIndex.Indexer); a peek that stops after a few KB
+    # does neither.
+    #
+    """
+    def __init__(self, fqbn, nproc=1, index=False):
+        self.fd = Digest_File(fqbn)
+        self.tool = is_compressed(fqbn)
+        self.dobj = self.decompressor()
+        self.pbz = None
+        self.gzx = None
+        if self.tool == 'bunzip2' and nproc > 1:
+            self.pbz = iter(PBzip2.Reader(self.fd, nproc))
+        elif self.tool == 'gunzip' and index and idxspan and \
+             GzIndex.libz():
+            self.gzx = GzIndex.Indexer(self.fd, idxspan)
+            self.pbz = iter(self.gzx)
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def decompressor(self):
+        if self.tool == 'bunzip2':
+            return bz2.BZ2Decompressor()
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def inflate(self, raw):
+        out = []
+        while raw:
+            try:
+                out.append(self.dobj.decompress(raw))
+            except EOFError:            # bz2 stream already ended
+                self.dobj = self.decompressor()
+                continue
+            except zlib.error:
+                if raw.strip('\0'):     # not just trailing padding
+                    raise
+                break
+
+            raw = self.dobj.unused_data
+            if raw:
+                self.dobj = self.decompressor()
+        return ''.join(out)
+
+    def next_chunk(self):
+        if self.pbz is not None:
+            return next(self.pbz, None)
+
+        raw = self.fd.read(xbufsz)
+        if not raw:
+            return None
+        return self.inflate(raw)
+
+    def fill(self, n):
+        chunks = [self.buf[self.pos:]]
+        have = len(chunks[0])
+        while have < n and not self.eof:
+            data = self.next_chunk()
+            if data is None:
+                self.eof = True
+                break
+            chunks.append(data)
+            have += len(data)
+        self.buf = ''.join(chunks)
+        self.pos = 0
+
+    def read(self, n=-1):
+        if n < 0:
+            self.fill(sys.maxint)
+            n = len(self.buf)
+        elif len(self.buf) - self.pos < n:
+            self.fill(n)
+
+        data = self.buf[self.pos:self.pos + n]
+        self.pos += len(data)
+        return data
+
+    def digest(self):
+        if self.gzx is not None:
+            for data in self.pbz:       # the index wants it all
+                pass
+        return self.fd.hexdigest()
+
+    def close(self):
+        if self.pbz is not None:
+            self.pbz.close()
+        self.fd.close()
+
+
+class Bundle_Tar(tarfile.TarFile):
+    """
+    #
+    # tarfile.TarFile over a Bundle_Stream; members can only be
+    # visited once, in archive order. Whatever gets extracted is
+    # given the ingested bundle owner and mode as it is written,
+    # rather than the ones recorded in the archive. Regular files go
+    # through the content store (see cas_write()), which gives them
+    # their attributes itself; they are left exactly as they come.
+    #
+    """
+    stored = None
+
+    def makefile(self, tarinfo, targetpath):
+        self.stored = None
+        if os.path.lexists(targetpath) and not os.path.isdir(targetpath):
+            os.unlink(targetpath)       # never write through a store link
+        if not casdedup or tarinfo.size == 0:
+            return tarfile.TarFile.makefile(self, tarinfo, targetpath)
+
+        src = self.extractfile(tarinfo)
+        try:
+            cas_write(src, tarinfo.size, targetpath, tarinfo.mtime)
+            self.stored = targetpath
+        finally:
+            src.close()
+
+    def chown(self, tarinfo, targetpath):
+        if targetpath != self.stored:
+            own_path(targetpath, tarinfo.isdir())
+
+    def chmod(self, tarinfo, targetpath):
+        pass                            # done by chown() above
+
+    def utime(self, tarinfo, targetpath):
+        if targetpath != self.stored:
+            tarfile.TarFile.utime(self, tarinfo, targetpath)
+
+    @classmethod
+    def bundle(cls, fqbn, nproc=1, index=False):
+        bs = Bundle_Stream(fqbn, nproc, index)
+        tf = cls.open(fileobj=bs, mode='r|', bufsize=xbufsz)
+        tf.bstream = bs
+        return tf
+
+    def close(self):
+        tarfile.TarFile.close(self)
+        self.bstream.close()
+
+
+def strip_member(name, skip):
+    """
+    #
+    # Drop the first 'skip' components of a member name, the way
+    # 'tar --strip-components' does; None if nothing remains or if
+    # the name would escape the extraction directory.
+    #
+    """
+    parts = [c for c in name.split('/') if c not in ('', '.')]
+    if name.startswith('/') or '..' in parts or len(parts) <= skip:
+        return None
+    return '/'.join(parts[skip:])
+
+
+def stream_extract(fqbn, cc):
+    """
+    #
+    # Extract the bundle in a single streaming pass. The extraction
+    # directory depends on collector.stats (its date and top-level
+    # collector dir), so members that precede collector.stats in the
+    # archive are parked in a staging dir under 'ingested' and moved
+    # into place once it has been read; everything after it is
+    # written straight to 'ingested/YYYY-MM-DD/<tard>'. Returns that
+    # directory, or None if this is not a usable collector bundle.
+    # With --selective, members outside the manifest are skipped (see
+    # member_manifest()) and listed in .ingestor_skipped. The tar
+    # offset and size of every file is kept in bdlidx, for the index
+    # extract_bundle() writes once the bundle is archived.
+    #
+    """
+    global fqtd
+    global tard
+    global tskip
+    global tcpresp
+    global bdlhash
+    global bdlidx
+
+    stg = tempfile.mkdtemp(prefix='.xtract-', dir=ingddir)
+    staged = []
+    dirs = []
+    members = []
+    offs = {}
+    skipped = set()
+    pats = member_manifest() if selectv else None
+    ddir = None
+
+    try:
+        tf = Bundle_Tar.bundle(fqbn, bz2jobs, True)
+        for ti in tf:
+            members.append(ti.name)
+            if ti.isreg():
+                offs[ti.name] = [ti.offset_data, ti.size]
+            elif ti.islnk() and ti.linkname in offs:
+                offs[ti.name] = offs[ti.linkname]
+            if ddir is None and re.match(cspatt, ti.name):
+                fd = tf.extractfile(ti)
+                data = fd.read() if fd else ''
+                collector_stats(StringIO(data))
+
+                mp = re.match(xdpatt, ti.name)
+                if not mp or not date:
+                    break
+                tard = mp.group(2)
+                tskip = 1 if len(re.split('/', mp.group(1))) == 1 else 2
+
+                ddir = os.path.join(ingddir, date)
+                if not os.path.exists(ddir):
+                    os.mkdir(ddir)
+                    own_path(ddir, True)
+                fqtd = os.path.join(ddir, tard)
+                unstage(stg, staged, ddir, dirs)
+
+                dst = os.path.join(ddir, strip_member(ti.name, tskip))
+                if not os.path.isdir(os.path.dirname(dst)):
+                    os.makedirs(os.path.dirname(dst))
+                with open(dst, 'wb') as f:
+                    f.write(data)
+                tf.chown(ti, dst)
+                tf.utime(ti, dst)
+                continue
+
+            if ddir is None:
+                name = strip_member(ti.name, 0)
+                if not (member_wanted(pats, ti, 1, skipped) or
+                        member_wanted(pats, ti, 2, skipped)):
+                    skipped.add(ti.name)
+                elif name is not None:
+                    extract_member(tf, ti, stg, name, [])
+                    staged.append(ti)
+                continue
+
+            name = strip_member(ti.name, tskip)
+            if not member_wanted(pats, ti, tskip, skipped):
+                skipped.add(ti.name)
+            elif name is not None:
+                if ti.islnk():
+                    ti.linkname = strip_member(ti.linkname, tskip) or ''
+                extract_member(tf, ti, ddir, name, dirs)
+
+        bdlhash = tf.bstream.digest()
+        bdlidx = (tf.bstream.gzx, offs)
+        tf.close()
+
+    except (tarfile.TarError, EnvironmentError, zlib.error, EOFError), e:
+        errmsg = 'Fatal error: Cannot extract collector bundle: %s' % e
+        if cc == 'cli':
+            sys.stderr.write(errmsg + '\n')
+            stop(101)
+        tcpresp = errmsg
+        return None
+
+    finally:
+        shutil.rmtree(stg, True)
+
+    if ddir is None:
+        errmsg = 'Fatal error: %s is not a collector bundle' % fqbn
+        if cc == 'cli':
+            sys.stderr.write(errmsg + '\n')
+            stop(101)
+        tcpresp = errmsg
+        return None
+
+    #
+    # Directory owner/mode/mtime go last, deepest first, as writing
+    # their contents would have undone them (cf. tarfile.extractall)
+    #
+    if fqtd not in [path for ti, path in dirs]:
+        own_path(fqtd, True)            # no entry of its own in the archive
+    dirs.sort(key=lambda d: d[1], reverse=True)
+    for ti, path in dirs:
+        try:
+            tf.chown(ti, path)
+            tf.utime(ti, path)
+            tf.chmod(ti, path)
+        except tarfile.ExtractError:
+            pass
+
+    if skipped:
+        names = [strip_member(n, tskip) for n in members if n in skipped]
+        skipped_update(os.path.join(fqtd, '.ingestor_skipped'),
+            [member_rel(n) for n in names if n is not None], [])
+        if dbginfo:
+            print_debug('%d members left in %s\n' % (len(names), fqbn), True)
+
+    mdx_store(fqbn, tard=tard, cs_date=cs_date, cs_host=cs_host,
+        cs_lkey=cs_lkey, tskip=tskip, members=members)
+    return fqtd
+
+
+def index_bundle(fqbn):
+    """
+    #
+    # Write the random access index of archived bundle 'fqbn' (see
+    # lib/GzIndex.py) from what stream_extract() gathered, and name
+    # the bundle in fqtd/.ingestor_bundle so that scripts and nxcat
+    # can read the members that were never extracted, or were pruned
+    #
+    """
+    global bdlidx
+
+    path = os.path.join(fqtd, '.ingestor_bundle')
+    with open(path, 'w') as f:
+        f.write(fqbn + '\n')
+    own_path(path, False)
+
+    if bdlidx is None or bdlidx[0] is None:
+        return
+    gzx, offs = bdlidx
+    bdlidx = None
+    members = {}
+    for n, ent in offs.iteritems():
+        name = strip_member(n, tskip)
+        if name is not None:
+            members[member_rel(name)] = ent
+    try:
+        if gzx.write(fqbn, members):
+            own_path(fqbn + '.idx', False)
+    finally:
+        gzx.close()
+
+
+def extract_member(tf, ti, xdir, name, dirs):
+    """
+    #
+    # Extract member 'ti' as 'xdir/name'. Directories are created
+    # with a safe mode; their real attributes are applied at the end
+    # of the extraction from the (tarinfo, path) pairs left in 'dirs'.
+    #
+    """
+    xi = copy.copy(ti)
+    xi.name = name
+    if ti.isdir():
+        dirs.append((ti, os.path.join(xdir, name)))
+        xi.mode = 0700
+    tf.extract(xi, xdir)
+
+
+def unstage(stg, staged, ddir, dirs):
+    """
+    #
+    # Move the members parked in staging dir 'stg' to their stripped
+    # place under 'ddir'. A directory that does not exist there yet
+    # is moved in one go, along with everything below it.
+    #
+    """
+    for ti in staged:
+        src = os.path.join(stg, strip_member(ti.name, 0))
+        name = strip_member(ti.name, tskip)
+        if name is None or not os.path.lexists(src):
+            continue
+
+        dst = os.path.join(ddir, name)
+        if ti.isdir():
+            dirs.append((ti, dst))
+            if os.path.isdir(dst):
+                continue
+        elif os.path.isdir(dst):
+            shutil.rmtree(dst)
+
+        if not os.path.isdir(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+        os.rename(src, dst)
+
+
+#
+# Selective Extraction Helper Functions
+#
+def member_manifest():
+    """
+    #
+    # fnmatch patterns of the bundle members that ingestion scripts
+    # and nxcat read, relative to the bundle dir: those in scrpdir/
+    # MANIFEST, plus the '# requires:' entries no script produces
+    # (raw bundle files). None, i.e. extract everything, if there is
+    # no MANIFEST.
+    #
+    """
+    try:
+        with open(os.path.join(scrpdir, 'MANIFEST')) as f:
+            pats = [l.split('#')[0].strip() for l in f]
+    except IOError:
+        return None
+
+    pats = [p for p in pats if p]
+    hdrs = [script_headers(s) for s in get_ingestor_scripts()]
+    prods = [q for reqs, prod in hdrs for q in prod]
+    for reqs, prod in hdrs:
+        for r in reqs or []:
+            if not [q for q in prods if script_satisfies(q, r)]:
+                pats.append(r + '*' if r.endswith('/') else r)
+    return pats
+
+
+def member_rel(name):
+    """
+    #
+    # Stripped member name (see strip_member()) relative to fqtd
+    #
+    """
+    parts = name.split('/', 1)
+    return parts[1] if len(parts) > 1 and parts[0] == tard else name
+
+
+def member_wanted(pats, ti, skip, skipped):
+    """
+    #
+    # Should member 'ti' be extracted, going by manifest 'pats'?
+    # Directories and symlinks always are; hard links only if their
+    # target was.
+    #
+    """
+    if pats is None or ti.isdir() or ti.issym():
+        return True
+    if ti.islnk():
+        return ti.linkname not in skipped
+    name = strip_member(ti.name, skip)
+    if name is None:
+        return True
+    name = name.split('/', 1)[-1]        # below the collector dir
+    return any(fnmatch.fnmatch(name, p) for p in pats)
+
+
+def skipped_update(path, add, drop):
+    """
+    #
+    # Add the member names in 'add' to skip list 'path' (one name per
+    # line, relative to fqtd) and remove those in 'drop'
+    #
+    """
+    try:
+        with open(path) as f:
+            names = [l.rstrip('\n') for l in f]
+    except IOError:
+        names = []
+
+    names = [n for n in names if n not in drop] + \
+        [n for n in add if n not in names]
+    if names:
+        with open(path, 'w') as f:
+            f.write(''.join(n + '\n' for n in names))
+        own_path(path, False)
+    elif os.path.exists(path):
+        os.unlink(path)
+
+
+def archived_bundle(fpath):
+    """
+    #
+    # Bundle file 'fpath', or the most recent one of that name in
+    # collector_archive, under its .bz2 name if it was recompressed
+    # since (see pack_bundle())
+    #
+    """
+    if os.path.isfile(fpath):
+        return os.path.abspath(fpath)
+
+    bnm = os.path.basename(fpath)
+    fqbns = glob.glob(os.path.join(clardir, '*', bnm)) or \
+        glob.glob(os.path.join(clardir, '*', pack_name(bnm)))
+    fqbns.sort(key=lambda p: os.path.dirname(p))
+    return fqbns[-1] if fqbns else None
+
+
+def Materialize(fpath, member, cc):
+    """
+    # Materialize
+    #
+    # NZA_Ingestor --materialize { foo.tar.gz | /path/to/bundle } member
+    #
+    # Extract members left out by a --selective ingestion into the
+    # ingestion dir of the bundle. 'member' is relative to that dir
+    # and may be an fnmatch pattern.
+    """
+    global fqtd
+    global tard
+
+    me = whoami()
+    fqbn = archived_bundle(fpath)
+    if fqbn is None or not is_compressed(fqbn):
+        print_fail('%s: no such bundle in %s' % (fpath, clardir))
+        return 1
+
+    tard = derive_xdir(fqbn, cc)
+    if tard is None:
+        print_fail('%s: no collector.stats in bundle' % fqbn)
+        return 1
+
+    fqtd = os.path.join(ingddir, fmt_time(cs_date, 'ymd'), tard)
+    if not os.path.isdir(fqtd):
+        print_fail('%s has not been ingested' % fqbn)
+        return 1
+
+    exact = not [c for c in '*?[' if c in member]
+    ddir = os.path.dirname(fqtd)
+    done = []
+    links = {}
+    try:
+        tf = Bundle_Tar.bundle(fqbn)
+        for ti in tf:
+            name = strip_member(ti.name, tskip)
+            if name is None or ti.isdir():
+                continue
+            rel = member_rel(name)
+            if not fnmatch.fnmatch(rel, member):
+                continue
+
+            tgt = strip_member(ti.linkname, tskip) if ti.islnk() else None
+            if tgt is not None and \
+               not os.path.exists(os.path.join(ddir, tgt)):
+                links.setdefault(ti.linkname, []).append(name)
+                continue                # its data is in the target member
+            if ti.islnk():
+                ti.linkname = tgt or ''
+            extract_member(tf, ti, ddir, name, [])
+            done.append(rel)
+            if exact:
+                break
+        tf.close()
+
+        #
+        # Hard links whose target was left out too: one more pass to
+        # write the target's data as the first link, and link the rest
+        #
+        if links:
+            tf = Bundle_Tar.bundle(fqbn)
+            for ti in tf:
+                if ti.name not in links:
+                    continue
+                names = links.pop(ti.name)
+                extract_member(tf, ti, ddir, names[0], [])
+                for name in names[1:]:
+                    dst = os.path.join(ddir, name)
+                    if os.path.lexists(dst):
+                        os.unlink(dst)
+                    os.link(os.path.join(ddir, names[0]), dst)
+                done.extend(member_rel(n) for n in names)
+                if not links:
+                    break
+            tf.close()
+
+    except (tarfile.TarError, EnvironmentError, zlib.error, EOFError), e:
+        print_fail('Cannot extract from %s: %s' % (fqbn, e))
+        return 1
+
+    skipped_update(os.path.join(fqtd, '.ingestor_skipped'), [], done)
+    print_bold('%s:\t' % me, 'white', False)
+    print '%d members of %s extracted in %s' % (len(done), fqbn, fqtd)
+    return 0 if done else 1
+
+
+def ingest_prep(cc, reingest):
+    """
+    #
+    # Get extracted bundle dir fqtd ready for ingest_bundle(): DB
+    # entry, '.just_ingested' marker and link. Returns fqtd, or None
+    # if the marker is there already.
+    #
+    """
+    global tcpresp
+
+    if db_enable:
+        db_new_entry()
+
+    jinged = os.path.join(fqtd, '.just_ingested')
+    flags = os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_TRUNC
+
+    if reingest:
+        reingest_prep(jinged)
+
+    try:
+        os.close(os.open(jinged, flags, fmode))
+        own_path(jinged, False)
+    except:
+        errmsg = 'Fatal Error: file ' + jinged + ' already exists'
+        if cc == 'cli':
+            print_fail(errmsg)
+            raise SystemExit(1)
+        else:
+            tcpresp = errmsg
+            return
+
+    #
+    # Create links
+    #
+    if not os.path.exists(linkdir):
+        os.mkdir(linkdir)
+    os.chdir(linkdir)
+    try:
+        os.symlink(fqtd, tard)
+    except:
+        None
+    os.chdir(currdir)
+    return fqtd
+
+
+def incremental_dir(fqbn, cc):
+    """
+    #
+    # Point fqtd at the ingestion dir an incremental reingest of
+    # archived bundle 'fqbn' can work in as it is, without extracting
+    # the bundle again: the one its last run left, fingerprints and
+    # all. Returns fqtd, or None if the bundle has to be extracted.
+    #
+    """
+    global fqtd
+    global tard
+
+    if fqbn is None or os.path.dirname(os.path.dirname(
+            os.path.realpath(fqbn))) != os.path.realpath(clardir):
+        return None
+
+    tard = derive_xdir(fqbn, cc)
+    if tard is None:
+        return None
+    fqtd = os.path.join(ingddir, date, tard)
+    fp_file = os.path.join(fqtd, '.ingestor_fingerprints')
+    if fingerprints_load(fp_file) is None:
+        return None
+    return fqtd
+
+
+def extract_bundle(fname, cc):
+    """
+    #
+    # Before bundle extraction, we MUST make sure this is
+    # a bonafide collector bundle. If so, we go ahead and
+    # extract in the 'ingested/YYYY-MM-DD' directory.
+    # Returns that directory, or None if nothing was
+    # extracted.
+    #
+    """
+    global fqtd
+    global tard
+    global date
+    global tskip
+    global tcpresp
+    global OS
+    global db_enable
+
+    #
+    # Extract into the fully qualified tar extraction
+    # directory, which is derived from collector.stats
+    # along the way (see stream_extract()). The whole
+    # extraction is done by the time this returns.
+    #
+    fqbn = fqcb(fname, cc)
+    if fqbn is None:
+        return
+
+    if not os.path.exists(ingddir):
+        os.mkdir(ingddir)
+    if stream_extract(fqbn, cc) is None:
+        return
+
+    if ingest_prep(cc, caller() == 'Reingest') is None:
+        return
+
+    if dbginfo:
+        print_debug('\nTarfile: %s extracted in %s\n' % (fname, fqtd), True)
+
+    #
+    # Move Collector Bundle to "collector_archive" directory.
+    #
+    if not os.path.exists(clardir):
+        os.mkdir(clardir)
+
+    dest = os.path.join(clardir, date)
+    if not os.path.exists(dest):
+        os.mkdir(dest)
+    os.chdir(dest)
     bnm = os.path.basename(fname)
 
-    if dbginfo:
-        if cc == 'cli':
-            print_debug('%s will be moved to %s/%s\n' % (fqbn, dest, bnm), True)
-    os.rename(fqbn, os.path.join(dest, bnm))
+    if dbginfo:
+        if cc == 'cli':
+            print_debug('%s will be moved to %s/%s\n' % (fqbn, dest, bnm), True)
+    os.rename(fqbn, os.path.join(dest, bnm))
+    mdx_move(fqbn, os.path.join(dest, bnm))
+
+    cidx_store(os.path.join(dest, bnm), bdlhash, fqtd=fqtd, tard=tard,
+        date=date, cs_date=cs_date, cs_host=cs_host, cs_lkey=cs_lkey,
+        archive=os.path.join(dest, bnm))
+
+    try:
+        index_bundle(os.path.join(dest, bnm))
+    except EnvironmentError, e:
+        if dbginfo:
+            print_debug('No index for %s: %s\n' % (bnm, e), True)
+    return fqtd
+
+
+#
+# Archive Recompression Helper Functions
+#
+def idle_priority():
+    """
+    #
+    # Run this process at the lowest CPU priority and, on Linux, in
+    # the idle I/O class: it only gets the disk when nobody else wants
+    # it. ioprio_set() has no libc wrapper, hence the raw syscall.
+    #
+    """
+    os.nice(19)
+    nr = {'x86_64': 251, 'i686': 289, 'i386': 289, 'aarch64': 30}.get(
+        platform.machine())
+    if OS != 'Linux' or nr is None:
+        return
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.syscall(nr, 1, 0, 3 << 13)  # WHO_PROCESS, self, CLASS_IDLE
+    except (OSError, AttributeError):
+        pass
+    return
+
+
+def pack_name(fqbn):
+    return re.sub('\.(gz|bz2)$', '.bz2', fqbn)
+
+
+def pack_candidates():
+    """
+    #
+    # Archived bundles (not the symlinks dedup_bundle() leaves) that
+    # have not been touched for 'packmin' seconds and were neither
+    # packed nor found not to shrink (see pack_bundle()) before
+    #
+    """
+    try:
+        with open(packskp) as f:
+            skip = set(l.rstrip('\n') for l in f)
+    except IOError:
+        skip = set()
+
+    fqbns = []
+    for fqbn in sorted(glob.glob(os.path.join(clardir, '*', '*'))):
+        if os.path.islink(fqbn) or not os.path.isfile(fqbn) or \
+           not is_compressed(fqbn) or fqbn in skip or \
+           time.time() - os.path.getmtime(fqbn) < packmin:
+            continue
+        try:
+            idx = GzIndex.Index(fqbn)
+            packed = idx.kind == 'bzip2'
+            idx.close()
+        except IOError:
+            packed = False
+        if not packed:
+            fqbns.append(fqbn)
+    return fqbns
+
+
+class Pack_Stream(Bundle_Stream):
+    """
+    #
+    # Bundle_Stream that hands everything read from it on to a
+    # GzIndex.Packer and keeps the SHA-256 of it
+    #
+    """
+    def __init__(self, fqbn, packer):
+        Bundle_Stream.__init__(self, fqbn, bz2jobs)
+        self.packer = packer
+        self.sha = hashlib.sha256()
+
+    def read(self, n=-1):
+        data = Bundle_Stream.read(self, n)
+        self.packer.pack(data)
+        self.sha.update(data)
+        return data
+
+
+def pack_verify(path, digest, size):
+    """
+    #
+    # Does bzip2 file 'path' decompress to 'size' bytes of tar stream
+    # hashing to 'digest'? Decoded serially with the bz2 module, not
+    # by anything the packing went through.
+    #
+    """
+    sha = hashlib.sha256()
+    n = 0
+    with open(path, 'rb') as fd:
+        try:
+            for data in PBzip2.Reader(fd, 1).serial(0):
+                sha.update(data)
+                n += len(data)
+        except (IOError, EOFError):
+            return False
+    return n == size and sha.hexdigest() == digest
+
+
+def pack_bundle(fqbn):
+    """
+    #
+    # Recompress archived bundle 'fqbn' to bzip2 -9, one stream per
+    # 'idxspan' of tar stream, with an index (see lib/GzIndex.py).
+    # The result is only swapped in if it decompresses to the very
+    # same tar stream and is smaller; it takes the place of 'fqbn'
+    # under a .bz2 name once everything naming the bundle has been
+    # repointed (see pack_relink()), and is removed again if that
+    # fails. Returns the bytes saved, or None if the bundle is left
+    # as it is.
+    #
+    """
+    new = pack_name(fqbn)
+    if new != fqbn and os.path.lexists(new):
+        return None
+    try:
+        idx = GzIndex.Index(fqbn)
+        members = idx.members
+        idx.close()
+    except IOError:
+        members = None
+
+    st = os.stat(fqbn)
+    ddir = os.path.dirname(fqbn)
+    fd, tmp = tempfile.mkstemp(prefix='.pack-', dir=ddir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            packer = GzIndex.Packer(f, idxspan or GzIndex.SPAN)
+            ps = Pack_Stream(fqbn, packer)
+            offs = {}
+            try:
+                tf = tarfile.open(fileobj=ps, mode='r|', bufsize=xbufsz)
+                for ti in tf:
+                    if ti.isreg():
+                        offs[ti.name] = [ti.offset_data, ti.size]
+                    elif ti.islnk() and ti.linkname in offs:
+                        offs[ti.name] = offs[ti.linkname]
+                while ps.read(xbufsz):
+                    pass
+            finally:
+                ps.close()
+            packer.close()
+            f.flush()
+            os.fsync(f.fileno())
+
+        if os.path.getsize(tmp) >= st.st_size or \
+           not pack_verify(tmp, ps.sha.hexdigest(), packer.totout):
+            return None
+
+        if members is None:
+            members = dict((GzIndex.member_rel(n), ent)
+                for n, ent in offs.iteritems())
+        packer.write(tmp, members)
+        os.utime(tmp, (st.st_atime, st.st_mtime))
+        own_path(tmp, False)
+        own_path(tmp + '.idx', False)
+        os.rename(tmp + '.idx', new + '.idx')
+        os.rename(tmp, new)
+        tmp = None
+    finally:
+        if tmp is not None:
+            for path in (tmp, tmp + '.idx'):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    if new != fqbn:
+        try:
+            pack_relink(fqbn, new)
+        except:
+            for path in (new, new + '.idx'):
+                if os.path.exists(path):
+                    os.unlink(path)
+            raise
+        os.unlink(fqbn)
+        if os.path.exists(fqbn + '.idx'):
+            os.unlink(fqbn + '.idx')
+    return st.st_size - os.path.getsize(new)
+
+
+def pack_undo(undo):
+    """
+    #
+    # Put back what pack_relink() changed, last change first. 'undo'
+    # holds (path, previous contents, is symlink) records; contents
+    # of None mean 'path' did not exist.
+    #
+    """
+    for path, prev, islink in reversed(undo):
+        try:
+            tmp = path + '.pack-%d' % os.getpid()
+            if prev is None:
+                if os.path.lexists(path):
+                    os.unlink(path)
+                continue
+            if islink:
+                os.symlink(prev, tmp)
+            else:
+                with open(tmp, 'w') as f:
+                    f.write(prev)
+            os.rename(tmp, path)
+        except EnvironmentError:
+            pass
+
+
+def pack_relink(old, new):
+    """
+    #
+    # Bundle 'old' is now 'new': repoint the dedup_bundle() symlinks
+    # to it (renamed to .bz2 as well), its content index entries,
+    # .ingestor_bundle, its bundle index entry and its DB rows. The
+    # old links only go once all of that is done; should any of it
+    # fail, what was repointed is put back and the error raised.
+    #
+    """
+    moved = [(old, new)]
+    undo = []
+    try:
+        for link in glob.glob(os.path.join(clardir, '*', '*')):
+            if os.path.islink(link) and os.readlink(link) == old:
+                dst = pack_name(link)
+                tmp = dst + '.pack-%d' % os.getpid()
+                prev = os.readlink(dst) if os.path.islink(dst) else None
+                undo.append((dst, prev, True))
+                os.symlink(new, tmp)
+                os.rename(tmp, dst)
+                moved.append((link, dst))
+
+        for name in os.listdir(cidxdir) if os.path.isdir(cidxdir) else []:
+            path = os.path.join(cidxdir, name)
+            try:
+                with open(path) as f:
+                    text = f.read()
+                ent = json.loads(text)
+            except (EnvironmentError, ValueError):
+                continue
+            if ent.get('archive') != old:
+                continue
+            ent['archive'] = new
+            undo.append((path, text, False))
+            fd, tmp = tempfile.mkstemp(prefix='.cidx-', dir=cidxdir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(ent, f)
+            os.rename(tmp, path)
+
+            path = os.path.join(ent.get('fqtd', ''), '.ingestor_bundle')
+            if os.path.isfile(path):
+                with open(path) as f:
+                    undo.append((path, f.read(), False))
+                with open(path, 'w') as f:
+                    f.write(new + '\n')
+
+        md = mdx_load(old)
+        if md:
+            md.pop('path', None)
+            mdx_store(new, **md)
+
+        if db_enable:
+            con, cur = db_connect(db_user, db_pass, db_name)
+            sql = 'UPDATE ingestions SET final_fullpath=%s ' + \
+                'WHERE final_fullpath=%s;'
+            try:
+                for src, dst in moved:
+                    db_execute(cur, sql, False, (dst, src))
+                con.commit()
+            except DB.Error:
+                con.rollback()
+                raise
+    except:
+        pack_undo(undo)
+        raise
+
+    for link, dst in moved[1:]:
+        if dst != link:
+            os.unlink(link)
+    return
+
+
+def PackArchive(cc):
+    """
+    # PackArchive
+    #
+    # NZA_Ingestor --recompress
+    #
+    # Recompress the archived bundles that are due (see pack_bundle())
+    # at idle CPU and I/O priority, and report the space saved.
+    """
+    me = whoami()
+    packed = skipped = saved = 0
+
+    #
+    # A bundle that cannot be read is left as it is for good; running
+    # out of space or losing the DB only puts it off to the next pass
+    #
+    transient = (errno.ENOSPC, errno.EDQUOT, errno.ENOMEM)
+    dberrs = (SystemExit, DB.Error) if db_enable else ()
+
+    idle_priority()
+    for fqbn in pack_candidates():
+        try:
+            gain = pack_bundle(fqbn)
+        except (EnvironmentError, tarfile.TarError, zlib.error,
+                EOFError), e:
+            print_warn('%s: not recompressed: %s' % (fqbn, e), True)
+            if getattr(e, 'errno', None) in transient:
+                skipped += 1
+                continue
+            gain = None
+        except dberrs, e:
+            print_warn('%s: not recompressed: DB error %s' % (fqbn, e),
+                True)
+            skipped += 1
+            continue
+        if gain is None:
+            skipped += 1
+            skipped_update(packskp, [fqbn], [])
+            continue
+        packed += 1
+        saved += gain
+        if cc == 'net':
+            print '[%s] recompress: %s (%d bytes saved)' % (now(),
+                pack_name(fqbn), gain)
+            sys.stdout.flush()
+
+    if cc == 'cli':
+        print_bold('%s:\t' % me, 'white', False)
+        print '%d bundles recompressed (%d bytes saved), %d left as is' % \
+            (packed, saved, skipped)
+    return 0
+
+
+def pack_worker():
+    """
+    #
+    # Body of the archive recompression process of the daemon: a
+    # PackArchive() pass every 'packwait' seconds. It is a daemonic
+    # process, which may not start decompression processes of its own.
+    #
+    """
+    global bz2jobs
+
+    bz2jobs = 1
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    ppid = os.getppid()
+    while os.getppid() == ppid:
+        try:
+            PackArchive('net')
+        except Exception, e:
+            print_warn('Archive recompression failed: %s' % e, True)
+        os.chdir(currdir)
+        time.sleep(packwait)
+
+
+def start_packer():
+    """
+    #
+    # Start the daemon's archive recompression process, unless
+    # --no-recompress
+    #
+    """
+    if not packarc:
+        return None
+    p = multiprocessing.Process(target=pack_worker)
+    p.daemon = True
+    p.start()
+    return p
+
+
+def step_from_script(fn):
+    pattern = '^A([0-9]+).*$'
+    mp = re.match(pattern, fn)
+    if (mp):
+        return mp.group(1)
+    return 'No Match'
+
+
+def get_ingestor_scripts():
+    if not os.path.exists(scrpdir):
+        print scrpdir, "MUST exist and contain the ingestion scripts"
+        stop(9)
+
+    scripts = []
+    pattern = '^(A[1-9]+.*\.(sh|py|php))$'
+    for i in sorted(os.listdir(scrpdir)):
+        mp = re.match(pattern, i)
+        if mp:
+            scripts.append(mp.group(1))
+
+    return scripts
+
+
+def script_tiers(scripts):
+    """
+    #
+    # Group scripts by their A-tier, in ascending tier order;
+    # within a tier the sorted (name) order is preserved.
+    #
+    """
+    tiers = {}
+    for s in scripts:
+        tiers.setdefault(int(step_from_script(s)), []).append(s)
+
+    return [(t, tiers[t]) for t in sorted(tiers)]
+
+
+def py_runnable(fqsn):
+    """
+    #
+    # Can script 'fqsn' be run by py_run(): an executable Python
+    # script defining main()
+    #
+    """
+    if not (fqsn.endswith('.py') and os.access(fqsn, os.X_OK)):
+        return False
+    with open(fqsn, 'r') as f:
+        return re.search('^def\s+main\s*\(', f.read(), re.M) is not None
+
+
+def py_load(name, fqsn):
+    """
+    #
+    # Load Python source 'fqsn' as module 'name', as imp.load_source()
+    # would, minus the .pyc files it and the imports of 'fqsn' drop
+    # in the scripts dir.
+    #
+    """
+    with open(fqsn, 'r') as f:
+        code = compile(f.read(), fqsn, 'exec')
+    mod = imp.new_module(name)
+    mod.__file__ = fqsn
+    sys.modules[name] = mod
+    dwb, sys.dont_write_bytecode = sys.dont_write_bytecode, True
+    try:
+        exec code in mod.__dict__
+    except:
+        sys.modules.pop(name, None)
+        raise
+    finally:
+        sys.dont_write_bytecode = dwb
+    return mod
+
+
+def py_preload():
+    """
+    #
+    # Load the modules ingestion scripts share (scrpdir/functions.py)
+    # into this process (again if it changed), so every forked py_run()
+    # child starts with them in place.
+    #
+    """
+    fns = os.path.join(scrpdir, 'functions.py')
+    try:
+        mt = os.stat(fns).st_mtime
+    except OSError:
+        return
+    if pymods.get(fns) != mt:
+        py_load('functions', fns)
+        pymods[fns] = mt
+
+
+def py_detach():
+    """
+    #
+    # Turn this (forked) process into what the shell would have run a
+    # script as: default signals, ingestion owner, output discarded.
+    #
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    as_ingest_owner()
+
+    fd = os.open(os.devnull, os.O_RDWR)
+    for i in (0, 1, 2):
+        os.dup2(fd, i)
+    os.close(fd)
+
+
+def py_main(fqsn, bdir):
+    """
+    #
+    # Run main() of Python ingestion script 'fqsn' on bundle dir 'bdir'
+    # in this process. Returns the exit status the script would have
+    # had as a program of its own.
+    #
+    """
+    code = 1
+    sys.argv = [fqsn, bdir]
+    sys.dont_write_bytecode = True      # nor for what the script imports
+    if scrpdir not in sys.path:
+        sys.path.insert(0, scrpdir)
+    try:
+        mod = py_load('ingestion_script', fqsn)
+        mod.main(bdir)
+        code = 0
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code & 0xff
+        else:
+            sys.stderr.write(str(e.code) + '\n')
+    except:
+        traceback.print_exc()
+    finally:
+        sys.modules.pop('ingestion_script', None)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return code
+
+
+def py_run(s, fqsn):
+    """
+    #
+    # Child side of an in-process script run: behave as if the shell
+    # had run 'fqsn fqtd > /dev/null 2>&1', i.e. same argv, cwd,
+    # owner, output and exit status, minus the shell and the fresh
+    # interpreter. Never returns.
+    #
+    """
+    code = 1
+    try:
+        py_detach()
+        code = py_main(fqsn, fqtd)
+    finally:
+        os._exit(code)
+
+
+#
+# Script Zygote Helper Functions
+#
+def script_wait(pid):
+    """
+    #
+    # wait4() for script process 'pid', for the resource usage of the
+    # script and everything it waited for. Returns (status, rusage),
+    # status being its exit code or minus the signal that killed it.
+    #
+    """
+    while True:
+        try:
+            wpid, status, ru = os.wait4(pid, 0)
+            break
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status), ru
+    return os.WEXITSTATUS(status), ru
+
+
+class Script_Zygote(object):
+    """
+    #
+    # Warm workers for Python ingestion scripts. The zygote is forked
+    # off the daemon with functions.py loaded on top of what the
+    # ingestor itself imports (json, re, tarfile, ...), listens on
+    # unix socket 'path' and keeps 'nwrk' workers forked from itself
+    # accepting on it. A worker forks one child per connection off
+    # its preloaded self to run the script in (see py_main()), so no
+    # script sees what another left behind, and exits after 'maxjobs'
+    # of them; the zygote forks a fresh one in its place. The zygote
+    # goes away with the process that started it.
+    #
+    """
+    def __init__(self, path, nwrk, maxjobs):
+        self.path = path
+        self.nwrk = nwrk
+        self.maxjobs = maxjobs
+        self.pid = 0
+        self.ppid = 0
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        sk = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sk.bind(self.path)
+        os.chmod(self.path, 0600)
+        sk.listen(max(16, 4 * self.nwrk))
+
+        py_preload()
+        self.ppid = os.getpid()
+        self.pid = os.fork()
+        if self.pid == 0:
+            code = 1
+            try:
+                self.zygote(sk)
+                code = 0
+            except SystemExit:
+                code = 0
+            except:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+
+        sk.close()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if os.getpid() != self.ppid or not self.pid:
+            return
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+        self.pid = 0
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def zygote(self, sk):
+        def term(signum, frame):
+            raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, term)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        wrks = set()
+
+        try:
+            while os.getppid() == self.ppid:
+                while True:
+                    try:
+                        pid, sts = os.waitpid(-1, os.WNOHANG)
+                    except OSError:
+                        break
+                    if pid == 0:
+                        break
+                    wrks.discard(pid)
+
+                while len(wrks) < self.nwrk:
+                    pid = os.fork()
+                    if pid == 0:
+                        self.worker(sk)
+                    wrks.add(pid)
+
+                time.sleep(1)           # cut short by SIGCHLD
+        finally:
+            for pid in wrks:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+    def worker(self, sk):
+        """
+        #
+        # Serve up to 'maxjobs' requests, one JSON line each naming
+        # the script, bundle dir, cwd and niceness of the submitter,
+        # which the script is run at. Each runs in a child of its
+        # own, which takes whatever the script changes (globals,
+        # sys.path, cwd, environment) with it when it exits; answer
+        # with its exit status (see script_wait()) and resource usage.
+        # Never returns.
+        #
+        """
+        try:
+            py_detach()
+            for n in range(self.maxjobs):
+                conn, addr = sk.accept()
+                try:
+                    req = json.loads(conn.makefile('rb').readline())
+                    py_preload()
+                    pid = os.fork()
+                    if pid == 0:
+                        code = 1
+                        try:
+                            sk.close()
+                            conn.close()
+                            nice = req.get('nice', 0) - os.nice(0)
+                            if nice > 0:
+                                os.nice(nice)
+                            os.chdir(str(req['cwd']))
+                            code = py_main(str(req['script']),
+                                str(req['bdir']))
+                        finally:
+                            os._exit(code)
+                    sts, ru = script_wait(pid)
+                    conn.sendall(json.dumps({'rc': sts,
+                        'ru': list(ru)}) + '\n')
+                finally:
+                    conn.close()
+        finally:
+            os._exit(0)
+
+    def submit(self, fqsn, bdir):
+        """
+        #
+        # Hand 'fqsn' on 'bdir' to a worker, to run at the niceness of
+        # this process (a bulk lane worker's, say); returns the
+        # connection its reply comes back on, or None when the zygote
+        # is unavailable.
+        #
+        """
+        sk = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sk.connect(self.path)
+            sk.sendall(json.dumps({'script': fqsn, 'bdir': bdir,
+                'cwd': os.getcwd(), 'nice': os.nice(0)}) + '\n')
+        except socket.error:
+            sk.close()
+            return None
+        return sk
+
+
+def zygote_reply(conn):
+    """
+    #
+    # (exit status, rusage) read off a Script_Zygote.submit() connection;
+    # a worker that died before it could answer reports 1 and no usage.
+    #
+    """
+    try:
+        rep = json.loads(conn.makefile('rb').readline())
+        return rep['rc'], resource.struct_rusage(rep['ru'])
+    except (socket.error, ValueError, KeyError, TypeError):
+        return 1, resource.struct_rusage([0] * 16)
+    finally:
+        conn.close()
+
+
+def start_zygote(nwrk):
+    """
+    #
+    # Start the Script_Zygote of this (daemon) process with 'zygwrks'
+    # workers, 'nwrk' if not set, unless Python scripts are run
+    # through the shell
+    #
+    """
+    global zygote
+
+    if zygwrks is not None:
+        nwrk = zygwrks
+    if not pyinproc or nwrk < 1:
+        return
+    path = '%s.zygote.%d' % (sysfile, os.getpid())
+    zygote = Script_Zygote(path, nwrk, zygjobs)
+    try:
+        zygote.start()
+    except (OSError, socket.error) as e:
+        print_warn('Script zygote not started: %s' % e, True)
+        zygote = None
+
+
+def script_launch(s, cq):
+    """
+    #
+    # Start ingestion script 's' on the current bundle and post
+    # (s, exit status, rusage) to completion queue 'cq' once it exits.
+    # Python scripts with a main() run on a warm Script_Zygote worker
+    # if there is one, else in a forked child of this process (see
+    # py_run()); everything else runs through the shell.
+    #
+    """
+    dnr = ' > /dev/null 2>&1'
+    fqsn = os.path.join(scrpdir, s)
+    cmd = "".join([fqsn, ' ', fqtd, dnr])
+    p = None
+    conn = None
+    pyok = pyinproc and py_runnable(fqsn)
+    if pyok and zygote is not None:
+        conn = zygote.submit(fqsn, fqtd)
+
+    if conn is None and pyok:
+        py_preload()
+        pid = os.fork()
+        if pid == 0:
+            py_run(s, fqsn)
+    elif conn is None:
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE, shell=True,
+            close_fds=True, preexec_fn=as_ingest_owner)
+        pid = p.pid
+
+    def reap():
+        #
+        # script_wait() rather than p.wait(), for the resource usage
+        # of the script and everything it waited for
+        #
+        sts, ru = script_wait(pid)
+        if p is not None:
+            p.returncode = sts
+        return sts, ru
+
+    def waiter():
+        if conn is not None:
+            sts, ru = zygote_reply(conn)
+        else:
+            sts, ru = reap()
+
+        if sts != 0 and dbginfo:
+            print_debug('** %s = %s **' % (cmd, sts), True)
+        cq.put((s, sts, ru))
+
+    t = threading.Thread(target=waiter)
+    t.daemon = True
+    t.start()
+
+
+def script_headers(s):
+    """
+    #
+    # Collect the '# requires:' and '# produces:' header comments of
+    # ingestion script 's'. Entries are paths relative to the bundle
+    # directory; a trailing '/' denotes a directory. Returns None for
+    # 'requires' when the script declares no such header at all.
+    #
+    """
+    pattern = '^\s*(?:#|//)\s*(requires|produces):(.*)$'
+    hdrs = {'requires': None, 'produces': []}
+
+    with open(os.path.join(scrpdir, s), 'r') as f:
+        for n, l in enumerate(f):
+            if n >= 64:
+                break
+            mp = re.match(pattern, l)
+            if mp:
+                if hdrs[mp.group(1)] is None:
+                    hdrs[mp.group(1)] = []
+                hdrs[mp.group(1)].extend(mp.group(2).split())
 
+    return hdrs['requires'], hdrs['produces']
 
-def step_from_script(fn):
-    pattern = '^A([0-9]+).*$'
-    mp = re.match(pattern, fn)
-    if (mp):
-        return mp.group(1)
-    return 'No Match'
 
+def script_satisfies(prod, req):
+    return req == prod or (prod.endswith('/') and req.startswith(prod))
 
-def get_ingestor_scripts():
-    if not os.path.exists(scrpdir):
-        print scrpdir, "MUST exist and contain the ingestion scripts"
-        stop(9)
 
-    scripts = []
-    pattern = '^(A[1-9]+.*)$'
-    for i in sorted(os.listdir(scrpdir)):
-        mp = re.match(pattern, i)
-        if mp:
-            scripts.append(mp.group(1))
+def script_dag(scripts):
+    """
+    #
+    # Build the script dependency graph. A script that declares
+    # '# requires:' depends only on the scripts whose '# produces:'
+    # entries satisfy its requirements; one that does not keeps the
+    # tier semantics and depends on every script of a lower A-tier.
+    # Returns {script: set(predecessors)}, or None on a cycle.
+    #
+    """
+    tier = dict((s, int(step_from_script(s))) for s in scripts)
+    hdrs = dict((s, script_headers(s)) for s in scripts)
+    deps = {}
+
+    for s in scripts:
+        reqs = hdrs[s][0]
+        if reqs is None:
+            deps[s] = set(p for p in scripts if tier[p] < tier[s])
+            continue
+
+        deps[s] = set()
+        for p in scripts:
+            if p == s:
+                continue
+            for r in reqs:
+                if [q for q in hdrs[p][1] if script_satisfies(q, r)]:
+                    deps[s].add(p)
+                    break
 
-    return scripts
+    #
+    # Kahn's algorithm; anything left over sits on a cycle.
+    #
+    left = dict((s, len(deps[s])) for s in scripts)
+    ready = [s for s in scripts if left[s] == 0]
+    seen = 0
+    while ready:
+        p = ready.pop()
+        seen += 1
+        for s in scripts:
+            if p in deps[s]:
+                left[s] -= 1
+                if left[s] == 0:
+                    ready.append(s)
+
+    if seen != len(scripts):
+        return None
+    return deps
 
 
-def nukedir(path):
-    # remove all files
+def script_deps(scripts):
+    """
+    #
+    # script_dag(), or plain A-tier ordering if the headers are cyclic
+    #
+    """
+    deps = script_dag(scripts)
+    if deps is None:
+        print_warn('Cyclic requires/produces headers; using A-tiers', True)
+        deps = {}
+        for s in scripts:
+            deps[s] = set(p for p in scripts
+                if int(step_from_script(p)) < int(step_from_script(s)))
+    return deps
+
+
+def critical_path(scripts, deps):
+    """
+    #
+    # Length of the longest (costliest) path from each script to the
+    # end of the graph, itself included. Costs are the last observed
+    # run times of the scripts in this process, 1s if never seen.
+    #
+    """
+    succs = dict((s, [t for t in scripts if s in deps[t]]) for s in scripts)
+    prio = {}
+
+    def walk(s):
+        if s not in prio:
+            tail = max([walk(t) for t in succs[s]] or [0])
+            prio[s] = scrcost.get(s, 1.0) + tail
+        return prio[s]
+
+    for s in scripts:
+        walk(s)
+    return prio
+
+
+def script_usage(s, sts, wall, ru):
+    """
+    #
+    # Activity log record of one script run. maxrss is in KB (Linux),
+    # blocks are file system input/output operations.
+    #
+    """
+    return {'script': s, 'rc': sts, 'wall': round(wall, 6),
+        'utime': round(ru.ru_utime, 6), 'stime': round(ru.ru_stime, 6),
+        'maxrss': ru.ru_maxrss, 'inblock': ru.ru_inblock,
+        'oublock': ru.ru_oublock}
+
+
+def usage_summary(recs, wall):
+    """
+    #
+    # Bundle level totals of the script_usage() records in 'recs'
+    #
+    """
+    top = sorted(recs, key=lambda r: r['wall'], reverse=True)
+    return {'scripts': len(recs), 'wall': round(wall, 6),
+        'utime': round(sum(r['utime'] for r in recs), 6),
+        'stime': round(sum(r['stime'] for r in recs), 6),
+        'maxrss': max([r['maxrss'] for r in recs] or [0]),
+        'inblock': sum(r['inblock'] for r in recs),
+        'oublock': sum(r['oublock'] for r in recs),
+        'slowest': [(r['script'], r['wall']) for r in top[:3]]}
+
+
+def run_scripts(scripts, act):
+    """
+    #
+    # Run the ingestion scripts as a DAG (see script_dag()): as soon
+    # as all of a script's predecessors have exited it becomes ready,
+    # and ready scripts are started in critical path order, at most
+    # 'scrjobs' at a time. Yields (script, exit status) as each one
+    # of them exits. Every exit is followed by a 'usage' record in
+    # Activity_Log 'act', and the last one by a 'summary' record.
+    #
+    """
+    deps = script_deps(scripts)
+    prio = critical_path(scripts, deps)
+
+    cq = Queue.Queue()
+    left = dict((s, len(deps[s])) for s in scripts)
+    ready = [s for s in scripts if left[s] == 0]
+    started = {}
+    rcs = {}
+    recs = []
+    active = 0
+    t0 = monotime()
+
+    while ready or active:
+        ready.sort(key=lambda s: prio[s])
+        while ready and active < scrjobs:
+            s = ready.pop()
+            act.write('|' + s + '|started\n')
+            started[s] = monotime()
+            script_launch(s, cq)
+            active += 1
+
+        s, sts, ru = cq.get()
+        active -= 1
+        rcs[s] = sts
+        scrcost[s] = monotime() - started[s]
+        act.write('|' + s + '|done|' + str(sts) + '\n')
+        recs.append(script_usage(s, sts, scrcost[s], ru))
+        act.write('|' + s + '|usage|' +
+            json.dumps(recs[-1], sort_keys=True) + '\n')
+
+        for t in scripts:
+            if s in deps[t]:
+                left[t] -= 1
+                if left[t] == 0:
+                    ready.append(t)
+
+        if not (ready or active):
+            sumry = usage_summary(recs, monotime() - t0)
+            act.write('|summary|' + json.dumps(sumry, sort_keys=True) + '\n')
+
+        yield s, sts
+
+
+#
+# Script Fingerprint Helper Functions
+#
+def path_digest(h, path):
+    """
+    #
+    # Feed (name, size, mtime) of 'path', and of everything below it
+    # if it is a directory, to hash object 'h'
+    #
+    """
+    if not os.path.isdir(path):
+        try:
+            st = os.stat(path)
+            h.update('%s\0%d\0%d\n' % (path, st.st_size, st.st_mtime))
+        except OSError:
+            h.update('%s\0-\n' % path)
+        return
+
     for dirname, subdirs, files in os.walk(path):
+        subdirs.sort()
+        for name in sorted(files):
+            path_digest(h, os.path.join(dirname, name))
+
+
+def script_fingerprint(s, inputs):
+    """
+    #
+    # Fingerprint of a run of script 's' on the current bundle: its
+    # own content, that of the shared functions file it sources and
+    # the state of the bundle files in 'inputs'
+    #
+    """
+    h = hashlib.sha1()
+    fqsn = os.path.join(scrpdir, s)
+    fns = os.path.join(scrpdir, 'functions' + os.path.splitext(s)[1])
+    for f in (fqsn, fns):
+        if os.path.isfile(f):
+            with open(f, 'rb') as fd:
+                h.update(hashlib.sha1(fd.read()).hexdigest())
+    for i in sorted(inputs):
+        path_digest(h, os.path.join(fqtd, i))
+    return h.hexdigest()
+
+
+def script_fingerprints(scripts):
+    """
+    #
+    # {script: fingerprint}. Only inputs straight from the bundle are
+    # looked at; what other scripts produce is covered by rerunning
+    # everything downstream of a script that reruns.
+    #
+    """
+    hdrs = dict((s, script_headers(s)) for s in scripts)
+    prods = [q for s in scripts for q in hdrs[s][1]]
+    fps = {}
+    for s in scripts:
+        reqs = [r for r in hdrs[s][0] or []
+            if not [q for q in prods if script_satisfies(q, r)]]
+        fps[s] = script_fingerprint(s, reqs)
+    return fps
+
+
+def fingerprints_load(fpfile):
+    """
+    #
+    # {script: {'fp': fingerprint, 'rc': exit status}} of the run
+    # recorded in 'fpfile', or None if there is no usable record
+    #
+    """
+    try:
+        with open(fpfile) as f:
+            old = json.load(f)
+    except (EnvironmentError, ValueError):
+        return None
+    return old if isinstance(old, dict) else None
+
+
+def incremental_plan(scripts, fpfile):
+    """
+    #
+    # Scripts an incremental reingest has to run: those whose
+    # fingerprint changed since the run recorded in 'fpfile' and all
+    # scripts downstream of them. Returns (rerun, fingerprints, old
+    # records), or None when a full reingest is needed as there is
+    # no usable record.
+    #
+    """
+    old = fingerprints_load(fpfile)
+    if old is None:
+        return None
+
+    deps = script_deps(scripts)
+    fps = script_fingerprints(scripts)
+    changed = set(s for s in scripts
+        if s not in old or old[s]['fp'] != fps[s])
+    rerun = set(changed)
+    grown = True
+    while grown:
+        more = set(s for s in scripts if deps[s] & rerun) - rerun
+        rerun |= more
+        grown = bool(more)
+
+    return rerun, fps, old
+
+
+def nukedir(path):
+    # remove everything below 'path', deepest first
+    for dirname, subdirs, files in os.walk(path, topdown=False):
         for name in files:
             fullname = os.path.join(dirname, name)
             if dbginfo:
@@ -780,19 +3766,107 @@ def nukedir(path):
                 print fullname
             os.unlink(fullname)
 
-    # remove all subdirs
-    for sd in subdirs:
-        fullsub = os.path.join(dirname, sd)
-        if dbginfo: 
-            print_warn('Removing dir:', False)
-            print fullsub
-        os.rmdir(fullsub)
+        for sd in subdirs:
+            fullsub = os.path.join(dirname, sd)
+            if dbginfo:
+                print_warn('Removing dir:', False)
+                print fullsub
+            if os.path.islink(fullsub):
+                os.unlink(fullsub)
+            else:
+                os.rmdir(fullsub)
 
     # remove 'path'
     if dbginfo:
         print_bold('Removing dir:', 'green', False)
-        print dirname
-    os.rmdir(dirname)
+        print path
+    os.rmdir(path)
+
+
+#
+# Trash Helper Functions
+#
+class Trash_Reaper(object):
+    """
+    #
+    # Low priority threads deleting the trees handed to them, so a
+    # reingest need not wait for the previous run's output to go.
+    #
+    """
+    def __init__(self, nthreads):
+        self.q = Queue.Queue()
+        self.threads = []
+        for i in range(nthreads):
+            t = threading.Thread(target=self.run)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def put(self, path):
+        self.q.put(path)
+
+    def run(self):
+        if OS == 'Linux':
+            os.nice(19)                 # per thread on Linux
+        while True:
+            path = self.q.get()
+            try:
+                nukedir(path)
+            except OSError as e:
+                if dbginfo:
+                    print_warn('Cannot remove %s: %s' % (path, e), True)
+            self.q.task_done()
+
+    def wait(self):
+        self.q.join()
+
+
+def trash_reaper():
+    """
+    #
+    # This process' Trash_Reaper; a forked worker starts its own
+    #
+    """
+    global trshq
+
+    if trshq is None or not trshq.threads[0].is_alive():
+        trshq = Trash_Reaper(trshjobs)
+        atexit.register(trshq.wait)
+    return trshq
+
+
+def trash(path):
+    """
+    #
+    # Atomically move 'path' out of the way into 'trshdir' (same file
+    # system as everything in 'ingested') and have it deleted in the
+    # background.
+    #
+    """
+    if not os.path.isdir(trshdir):
+        try:
+            os.mkdir(trshdir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    dst = tempfile.mkdtemp(prefix=os.path.basename(path) + '.', dir=trshdir)
+    os.rename(path, os.path.join(dst, os.path.basename(path)))
+    trash_reaper().put(dst)
+    return
+
+
+def reap_trash():
+    """
+    #
+    # Delete whatever an earlier run left in 'trshdir' (crash, kill)
+    #
+    """
+    if not os.path.isdir(trshdir):
+        return
+    for name in os.listdir(trshdir):
+        trash_reaper().put(os.path.join(trshdir, name))
+    return
 
 
 def ingest_scripts():
@@ -800,66 +3874,93 @@ def ingest_scripts():
     global OS
     global db_enable
 
-    owner = 'ftp'
-    usrid = pwd.getpwnam(owner).pw_uid
-    group = 'nexentians'
-    grpid = 10
-    try:
-        grpid = grp.getgrnam(group).gr_gid
-    except KeyError:
-        group = 'staff'
-        grpid = grp.getgrnam(group).gr_gid
-    fmode = 0660
-    dmode = 0770
     ing_dir = os.path.join(fqtd, 'ingestor')
     ing_lgs = os.path.join(fqtd, '.ingestor_logs')
     act_log = os.path.join(fqtd, '.ingestor_activity_log')
+    fp_file = os.path.join(fqtd, '.ingestor_fingerprints')
 
-    if os.path.exists(ing_dir):
-        nukedir(ing_dir)
-    if os.path.exists(ing_lgs):
-        nukedir(ing_lgs)
-    if os.path.exists(act_log):
-        os.unlink(act_log)
+    tiers = script_tiers(get_ingestor_scripts())
+    scripts = [s for t, ts in tiers for s in ts]
+    rcs = {}
 
     #
-    # Execute all ingestor scripts in scrpdir
+    # An incremental reingest keeps the previous run's output and
+    # only reruns the scripts whose fingerprint changed (and what
+    # depends on them), after removing the files they produce.
     #
-    os.chdir(scrpdir)
-    for s in get_ingestor_scripts():
-        log(act_log, '|' + s + '|started\n')
-        try:
-            os.mkdir(ing_lgs)
-        except OSError as e:
-            pass
-
-        dnr = ' > /dev/null 2>&1'
-        fqsn = os.path.join(scrpdir, s)
-        cmd = "".join([fqsn, ' ', fqtd, dnr])
-        sts = subprocess.call(cmd, stdin=subprocess.PIPE, shell=True)
-        if sts != 0 and dbginfo:
-            print_debug('** %s = %s **' % (cmd, sts), True)
-        log(act_log, '|' + s + '|done|' + str(sts) + '\n')
-
-        if db_enable and OS == 'Linux':
-            if sts == 0 and db_actn == 'update':
-                step = step_from_script(s)
-                if step != 'No Match':
-                    db_update_entry('ingestions', db_indx, step)
+    plan = incremental_plan(scripts, fp_file) if incrmtl else None
+    if plan is not None:
+        rerun, fps, old = plan
+        for s in scripts:
+            if s not in rerun:
+                rcs[s] = old[s]['rc']
+            elif not script_headers(s)[1]:
+                print_warn('%s declares no outputs (\'# produces:\'); ' \
+                    'whatever it wrote before is left in place' % s, True)
+            else:
+                for q in script_headers(s)[1]:
+                    path = os.path.join(fqtd, q)
+                    if not q.endswith('/') and os.path.lexists(path):
+                        os.unlink(path)
+    else:
+        if incrmtl:
+            print_warn('No usable fingerprints; doing a full reingest', True)
+        rerun, fps, old = set(scripts), script_fingerprints(scripts), {}
+        if os.path.exists(ing_dir):
+            trash(ing_dir)
+        if os.path.exists(ing_lgs):
+            trash(ing_lgs)
+        if os.path.exists(act_log):
+            os.unlink(act_log)
 
     #
-    # Everything should be owned by owner:group,
-    # dirs should be 770 and regular files 660
+    # Execute all ingestor scripts in scrpdir, scheduled by their
+    # declared dependencies (see run_scripts()). Scripts run as the
+    # bundle owner (see as_ingest_owner()), so whatever they create
+    # needs no fixing up afterwards.
     #
-    for dirname, subdirs, files in os.walk(fqtd):
-        os.chown(dirname, usrid, grpid)
-        os.chmod(dirname, dmode)
-        for name in files:
-            fullname = os.path.join(dirname, name)
-            os.chown(fullname, usrid, grpid)
-            os.chmod(fullname, fmode)
-
-    log(act_log, '|finished|\n')
+    os.chdir(scrpdir)
+    try:
+        os.mkdir(ing_lgs)
+        own_path(ing_lgs, True)
+    except OSError as e:
+        pass
+    act = Activity_Log(act_log)
+    own_path(act_log, False)
+
+    def reached():
+        #
+        # A tier counts as reached once it and all lower tiers are
+        # done and any of its scripts succeeded, which is the same
+        # last successful step a serial run would have recorded.
+        #
+        while tiers and not [x for x in tiers[0][1] if x not in rcs]:
+            tier, ts = tiers.pop(0)
+            if db_enable:
+                if [x for x in ts if rcs[x] == 0]:
+                    db_update_entry('ingestions', db_indx, str(tier))
+
+    for s in scripts:
+        if s not in rerun:
+            act.write('|' + s + '|unchanged|' + str(rcs[s]) + '\n')
+    reached()
+
+    for s, rc in run_scripts([s for s in scripts if s in rerun], act):
+        rcs[s] = rc
+        reached()
+
+    fpr = dict((s, {'fp': fps[s], 'rc': rcs[s]}) for s in scripts)
+    with open(fp_file + '.tmp', 'w') as f:
+        json.dump(fpr, f, indent=1, sort_keys=True)
+    own_path(fp_file + '.tmp', False)
+    os.rename(fp_file + '.tmp', fp_file)
+
+    if db_enable:
+        db_flush()
+    sts = rcs[scripts[-1]] if scripts else 0
+
+    act.write('|finished|\n')
+    act.close()
     return sts
 
 
@@ -870,7 +3971,7 @@ def ingest_bundle(cc):
     global OS
     global db_enable
 
-    if db_enable and OS == 'Linux':
+    if db_enable:
         global db_actn
 
     status = 0
@@ -893,8 +3994,10 @@ def ingest_bundle(cc):
         os.rename(jinged, jinged_at)
 
         log(ing_started, '\n')
+        own_path(ing_started, False)
         rc = ingest_scripts()
         log(ing_finished, '\n')
+        own_path(ing_finished, False)
 
         if rc == 0:
             if cc == 'cli':
@@ -913,11 +4016,11 @@ def ingest_bundle(cc):
             tcpresp = errmsg + tard
             status = 1
 
-    if db_enable and OS == 'Linux':
+    if db_enable:
         if db_actn == 'insert':
-            db_new_entry()
-        else:
-            db_print('ingestions', 'id', db_indx)
+            db_update_entry('ingestions', db_indx, '9')
+            db_flush()
+        db_print('ingestions', 'id', db_indx)
 
     return status
 
@@ -999,13 +4102,21 @@ def Reingest(fpath, cc):
     # Reingest
     #
     # NZA_Ingestor --reingest { foo.tar.gz | /fully/qualified/path/to/bundle }
+    #
+    # With --incremental, an archived bundle is only extracted again
+    # if its last run left nothing to work on (see incremental_dir()).
     """
     if cc == 'cli':
         print_bold('%sing:\t' % whoami(), 'white', False)
         print '\"%s\"' % fpath
 
     bundle = fqcb(fpath, cc)
-    extract_bundle(bundle, cc)
+    if incrmtl and incremental_dir(bundle, cc) is not None:
+        if ingest_prep(cc, True) is None:
+            return 1
+        return ingest_bundle(cc)
+    if extract_bundle(bundle, cc) is None:
+        return 1
     return ingest_bundle(cc)
 
 
@@ -1014,16 +4125,130 @@ def Ingest(fpath, cc):
     # Ingest
     #
     # NZA_Ingestor --ingest { foo.tar.gz | /fully/qualified/path/to/bundle }
+    #
+    # A bundle with the contents of one ingested before is only linked
+    # to that ingestion (see dedup_bundle()).
     """
     if cc == 'cli':
         print_bold('%sing:\t' % whoami(), 'white', False)
         print '\"%s\"' % fpath
 
     bundle = fqcb(fpath, cc)
-    extract_bundle(bundle, cc)
+    if dedup_bundle(bundle, cc):
+        return 0
+    if extract_bundle(bundle, cc) is None:
+        return 1
     return ingest_bundle(cc)
 
 
+def bundle_xdir(fqbn):
+    """
+    #
+    # (fqbn, size, mtime, ingestion dir) of a bundle; the dir is None
+    # if it cannot be derived. Runs in a multiprocessing.Pool worker,
+    # which may not start decompression processes of its own.
+    #
+    """
+    global bz2jobs
+
+    bz2jobs = 1
+    st = os.stat(fqbn)
+    try:
+        xdir = derive_xdir(fqbn, 'net')
+        ddir = os.path.join(ingddir, fmt_time(cs_date, 'ymd'), xdir)
+    except (SystemExit, Exception):
+        ddir = None
+    return fqbn, st.st_size, st.st_mtime, ddir
+
+
+def IngestDir(dpath, njobs):
+    """
+    # IngestDir
+    #
+    # NZA_Ingestor --ingest-dir /path/to/bundles [ --jobs N ]
+    #
+    # Ingest every compressed bundle in 'dpath' on 'njobs' workers.
+    # Bundles that derive the same ingestion dir are ingested once
+    # (the most recent upload wins), and the largest bundles go
+    # first so a big one started late does not dominate the total.
+    """
+    global bz2jobs
+
+    me = whoami()
+    names = sorted(os.listdir(dpath))
+    fqbns = [os.path.join(dpath, n) for n in names
+        if is_compressed(n) and os.path.isfile(os.path.join(dpath, n))]
+    print_bold('%s:\t' % me, 'white', False)
+    print '%d bundles in \"%s\"' % (len(fqbns), dpath)
+    if not fqbns:
+        return 0
+
+    start_zygote(njobs * scrjobs)
+    p = multiprocessing.Pool(njobs)
+    try:
+        found = p.map(bundle_xdir, fqbns, 1)
+    finally:
+        p.terminate()
+        p.join()
+
+    bydir = {}
+    for fqbn, size, mtime, ddir in found:
+        if ddir is None:
+            print_warn('Not a collector bundle, skipped: %s' % fqbn, True)
+            continue
+        b = (fqbn, size, mtime)
+        prev = bydir.get(ddir)
+        if prev is not None:
+            keep, skip = (prev, b) if prev[2] >= mtime else (b, prev)
+            print_lite('Same ingestion dir as %s, skipped: %s' %
+                (keep[0], skip[0]), 'yellow', True)
+            b = keep
+        bydir[ddir] = b
+
+    todo = sorted(bydir.values(), key=lambda b: b[1], reverse=True)
+
+    #
+    # Every worker runs its own bzip2 decompressors; share the CPUs
+    #
+    bz2jobs = max(1, bz2jobs // njobs)
+
+    lock = threading.Lock()
+    alldone = threading.Event()
+    done = []
+    good = []
+
+    def finished(b, reply, sts):
+        with lock:
+            done.append(b)
+            if sts == 0:
+                good.append(b)
+            print '[%d/%d] %s' % (len(done), len(todo), reply)
+            sys.stdout.flush()
+            if len(done) == len(todo):
+                alldone.set()
+
+    pool = Ingest_Worker_Pool(njobs, len(todo))
+    t0 = time.time()
+    try:
+        for b in todo:
+            pool.submit('ingest ' + b[0],
+                lambda jid, reply, sts, b=b: finished(b, reply, sts))
+        while not alldone.wait(1):
+            pass
+    finally:
+        pool.shutdown()
+
+    secs = max(time.time() - t0, 1e-3)
+    nbytes = sum(size for fqbn, size, mtime in good)
+
+    print_bold('%s:\t' % me, 'white', False)
+    print '%d of %d bundles ingested in %s' % (len(good), len(todo),
+        time.strftime('%H:%M:%S', time.gmtime(secs)))
+    print_pass('%.1f bundles/min, %.2f GB/min' % (len(good) * 60 / secs,
+        nbytes / float(1 << 30) * 60 / secs))
+    return 0 if len(good) == len(todo) else 1
+
+
 def daemonize(pidf, stdin='/dev/null', stdout='/dev/null', stderr='/dev/null'):
     #
     # Only one instance allowed
@@ -1079,24 +4304,229 @@ def daemonize(pidf, stdin='/dev/null', stdout='/dev/null', stderr='/dev/null'):
     signal.signal(signal.SIGTERM, sigterm_handler)
 
 
-def start_svc():
+#
+# Upload Watcher Helper Functions
+#
+class Inotify(object):
+    """
+    #
+    # Minimal inotify(7) binding: watch one directory and read back
+    # (mask, name) events. Linux only.
+    #
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_Q_OVERFLOW = 0x00004000
+    IN_NONBLOCK = 0x00000800
+    IN_CLOEXEC = 0x00080000
+
+    def __init__(self, path, mask):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        if libc.inotify_add_watch(self.fd, path, mask) < 0:
+            e = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(e, '%s: %s' % (path, os.strerror(e)))
+
+    def fileno(self):
+        return self.fd
+
+    def events(self):
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        evs = []
+        i = 0
+        while i + 16 <= len(buf):
+            wd, mask, cookie, nlen = struct.unpack('iIII', buf[i:i + 16])
+            evs.append((mask, buf[i + 16:i + 16 + nlen].rstrip('\0')))
+            i += 16 + nlen
+        return evs
+
+
+class Upload_Watcher(object):
+    """
+    #
+    # Feed bundles showing up in 'path' to the ingestion worker pool,
+    # instead of waiting for the ftp server to tell us about them.
+    # A bundle is handed over once it has been closed after writing
+    # (or renamed into place) and then left alone, same size and
+    # mtime, for 'quiet' seconds; a resumed or re-sent upload just
+    # pushes that out. Bundles already there at start-up, or left
+    # unseen by an event queue overflow, are picked up by a scan.
+    # 'pool' must be set before run().
+    #
+    """
+    def __init__(self, path, quiet):
+        self.path = path
+        self.pool = None
+        self.quiet = quiet
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.inflight = set()
+        self.ino = Inotify(path, Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO)
+
+    def note(self, name):
+        if name.startswith('.') or not is_compressed(name):
+            return
+        fqbn = os.path.join(self.path, name)
+        try:
+            st = os.stat(fqbn)
+        except OSError:
+            return
+        self.pending[fqbn] = (time.time() + self.quiet, st.st_size,
+            st.st_mtime)
+
+    def scan(self):
+        for name in sorted(os.listdir(self.path)):
+            self.note(name)
+
+    def settle(self):
+        """
+        #
+        # Submit the bundles that have been quiet long enough; returns
+        # the time until the next one is due (None if none pending)
+        #
+        """
+        nxt = None
+        for fqbn, (due, size, mtime) in self.pending.items():
+            wait = due - time.time()
+            if wait <= 0:
+                try:
+                    st = os.stat(fqbn)
+                except OSError:
+                    del self.pending[fqbn]      # gone again
+                    continue
+                if (st.st_size, st.st_mtime) != (size, mtime):
+                    self.note(os.path.basename(fqbn))
+                    wait = self.quiet
+                elif self.submit(fqbn):
+                    del self.pending[fqbn]
+                    continue
+                else:
+                    wait = 1.0                  # pool busy; retry
+            nxt = wait if nxt is None else min(nxt, wait)
+        return nxt
+
+    def submit(self, fqbn):
+        with self.lock:
+            if fqbn in self.inflight:
+                return False
+            self.inflight.add(fqbn)
+
+        jid = self.pool.submit('ingest ' + fqbn,
+            lambda jid, reply, sts: self.done(fqbn, jid, reply))
+        if jid is None:
+            with self.lock:
+                self.inflight.discard(fqbn)
+            return False
+
+        print '[%s] watch: ACK %d ingest %s' % (now(), jid, fqbn)
+        sys.stdout.flush()
+        return True
+
+    def done(self, fqbn, jid, reply):
+        with self.lock:
+            self.inflight.discard(fqbn)
+        print '[%s] watch: DONE %d %s' % (now(), jid, reply)
+        sys.stdout.flush()
+
+    def run(self):
+        self.scan()
+        while True:
+            wait = self.settle()
+            try:
+                r, w, x = select.select([self.ino], [], [], wait)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not r:
+                continue
+            for mask, name in self.ino.events():
+                if mask & Inotify.IN_Q_OVERFLOW:
+                    self.scan()
+                elif name:
+                    self.note(name)
+
+
+def start_watch():
+    """
+    #
+    # Upload watcher over 'uplddir'; set up before daemonizing so
+    # that a failure is reported on the terminal.
+    #
+    """
+    try:
+        return Upload_Watcher(uplddir, wqtime)
+    except OSError as e:
+        sys.stderr.write('Fatal error: cannot watch %s: %s\n' %
+            (uplddir, e))
+        raise SystemExit(1)
+
+
+def watch_uploads():
+    """
+    #
+    # --watch without --service: ingest uploads in the foreground
+    #
+    """
+    global wrkpool
+
+    watcher = start_watch()
+    print 'watch_uploads(): watching', uplddir, '(%d workers)' % wrkrs
+
+    start_zygote(wrkrs * scrjobs)
+    wrkpool = Ingest_Worker_Pool(wrkrs, jobqmax)
+    atexit.register(wrkpool.shutdown)
+    reap_trash()
+    start_packer()
+    watcher.pool = wrkpool
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        raise SystemExit(0)
+
+
+def start_svc(watch):
     print 'start_svc(): system daemon mode ( pid in', pidfile, ')'
 
+    watcher = start_watch() if watch else None
     try:
         daemonize(pidfile, stdin='/dev/null', stdout=logfile, stderr=logfile)
     except RuntimeError as e:
         sys.stderr.write('Fatal error: {}\n'.format(e))
         raise SystemExit(1)
 
-    # make it so that new processes don't end up as zombies
-    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
-
-    srva = (tcpaddr, tcpport)
-    s = TCP_Forking_Server(srva, TCP_Ingestion_Handler,
-        bind_and_activate=False)
-    s.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
-    s.server_bind()
-    s.server_activate()
+    #
+    # Bounded pools of workers, one per lane; the TCP front-end only
+    # hands requests over to them and relays their completion.
+    #
+    global wrkpool
+    start_zygote((wrkrs + bwrkrs) * scrjobs)
+    wrkpool = Worker_Lanes({'interactive': (iwrkrs, iqmax, 0),
+        'ingest': (wrkrs, jobqmax, 0), 'bulk': (bwrkrs, jobqmax, bnice)})
+    atexit.register(wrkpool.shutdown)
+    reap_trash()
+    start_packer()
+
+    if watcher is not None:
+        watcher.pool = wrkpool
+        t = threading.Thread(target=watcher.run)
+        t.daemon = True
+        t.start()
+
+    s = TCP_Async_Server((tcpaddr, tcpport))
     s.serve_forever()
 
 
@@ -1112,32 +4542,47 @@ def start_svc():
 #  directory is returned.
 #
 def derive_xdir(fqbn, cc):
+    """
+    #
+    # Walk the bundle members lazily and stop at collector.stats, so
+    # only the part of the archive in front of it gets decompressed.
+    # Sets cs_date and tskip; returns the top-level collector dir.
+    #
+    """
     global tskip
 
+    xdir = mdx_stats(fqbn)
+    if xdir is not None:
+        return xdir
+
     try:
-        names = tarfile.open(fqbn, 'r:*').getnames()
-    except:
-        sys.stderr.write('Fatal error: Cannot open collector bundle\n')
-        stop(101)
+        tf = Bundle_Tar.bundle(fqbn)
+        for ti in tf:
+            if not re.match(cspatt, ti.name):
+                continue
 
-    for i in names:
-        pattern = "\S*collector\.stats$"
-        mp = re.match(pattern, i)
-        if mp:
-            fd = tarfile.open(fqbn, 'r:*').extractfile(i)
+            fd = tf.extractfile(ti)
             if fd:
                 collector_stats(fd)
 
-            patt = "^(\S+)/(collector[a-zA-Z0-9_.-]*)/\S*$"
-            mp1 = re.match(patt, i)
-            if mp1:
-                prefix = mp1.group(1)
-                xdir = mp1.group(2)
+            mp = re.match(xdpatt, ti.name)
+            if mp:
+                prefix = mp.group(1)
+                xdir = mp.group(2)
 
                 tskip = 1 if len(re.split('/', prefix)) == 1 else 2
-                return xdir
+                break
 
-    return None
+        tf.close()
+
+    except (tarfile.TarError, EnvironmentError, zlib.error, EOFError):
+        sys.stderr.write('Fatal error: Cannot open collector bundle\n')
+        stop(101)
+
+    if xdir is not None:
+        mdx_store(fqbn, tard=xdir, cs_date=cs_date, cs_host=cs_host,
+            cs_lkey=cs_lkey, tskip=tskip)
+    return xdir
 
 
 def Peek(fpath, cc):
@@ -1202,33 +4647,69 @@ def process_args():
     # Valid Options:
     #
     #   --ingest    path_to_collector_bundle [ --db-enable ]
-    #   --reingest  path_to_collector_bundle [ --db-enable ]
+    #   --reingest  path_to_collector_bundle [ --incremental ] [ --db-enable ]
     #   --peek      path_to_collector_bundle
     #   --dbt       path_to_collector_bundle --db-enable
-    #   --service
+    #   --service [ --workers N ] [ --queue-max N ] [ --watch ]
+    #             [ --interactive-workers N ] [ --bulk-workers N ]
+    #   --watch   [ --workers N ] [ --queue-max N ]
+    #   --ingest-dir path_to_bundle_dir [ --jobs N ] [ --db-enable ]
+    #
+    #   --bz2-jobs N    processes decompressing .tar.bz2 bundles
+    #   --zygote-workers N, --zygote-jobs N
+    #                   warm Python script workers (daemon modes)
+    #   --db-backend B  'mysql' (default) or 'sqlite' (db_file)
+    #
+    #   --cas-prune     drop content store entries nothing links to
+    #   --selective     only extract the members scripts read (MANIFEST)
+    #   --materialize path_to_bundle member
+    #                   extract a member --selective left out
+    #   --no-cas        extract without the content store
+    #   --index-span MB access point spacing of .tar.gz bundle indexes
+    #   --recompress    recompress the archived bundles that are due
+    #   --no-recompress no background recompression (daemon modes)
     #
     """
     global OS
     global bdlpath
     global db_enable
     global program
+    global wrkrs
+    global jobqmax
+    global scrjobs
+    global bz2jobs
+    global incrmtl
+    global pyinproc
+    global zygwrks
+    global zygjobs
+    global casdedup
+    global selectv
+    global idxspan
+    global packarc
+    global iwrkrs
+    global bwrkrs
 
     c = Colors()
     umsg = program + c.bold_white + ' --ingest ' + c.reset +                \
         'path_to_compressed_bundle' + ' [ ' + c.bold_white + '--db-enable' +\
         c.reset + ' ]' + '\n' + 7*' ' + program + c.bold_white +            \
         ' --reingest' + c.reset + ' path_to_compressed_bundle [ ' +         \
+        c.bold_white + '--incremental' + c.reset + ' ] [ ' +               \
         c.bold_white + '--db-enable' + c.reset + ' ]' + '\n' + 7*' ' +      \
         program + c.bold_white + ' --peek' + c.reset +                      \
         ' path_to_compressed_bundle' + '\n' + 7*' ' + program + c.bold_white\
-        + ' --service' + c.reset + '\n'
-
-    if OS == 'Linux':
-        usage_msg = umsg + 7*' ' + program + c.bold_white + ' --dbt ' +     \
-            c.reset + 'path_to_compressed_bundle' + c.bold_white +          \
-            ' --db-enable' + c.reset + '\n'
-    else:
-        usage_msg = umsg
+        + ' --service' + c.reset + ' [ ' + c.bold_white + '--watch' +      \
+        c.reset + ' ]' + '\n' + 7*' ' + program + c.bold_white +           \
+        ' --watch' + c.reset + '\n' + 7*' ' + program + c.bold_white +    \
+        ' --ingest-dir' + c.reset + ' path_to_bundle_dir [ ' +              \
+        c.bold_white + '--jobs' + c.reset + ' N ]' + '\n'
+
+    usage_msg = umsg + 7*' ' + program + c.bold_white + ' --dbt ' +         \
+        c.reset + 'path_to_compressed_bundle' + c.bold_white +              \
+        ' --db-enable' + c.reset + '\n' + 7*' ' + program + c.bold_white + \
+        ' --cas-prune' + c.reset + '\n' + 7*' ' + program + c.bold_white + \
+        ' --materialize' + c.reset + ' path_to_bundle member\n' + 7*' ' +  \
+        program + c.bold_white + ' --recompress' + c.reset + '\n'
 
     parser = optparse.OptionParser(usage=usage_msg)
 
@@ -1240,6 +4721,10 @@ def process_args():
         help='Re-Ingestion of previously ingested bundle \"BundlePath\"; '
         'refer to' + c.bold_white + ' --db-enable ' + c.reset + 'for database'
         ' insertion.', metavar='BundlePath', nargs=1)
+    parser.add_option('--incremental', dest='incr', action='store_true',
+        default=False, help='With ' + c.bold_white + '--reingest' + c.reset +
+        ', only rerun the ingestion scripts whose fingerprint (script, ' +
+        'inputs) changed since the last run, and those depending on them')
     parser.add_option('--db-enable', action='store_true', default=False,
         help='Optional argument to enable database functionality: use ' +   \
         'script variables ' + c.bold_white + 'db_user, db_pass' + c.reset + \
@@ -1250,10 +4735,91 @@ def process_args():
         metavar='BundlePath', nargs=1)
     parser.add_option('--service', dest='daemon', action='store_true',
         default=False, help='Run ' + program + ' as a TCP Server daemon')
-    if OS == 'Linux':
-        parser.add_option('--dbt', dest='dbpath', type='str', default=None,
-            help='Test if provided bundle already exists in database',
-            metavar='BundlePath', nargs=1)
+    parser.add_option('--ingest-dir', dest='idir', type='str', default=None,
+        help='Ingest every collector bundle in directory \"BundleDir\"',
+        metavar='BundleDir', nargs=1)
+    parser.add_option('--jobs', dest='jobs', type='int',
+        default=multiprocessing.cpu_count(), help='Bundles ingested ' +
+        'concurrently by ' + c.bold_white + '--ingest-dir' + c.reset +
+        ' (default: %default)', metavar='N')
+    parser.add_option('--watch', dest='watch', action='store_true',
+        default=False, help='Ingest bundles as soon as their upload to ' +
+        uplddir + ' completes (inotify); combines with ' + c.bold_white +
+        '--service' + c.reset)
+    parser.add_option('--workers', dest='workers', type='int', default=wrkrs,
+        help='Number of concurrent ingestion workers for ' + c.bold_white +
+        '--service' + c.reset + ' (default: %default)', metavar='N')
+    parser.add_option('--queue-max', dest='qmax', type='int',
+        default=jobqmax, help='Jobs allowed to wait for a free worker ' +
+        'before requests are refused as busy (default: %default)',
+        metavar='N')
+    parser.add_option('--interactive-workers', dest='iworkers', type='int',
+        default=iwrkrs, help='Workers of ' + c.bold_white + '--service' +
+        c.reset + ' reserved for peek, dbt and status requests, which ' +
+        'never wait behind ingests (default: %default)', metavar='N')
+    parser.add_option('--bulk-workers', dest='bworkers', type='int',
+        default=bwrkrs, help='Workers of ' + c.bold_white + '--service' +
+        c.reset + ' running reingest requests, at a lower priority and ' +
+        'apart from the ingest ones (default: %default)', metavar='N')
+    parser.add_option('--script-jobs', dest='sjobs', type='int',
+        default=scrjobs, help='Ingestion scripts of the same A-tier to ' +
+        'run concurrently (default: %default)', metavar='N')
+    parser.add_option('--py-exec', dest='pyexec', action='store_true',
+        default=False, help='Run Python ingestion scripts through the ' +
+        'shell in a new interpreter, like all the others, instead of in ' +
+        'a forked child with the shared modules preloaded')
+    parser.add_option('--zygote-workers', dest='zwrks', type='int',
+        default=None, help='Warm workers running Python ingestion ' +
+        'scripts for ' + c.bold_white + '--service' + c.reset + ', ' +
+        c.bold_white + '--watch' + c.reset + ' and ' + c.bold_white +
+        '--ingest-dir' + c.reset + '; 0 forks a child per script ' +
+        '(default: workers x script-jobs)', metavar='N')
+    parser.add_option('--zygote-jobs', dest='zjobs', type='int',
+        default=zygjobs, help='Scripts a warm worker runs before it is ' +
+        'replaced by a fresh one (default: %default)', metavar='N')
+    parser.add_option('--bz2-jobs', dest='bjobs', type='int',
+        default=bz2jobs, help='Processes decompressing .tar.bz2 bundles ' +
+        'in parallel; 1 decompresses serially (default: %default)',
+        metavar='N')
+    parser.add_option('--db-backend', dest='dbback', type='choice',
+        choices=sorted(db_backends.keys()), default=db_back,
+        help='Database used by ' + c.bold_white + '--db-enable' + c.reset +
+        ': mysql, or sqlite for a local database in ' + db_file +
+        ' (default: %default)', metavar='BACKEND')
+    parser.add_option('--no-cas', dest='nocas', action='store_true',
+        default=False, help='Write every extracted file, rather than ' +
+        'hard link the ones identical to a file already in the content ' +
+        'store (' + casdir + ')')
+    parser.add_option('--cas-prune', dest='casprune', action='store_true',
+        default=False, help='Remove the content store entries no ' +
+        'ingested file links to any more')
+    parser.add_option('--selective', dest='selectv', action='store_true',
+        default=False, help='Only extract the bundle members ingestion ' +
+        'scripts read (ingestion-scripts/MANIFEST and their requires: ' +
+        'headers); the rest stay in the archived bundle')
+    parser.add_option('--materialize', dest='mtrlz', type='str',
+        default=None, help='Extract \"Member\" (a path relative to ' +
+        'the ingestion dir, or a pattern), left out by ' + c.bold_white +
+        '--selective' + c.reset + ', from \"BundlePath\"',
+        metavar='BundlePath Member', nargs=2)
+    parser.add_option('--index-span', dest='ispan', type='int',
+        default=idxspan >> 20, help='MB of tar stream between the access ' +
+        'points of the random access index written beside archived ' +
+        '.tar.gz bundles; 0 writes no index (default: %default)',
+        metavar='MB')
+    parser.add_option('--recompress', dest='pack', action='store_true',
+        default=False, help='Recompress the archived bundles in ' +
+        clardir + ' not touched for %d days to indexed bzip2, ' %
+        (packmin / 86400) + 'at idle priority; ' + c.bold_white +
+        '--service' + c.reset + ' and ' + c.bold_white + '--watch' +
+        c.reset + ' do so in the background')
+    parser.add_option('--no-recompress', dest='nopack',
+        action='store_true', default=False, help='No background ' +
+        'recompression of the archive by ' + c.bold_white + '--service' +
+        c.reset + ' and ' + c.bold_white + '--watch' + c.reset)
+    parser.add_option('--dbt', dest='dbpath', type='str', default=None,
+        help='Test if provided bundle already exists in database',
+        metavar='BundlePath', nargs=1)
 
     (options_args, args) = parser.parse_args()
 
@@ -1267,12 +4833,55 @@ def process_args():
         usage(parser, msg)
     if options_args.daemon and (options_args.bpath or options_args.rbpath):
         usage(parser, msg)
+    if options_args.watch and (options_args.bpath or options_args.rbpath):
+        usage(parser, msg)
+    if options_args.idir and (options_args.bpath or options_args.rbpath or
+       options_args.daemon or options_args.watch):
+        usage(parser, msg)
+    if options_args.incr and not options_args.rbpath:
+        usage(parser, "\n\t*** --incremental requires --reingest ***\n")
+    if options_args.jobs < 1:
+        usage(parser, "\n\t*** --jobs must be >= 1 ***\n")
+    if options_args.workers < 1 or options_args.qmax < 0:
+        usage(parser, "\n\t*** --workers must be >= 1, --queue-max >= 0 ***\n")
+    if options_args.iworkers < 1 or options_args.bworkers < 1:
+        usage(parser, "\n\t*** --interactive-workers and --bulk-workers " +
+            "must be >= 1 ***\n")
+    if options_args.sjobs < 1:
+        usage(parser, "\n\t*** --script-jobs must be >= 1 ***\n")
+    if (options_args.zwrks or 0) < 0 or options_args.zjobs < 1:
+        usage(parser, "\n\t*** --zygote-workers must be >= 0, " +
+            "--zygote-jobs >= 1 ***\n")
+    if options_args.bjobs < 1:
+        usage(parser, "\n\t*** --bz2-jobs must be >= 1 ***\n")
+    if options_args.ispan < 0:
+        usage(parser, "\n\t*** --index-span must be >= 0 ***\n")
+    if options_args.db_enable:
+        try:
+            db_backend(options_args.dbback)
+        except ImportError, e:
+            usage(parser, "\n\t*** --db-backend %s: %s ***\n" %
+                (options_args.dbback, e))
 
     #
     # Perform action for option specified
     #
     cc = 'cli'
     db_enable = options_args.db_enable
+    wrkrs = options_args.workers
+    jobqmax = options_args.qmax
+    iwrkrs = options_args.iworkers
+    bwrkrs = options_args.bworkers
+    scrjobs = options_args.sjobs
+    bz2jobs = options_args.bjobs
+    incrmtl = options_args.incr
+    pyinproc = not options_args.pyexec
+    zygwrks = options_args.zwrks
+    zygjobs = options_args.zjobs
+    casdedup = not options_args.nocas
+    selectv = options_args.selectv
+    idxspan = options_args.ispan << 20
+    packarc = not options_args.nopack
     if options_args.bpath is not None:
         bdlpath = options_args.bpath
         Ingest(options_args.bpath, cc)      # --ingest
@@ -1281,11 +4890,25 @@ def process_args():
         bdlpath = options_args.rbpath
         Reingest(options_args.rbpath, cc)   # --reingest
 
+    elif options_args.idir is not None:
+        sys.exit(IngestDir(options_args.idir, options_args.jobs))
+
     elif options_args.pbpath is not None:
         bdlpath = options_args.pbpath
         Peek(options_args.pbpath, cc)       # --peek
 
-    elif OS == 'Linux' and db_enable and options_args.dbpath is not None:
+    elif options_args.casprune:
+        sys.exit(CasPrune(cc))              # --cas-prune
+
+    elif options_args.pack:
+        sys.exit(PackArchive(cc))           # --recompress
+
+    elif options_args.mtrlz is not None:
+        bdlpath = options_args.mtrlz[0]
+        sys.exit(Materialize(options_args.mtrlz[0], options_args.mtrlz[1],
+            cc))                            # --materialize
+
+    elif db_enable and options_args.dbpath is not None:
         bdlpath = options_args.dbpath
         DBPeek(options_args.dbpath, cc)     # --dbt
 
@@ -1293,7 +4916,12 @@ def process_args():
         if args:
             msg = "\n\t*** --service option takes no arguments ***\n"
             usage(parser, msg)
-        start_svc()                         # --service
+        start_svc(options_args.watch)       # --service
+    elif options_args.watch:
+        if args:
+            msg = "\n\t*** --watch option takes no arguments ***\n"
+            usage(parser, msg)
+        watch_uploads()                     # --watch
     else:
         parser.print_help()
         sys.exit(1)
@@ -1323,12 +4951,8 @@ def plat_info():
 def main():
     global program
     global OS
-    global DB
-    
-    OS, PyV = plat_info()
-    if OS == 'Linux':
-        import MySQLdb as DB
 
+    OS, PyV = plat_info()
     program = os.path.basename(sys.argv[0])
     process_args()
     return
@@ -7,6 +7,9 @@ set -x
 # Description:
 #   creates an ingestor/links dir in the bundle and symlinks all .out* files in it for ease of location
 #   - could be used by other scripts to prevent having to know exact dirs to look in, perhaps
+#
+# requires:
+# produces: ingestor/ ingestor/links/
 
 # include generic functions file
 #source /root/Collector/Ingestor/ingestion-scripts/functions.sh
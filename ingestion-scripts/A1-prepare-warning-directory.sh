@@ -5,6 +5,9 @@
 # Last Updated On: 2013-09-26
 # Description:
 #   just prepares a warning directory to put various warnings into
+#
+# requires:
+# produces: ingestor/ ingestor/warnings/ ingestor/checks/
 
 # include generic functions file
 #source /root/Collector/Ingestor/ingestion-scripts/functions.sh
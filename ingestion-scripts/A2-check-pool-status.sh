@@ -5,6 +5,9 @@
 # Last Updated On: 2013-09-26
 # Description:
 #   checks if the pool has any obvious warning signs
+#
+# requires: zfs/zpool-status-dv.out zfs/zpool-list-o-all.out ingestor/warnings/
+# produces: ingestor/warnings/check-pool-status
 
 # include generic functions file
 #source /root/Collector/Ingestor/ingestion-scripts/functions.sh
@@ -6,6 +6,9 @@
 # Description:
 #   checks if the pool utilization is greater than 70% on any pool and reports
 #   that if it is
+#
+# requires: ingestor/links/ ingestor/warnings/ ingestor/checks/
+# produces: ingestor/warnings/check-pool-utilization ingestor/checks/check-pool-utilization
 
 # include generic functions file
 #source /root/Collector/Ingestor/ingestion-scripts/functions.sh
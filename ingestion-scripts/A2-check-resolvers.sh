@@ -5,6 +5,9 @@
 # Last Updated On: 2013-09-26
 # Description:
 #   nameserver check
+#
+# requires: network/resolv.conf ingestor/warnings/
+# produces: ingestor/warnings/check-resolvers
 
 # include generic functions file
 #source /root/Collector/Ingestor/ingestion-scripts/functions.sh
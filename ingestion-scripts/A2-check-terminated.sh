@@ -5,6 +5,9 @@
 # Last Updated On: 2013-09-26
 # Description:
 #   check for terminated list in collector.stats
+#
+# requires: collector.stats ingestor/warnings/
+# produces: ingestor/warnings/check-terminated
 
 # include generic functions file
 #source /root/Collector/Ingestor/ingestion-scripts/functions.sh
@@ -5,6 +5,9 @@
 # Last Updated On: 2013-09-30
 # Description:
 #   dump check
+#
+# requires: ingestor/links/ ingestor/warnings/ ingestor/checks/
+# produces: ingestor/warnings/check-zeusram-firmware ingestor/checks/check-zeusram-firmware
 
 # include generic functions file
 #source /root/Collector/Ingestor/ingestion-scripts/functions.sh
@@ -9,6 +9,9 @@ their json counterparts, for their eventual absorption in the
 Nexenta dashboard.
 """
 
+# requires: ingestor/
+# produces: ingestor/json/
+
 import sys
 import json
 import time
@@ -5,6 +5,7 @@
 
 import os
 import re
+import sys
 
 
 class Path(Exception):
@@ -792,6 +793,27 @@ def read_raw_txt(rawfile):
     return rawlines
 
 
+def open_bundle_member(bdir, member):
+    """
+    Open a file of an ingested collector bundle, whether or not it was
+    extracted: bundle members left out by a selective ingestion (or
+    pruned since) are read from the archived bundle, through its
+    random access index when it has one.
+
+    Inputs:
+        bdir   (str): Path to collector bundle
+        member (str): Path of the file, relative to bdir
+    Outputs:
+        f     (file): Read-only file object
+    """
+    top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if top not in sys.path:
+        sys.path.append(top)
+    from lib import GzIndex
+
+    return GzIndex.open_file(bdir, member)
+
+
 def json_save(bdir, jsdmp, jsonfile):
     debug = False
     odir = os.path.join(bdir, 'ingestor/json')
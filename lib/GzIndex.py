@@ -0,0 +1,597 @@
+#!/usr/bin/env python
+#
+# Random access into compressed collector bundles
+#
+# A gzip file can only be decompressed from the start, unless the
+# decompressor is restarted at a deflate block boundary with the 32K
+# of output preceding it as dictionary (zlib's examples/zran.c). While
+# a bundle is decompressed anyway, for its extraction, the Indexer
+# records such an access point every 'span' bytes of output; together
+# with the offset and size of every tar member that makes up the
+# bundle's sidecar index, '<bundle>.idx'. open_member() then reads a
+# single member by starting at the access point right before it.
+#
+# Python's zlib module cannot prime a bit offset nor set a raw inflate
+# dictionary, so this goes to libz through ctypes. Without libz there
+# is no index, and members are found by reading through the bundle.
+#
+# A bzip2 bundle gets its access points by construction instead: the
+# Packer writes it as a run of bzip2 streams of 'span' bytes of tar
+# stream each, and every stream can be decompressed on its own, with
+# no window. bunzip2 (and PBzip2) read such a file like any other.
+#
+# Index file: one line of JSON (bundle type and size, span, access
+# points and members as {name: [offset, size]}), followed by the zlib
+# compressed windows of the points, if any. Points are [in, out, bits,
+# woff, wlen] for gzip ('woff' and 'wlen' locate a window in the
+# blob) and [in, out] for bzip2.
+#
+import os
+import re
+import io
+import bz2
+import json
+import zlib
+import bisect
+import tarfile
+import tempfile
+import ctypes
+import ctypes.util
+
+gzindex_ver = '1.0.0'
+
+WINSIZE = 32768
+CHUNK = 1 << 20
+SPAN = 4 << 20
+
+Z_OK = 0
+Z_STREAM_END = 1
+Z_NEED_DICT = 2
+Z_BUF_ERROR = -5
+Z_NO_FLUSH = 0
+Z_BLOCK = 5
+
+GZ_WBITS = 47                   # 32 + 15: zlib or gzip header
+RAW_WBITS = -15
+
+
+class z_stream(ctypes.Structure):
+    _fields_ = [('next_in', ctypes.c_void_p), ('avail_in', ctypes.c_uint),
+        ('total_in', ctypes.c_ulong), ('next_out', ctypes.c_void_p),
+        ('avail_out', ctypes.c_uint), ('total_out', ctypes.c_ulong),
+        ('msg', ctypes.c_char_p), ('state', ctypes.c_void_p),
+        ('zalloc', ctypes.c_void_p), ('zfree', ctypes.c_void_p),
+        ('opaque', ctypes.c_void_p), ('data_type', ctypes.c_int),
+        ('adler', ctypes.c_ulong), ('reserved', ctypes.c_ulong)]
+
+
+_libz = None
+
+
+def libz():
+    """
+    #
+    # libz through ctypes, or None if it cannot be loaded
+    #
+    """
+    global _libz
+
+    if _libz is None:
+        _libz = False
+        try:
+            lib = ctypes.CDLL(ctypes.util.find_library('z') or 'libz.so.1')
+            lib.zlibVersion.restype = ctypes.c_char_p
+            lib.inflateInit2_.argtypes = [ctypes.POINTER(z_stream),
+                ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+            lib.inflate.argtypes = [ctypes.POINTER(z_stream), ctypes.c_int]
+            lib.inflateEnd.argtypes = [ctypes.POINTER(z_stream)]
+            lib.inflateReset.argtypes = [ctypes.POINTER(z_stream)]
+            lib.inflatePrime.argtypes = [ctypes.POINTER(z_stream),
+                ctypes.c_int, ctypes.c_int]
+            lib.inflateSetDictionary.argtypes = [ctypes.POINTER(z_stream),
+                ctypes.c_char_p, ctypes.c_uint]
+            _libz = lib
+        except (OSError, AttributeError):
+            pass
+    return _libz or None
+
+
+class Inflater(object):
+    """
+    #
+    # A libz inflate stream. feed() it input, then run() it until it
+    # has consumed all of it; every run() returns (zlib return code,
+    # output) and stops at the end of a deflate block when 'flush' is
+    # Z_BLOCK, which is where access points can be taken.
+    #
+    """
+    def __init__(self, wbits):
+        self.lib = libz()
+        self.strm = z_stream()
+        self.out = ctypes.create_string_buffer(WINSIZE)
+        self.data = ''
+        self.wbits = wbits
+        rc = self.lib.inflateInit2_(ctypes.byref(self.strm), wbits,
+            self.lib.zlibVersion(), ctypes.sizeof(z_stream))
+        if rc != Z_OK:
+            raise zlib.error('inflateInit2: %d' % rc)
+
+    def feed(self, data):
+        self.data = data                # next_in points into it
+        self.strm.next_in = ctypes.cast(ctypes.c_char_p(data),
+            ctypes.c_void_p)
+        self.strm.avail_in = len(data)
+
+    def unused(self):
+        n = self.strm.avail_in
+        return self.data[len(self.data) - n:] if n else ''
+
+    def run(self, flush):
+        self.strm.next_out = ctypes.addressof(self.out)
+        self.strm.avail_out = WINSIZE
+        rc = self.lib.inflate(ctypes.byref(self.strm), flush)
+        if rc < 0 and rc != Z_BUF_ERROR or rc == Z_NEED_DICT:
+            raise zlib.error('inflate: %s' % (self.strm.msg or rc))
+        return rc, self.out.raw[:WINSIZE - self.strm.avail_out]
+
+    def busy(self):
+        return self.strm.avail_in > 0 or self.strm.avail_out == 0
+
+    def reset(self):
+        self.lib.inflateReset(ctypes.byref(self.strm))
+
+    def prime(self, bits, value):
+        self.lib.inflatePrime(ctypes.byref(self.strm), bits, value)
+
+    def dictionary(self, window):
+        self.lib.inflateSetDictionary(ctypes.byref(self.strm), window,
+            len(window))
+
+    def close(self):
+        if self.strm is not None:
+            self.lib.inflateEnd(ctypes.byref(self.strm))
+            self.strm = None
+
+    def __del__(self):
+        self.close()
+
+
+class Indexer(object):
+    """
+    #
+    # Iterate over Indexer(fd, span) to get the decompressed contents
+    # of gzip file object 'fd' (concatenated members included), while
+    # an access point is recorded at the first deflate block boundary
+    # past every 'span' bytes of output. Windows go to a temp file as
+    # they are taken, so memory use does not grow with the bundle.
+    #
+    """
+    def __init__(self, fd, span=SPAN):
+        self.fd = fd
+        self.span = span
+        self.points = []
+        self.blob = tempfile.TemporaryFile()
+        self.bloblen = 0
+        self.totin = 0
+        self.totout = 0
+        self.complete = False
+
+    def __iter__(self):
+        inf = Inflater(GZ_WBITS)
+        window = ''
+        last = -self.span
+        ended = False
+
+        try:
+            while True:
+                data = self.fd.read(CHUNK)
+                if not data:
+                    break
+                if ended:
+                    if not data.strip('\0'):
+                        continue        # trailing padding
+                    inf.reset()
+                    ended = False
+                inf.feed(data)
+
+                while inf.busy():
+                    before = inf.strm.avail_in
+                    rc, out = inf.run(Z_BLOCK)
+                    self.totin += before - inf.strm.avail_in
+                    self.totout += len(out)
+                    if out:
+                        window = (window + out)[-WINSIZE:]
+                        yield out
+
+                    if rc == Z_STREAM_END:
+                        rest = inf.unused()
+                        if not rest.strip('\0'):
+                            ended = True
+                            break
+                        inf.reset()     # next gzip member
+                        inf.feed(rest)
+                        continue
+
+                    dt = inf.strm.data_type
+                    if dt & 128 and not dt & 64 and \
+                       self.totout - last >= self.span:
+                        self.point(dt & 7, window)
+                        last = self.totout
+
+                    if rc == Z_BUF_ERROR and not inf.strm.avail_in:
+                        break
+            self.complete = ended
+        finally:
+            inf.close()
+
+    def point(self, bits, window):
+        wz = zlib.compress(window)
+        self.blob.write(wz)
+        self.points.append([self.totin, self.totout, bits, self.bloblen,
+            len(wz)])
+        self.bloblen += len(wz)
+
+    def write(self, path, members):
+        """
+        #
+        # Write the index of the bundle at 'path' to 'path.idx', given
+        # its {member: [offset, size]}. False if the bundle was not
+        # read through to its end, so the index would be incomplete.
+        #
+        """
+        if not self.complete:
+            return False
+
+        write_index(path, 'gzip', self.span, self.points, members,
+            self.blob)
+        return True
+
+    def close(self):
+        self.blob.close()
+
+
+class Packer(object):
+    """
+    #
+    # pack() tar stream data into bzip2 file object 'fd', as one bzip2
+    # stream per 'span' bytes of it; each stream start is recorded as
+    # an access point. close() ends the last stream.
+    #
+    """
+    def __init__(self, fd, span=SPAN, level=9):
+        self.fd = fd
+        self.span = span
+        self.level = level
+        self.points = []
+        self.comp = None
+        self.left = 0
+        self.totin = 0
+        self.totout = 0
+
+    def pack(self, data):
+        while data:
+            if self.comp is None:
+                self.points.append([self.totin, self.totout])
+                self.comp = bz2.BZ2Compressor(self.level)
+                self.left = self.span
+            piece = data[:self.left]
+            data = data[len(piece):]
+            self.put(self.comp.compress(piece))
+            self.totout += len(piece)
+            self.left -= len(piece)
+            if not self.left:
+                self.end()
+
+    def put(self, data):
+        self.fd.write(data)
+        self.totin += len(data)
+
+    def end(self):
+        if self.comp is not None:
+            self.put(self.comp.flush())
+            self.comp = None
+
+    def write(self, path, members):
+        """
+        #
+        # Write the index of the packed bundle at 'path' to 'path.idx'
+        #
+        """
+        self.end()
+        write_index(path, 'bzip2', self.span, self.points, members, None)
+        return True
+
+    def close(self):
+        self.end()
+
+
+def write_index(path, kind, span, points, members, blob):
+    """
+    #
+    # Write 'path.idx' (see above) through a temp file, so that readers
+    # see either the old index or the whole new one
+    #
+    """
+    hdr = {'version': 1, 'type': kind, 'size': os.path.getsize(path),
+        'span': span, 'points': points, 'members': members}
+    fd, tmp = tempfile.mkstemp(prefix='.idx-',
+        dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(json.dumps(hdr) + '\n')
+        if blob is not None:
+            blob.seek(0)
+            for data in iter(lambda: blob.read(CHUNK), ''):
+                f.write(data)
+    os.rename(tmp, path + '.idx')
+
+
+class Index(object):
+    """
+    #
+    # The sidecar index of bundle 'path', or IOError if it has none
+    # (or a stale one)
+    #
+    """
+    def __init__(self, path):
+        self.path = os.path.realpath(path)
+        self.f = open(self.path + '.idx', 'rb')
+        try:
+            hdr = json.loads(self.f.readline())
+        except ValueError:
+            self.f.close()
+            raise IOError('%s.idx: not an index' % path)
+        self.blob = self.f.tell()
+        if hdr.get('version') != 1 or \
+           hdr['size'] != os.path.getsize(self.path):
+            self.f.close()
+            raise IOError('%s.idx: stale index' % path)
+
+        self.kind = hdr.get('type', 'gzip')
+        self.points = hdr['points']
+        self.outs = [p[1] for p in self.points]
+        self.members = hdr['members']
+
+    def window(self, point):
+        self.f.seek(self.blob + point[3])
+        return zlib.decompress(self.f.read(point[4]))
+
+    def read(self, offset):
+        """
+        #
+        # Decompressed data of the bundle from 'offset' on, in chunks
+        #
+        """
+        if self.kind == 'bzip2':
+            return self.bunzip(offset)
+        return self.gunzip(offset)
+
+    def bunzip(self, offset):
+        i = bisect.bisect_right(self.outs, offset) - 1
+        pin, pos = self.points[i] if i >= 0 else (0, 0)
+        with open(self.path, 'rb') as fd:
+            fd.seek(pin)
+            dobj = bz2.BZ2Decompressor()
+            for raw in iter(lambda: fd.read(CHUNK), ''):
+                while raw:
+                    try:
+                        data = dobj.decompress(raw)
+                    except EOFError:    # next stream
+                        dobj = bz2.BZ2Decompressor()
+                        continue
+                    raw = dobj.unused_data
+                    if raw:
+                        dobj = bz2.BZ2Decompressor()
+                    if pos + len(data) > offset:
+                        yield data[max(0, offset - pos):]
+                    pos += len(data)
+
+    def gunzip(self, offset):
+        i = bisect.bisect_right(self.outs, offset) - 1
+        with open(self.path, 'rb') as fd:
+            if i < 0:
+                inf = Inflater(GZ_WBITS)
+                pos = 0
+            else:
+                pin, pos, bits = self.points[i][:3]
+                inf = Inflater(RAW_WBITS)
+                fd.seek(pin - (1 if bits else 0))
+                if bits:
+                    inf.prime(bits, ord(fd.read(1)) >> (8 - bits))
+                inf.dictionary(self.window(self.points[i]))
+
+            for data in self.inflate(fd, inf):
+                if pos + len(data) > offset:
+                    yield data[max(0, offset - pos):]
+                pos += len(data)
+
+    def inflate(self, fd, inf):
+        try:
+            data = fd.read(CHUNK)
+            while data:
+                inf.feed(data)
+                data = None
+                while inf.busy():
+                    rc, out = inf.run(Z_NO_FLUSH)
+                    if out:
+                        yield out
+                    if rc == Z_STREAM_END:
+                        #
+                        # End of a gzip member; a raw stream started at
+                        # an access point leaves its trailer to skip
+                        #
+                        data = inf.unused()
+                        if inf.wbits == RAW_WBITS:
+                            data += fd.read(max(0, 8 - len(data)))
+                            data = data[8:]
+                        data = data or fd.read(CHUNK)
+                        inf.close()
+                        inf = Inflater(GZ_WBITS)
+                        if not data.strip('\0'):
+                            return      # trailing padding
+                        break
+                    if rc == Z_BUF_ERROR and not inf.strm.avail_in:
+                        break
+                if data is None:
+                    data = fd.read(CHUNK)
+        finally:
+            inf.close()
+
+    def close(self):
+        self.f.close()
+
+
+class Member(object):
+    """
+    #
+    # Read-only file object over 'size' bytes of a bundle's tar stream
+    # at 'offset', decompressed from the closest access point on
+    #
+    """
+    def __init__(self, idx, offset, size):
+        self.idx = idx
+        self.offset = offset
+        self.size = size
+        self.pos = 0
+        self.buf = ''
+        self.chunks = None
+
+    def fill(self, n):
+        """
+        #
+        # Buffer at least 'n' bytes, or whatever is left of the member
+        #
+        """
+        if self.chunks is None:
+            self.chunks = self.idx.read(self.offset + self.pos)
+            self.buf = ''
+        n = min(n, self.size - self.pos)
+        have = len(self.buf)
+        bufs = [self.buf]
+        while have < n:
+            data = next(self.chunks, None)
+            if data is None:
+                break
+            bufs.append(data)
+            have += len(data)
+        self.buf = ''.join(bufs)
+
+    def read(self, n=-1):
+        left = self.size - self.pos
+        n = left if n < 0 else min(n, left)
+        self.fill(n)
+        data = self.buf[:n]
+        self.buf = self.buf[n:]
+        self.pos += len(data)
+        return data
+
+    def readline(self):
+        want = 1
+        while True:
+            self.fill(want)
+            i = self.buf.find('\n')
+            if i >= 0:
+                return self.read(i + 1)
+            if len(self.buf) < want:
+                return self.read(len(self.buf))
+            want = len(self.buf) + CHUNK
+
+    def readlines(self):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def seek(self, pos, whence=0):
+        pos += (0, self.pos, self.size)[whence]
+        if pos != self.pos:
+            self.pos = min(max(pos, 0), self.size)
+            self.chunks = None          # restart at the closest point
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.chunks = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def member_rel(name):
+    """
+    #
+    # Tar member name relative to the collector dir it is under, one
+    # or two levels down (see xdpatt in NZA_Ingestor.py)
+    #
+    """
+    mp = re.match('^[^/]+/(?:[^/]+/)?collector[a-zA-Z0-9_.-]*/(.+)$', name)
+    return mp.group(1) if mp else name
+
+
+def open_member(path, member):
+    """
+    #
+    # File object over 'member' (a path relative to the bundle dir) of
+    # collector bundle 'path', through its index if it has one and by
+    # reading through the bundle otherwise. IOError if there is no
+    # such member.
+    #
+    """
+    try:
+        idx = Index(path)
+    except (IOError, OSError):
+        idx = None
+
+    if idx is not None and (idx.kind == 'bzip2' or libz() is not None):
+        if member not in idx.members:
+            idx.close()
+            raise IOError('%s: no such member in %s' % (member, path))
+        offset, size = idx.members[member]
+        return Member(idx, offset, size)
+
+    #
+    # Not a stream: extractfile() of a hard link needs to go back to
+    # the member it links to
+    #
+    try:
+        tf = tarfile.open(path, 'r:*')
+        try:
+            for ti in tf:
+                if (ti.isreg() or ti.islnk()) and \
+                   member_rel(ti.name) == member:
+                    return io.BytesIO(tf.extractfile(ti).read())
+        finally:
+            tf.close()
+    except (tarfile.TarError, KeyError, EOFError, zlib.error) as e:
+        raise IOError('%s: %s in %s' % (member, e, path))
+    raise IOError('%s: no such member in %s' % (member, path))
+
+
+def open_file(bdir, member):
+    """
+    #
+    # File object over 'member' of ingested bundle dir 'bdir': the
+    # extracted file if there is one, or else the member of the bundle
+    # it was extracted from (named in bdir/.ingestor_bundle). IOError
+    # if neither can be read.
+    #
+    """
+    try:
+        return open(os.path.join(bdir, member), 'rb')
+    except IOError:
+        try:
+            with open(os.path.join(bdir, '.ingestor_bundle')) as f:
+                path = f.readline().rstrip('\n')
+        except IOError:
+            path = None
+        if not path:
+            raise
+    return open_member(path, member)
+
+
+# pydoc related
+__version__ = "$Revision: " + gzindex_ver + " $"
+__status__ = "Experimental"
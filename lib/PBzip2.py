@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+#
+# Parallel bzip2 decompression
+#
+# A bzip2 file is one or more streams ('BZh1'..'BZh9' header, a run
+# of blocks, an end-of-stream marker) and every block is compressed
+# independently. Blocks start with a 48-bit magic number which is not
+# byte aligned, so the compressed data is scanned for it at every bit
+# offset; each block found is then re-wrapped as a standalone, byte
+# aligned single-block stream and handed to a process pool. Results
+# come back in file order.
+#
+# The per-block CRCs are checked by the bz2 module while decoding and
+# the combined CRC of every stream is checked against its trailer.
+# If anything does not line up (a block marker lookalike inside the
+# compressed data, a truncated file, corruption) the reader falls back
+# to a plain sequential decode of the file, skipping what it already
+# delivered, so the output is always exactly what bunzip2 produces.
+#
+import bz2
+import binascii
+import multiprocessing
+from collections import deque
+
+pbzip2_ver = '1.0.0'
+
+BLK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+CHUNK = 8 << 20
+
+
+def magic_patterns(magic):
+    """
+    #
+    # For each of the 8 bit offsets a 48-bit magic can start at, the
+    # 5 fully determined bytes to search for, plus the byte before
+    # and the byte after them with the masks of their magic bits.
+    #
+    """
+    pats = []
+    for s in range(8):
+        w = magic << (8 - s)
+        wb = [(w >> (8 * (6 - k))) & 0xff for k in range(7)]
+        mid = ''.join(chr(b) for b in wb[1:6])
+        m0 = 0xff >> s
+        m6 = (0xff << (8 - s)) & 0xff
+        pats.append((s, mid, wb[0] & m0, m0, wb[6] & m6, m6))
+    return pats
+
+
+BLK_PATS = magic_patterns(BLK_MAGIC)
+EOS_PATS = magic_patterns(EOS_MAGIC)
+
+
+def bits_value(data, sbit, nbits):
+    """
+    #
+    # Integer value of 'nbits' bits of 'data' starting at bit 'sbit'
+    # (MSB first, as bzip2 writes them).
+    #
+    """
+    sb = sbit >> 3
+    eb = (sbit + nbits + 7) >> 3
+    n = int(binascii.hexlify(data[sb:eb]) or '0', 16)
+    n >>= (eb << 3) - (sbit + nbits)
+    return n & ((1 << nbits) - 1)
+
+
+def decode_block(data, sbit, nbits, level):
+    """
+    #
+    # Decompress one block: bits [sbit, sbit + nbits) of 'data' hold
+    # the block magic, its CRC and the block itself. It is re-aligned
+    # and closed with an end-of-stream marker whose combined CRC is
+    # the block CRC, which is what it is for a one-block stream.
+    #
+    """
+    blk = bits_value(data, sbit, nbits)
+    crc = (blk >> (nbits - 80)) & 0xffffffff
+    n = (((blk << 48) | EOS_MAGIC) << 32) | crc
+    tbits = nbits + 80
+    pad = -tbits % 8
+    n <<= pad
+    nbytes = (tbits + pad) >> 3
+    raw = binascii.unhexlify('%0*x' % (nbytes * 2, n))
+
+    return bz2.decompress('BZh%d' % level + raw)
+
+
+class Reader(object):
+    """
+    #
+    # Iterate over Reader(fd, nproc) to get the decompressed contents
+    # of bzip2 file object 'fd' in order, in block sized pieces.
+    #
+    """
+    def __init__(self, fd, nproc):
+        self.fd = fd
+        self.nproc = nproc
+        self.pool = None
+        self.keep = 0
+        self.combined = 0
+        self.emitted = 0
+
+    def __iter__(self):
+        try:
+            for data in self.parallel():
+                self.emitted += len(data)
+                yield data
+        except Fallback:
+            for data in self.serial(self.emitted):
+                yield data
+        finally:
+            self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def markers(self):
+        """
+        #
+        # Yield (kind, bitpos, buf, base) for every block ('blk') and
+        # end-of-stream ('eos') magic in file order; 'buf' holds the
+        # file data from offset 'base' on. Every marker is yielded
+        # with at least 16 bytes of 'buf' after it (unless at EOF) so
+        # the stream trailer and the next stream header can be read.
+        # Nothing before self.keep is ever dropped from 'buf'.
+        #
+        """
+        buf = self.fd.read(CHUNK)
+        base = 0
+        start = 1
+        eof = False
+
+        if buf[:3] != 'BZh':
+            raise Fallback()
+
+        while True:
+            end = len(buf) if eof else len(buf) - 16
+            found = []
+            for kind, pats in (('blk', BLK_PATS), ('eos', EOS_PATS)):
+                for s, mid, b0, m0, b6, m6 in pats:
+                    i = buf.find(mid, start, end)
+                    while i >= 0:
+                        if ord(buf[i - 1]) & m0 == b0 and \
+                           (m6 == 0 or (i + 5 < len(buf) and
+                                ord(buf[i + 5]) & m6 == b6)):
+                            found.append(((base + i - 1) * 8 + s, kind))
+                        i = buf.find(mid, i + 1, end)
+
+            for bitpos, kind in sorted(found):
+                yield kind, bitpos, buf, base
+
+            if eof:
+                return
+
+            more = self.fd.read(CHUNK)
+            if not more:
+                eof = True
+            drop = max(0, min(self.keep - base, end - 5))
+            buf = buf[drop:] + more
+            base += drop
+            start = max(1, end - 4 - drop)
+
+    def parallel(self):
+        self.pool = multiprocessing.Pool(self.nproc)
+        level = 9
+        pending = deque()
+        blk = None
+        ended = False
+
+        for kind, bitpos, buf, base in self.markers():
+            if blk is not None:
+                sbit, lvl = blk
+                data = buf[(sbit >> 3) - base:((bitpos + 7) >> 3) - base]
+                res = self.pool.apply_async(decode_block,
+                    (data, sbit & 7, bitpos - sbit, lvl))
+                crc = bits_value(data, (sbit & 7) + 48, 32)
+                pending.append(('blk', crc, res))
+                blk = None
+
+            if kind == 'blk':
+                blk = (bitpos, level)
+                self.keep = bitpos >> 3
+            else:
+                crc = bits_value(buf, bitpos - base * 8 + 48, 32)
+                pending.append(('eos', crc, None))
+
+                hdr = ((bitpos + 80 + 7) >> 3) - base
+                if buf[hdr:hdr + 3] == 'BZh' and buf[hdr + 3:hdr + 4].isdigit():
+                    level = int(buf[hdr + 3])
+                    self.keep = base + hdr
+                else:
+                    ended = True
+
+            while len(pending) > 2 * self.nproc or \
+                  (pending and pending[0][0] == 'eos'):
+                for data in self.drain(pending):
+                    yield data
+
+            if ended:
+                break
+
+        if blk is not None or not ended:
+            raise Fallback()
+        while pending:
+            for data in self.drain(pending):
+                yield data
+
+    def drain(self, pending):
+        """
+        #
+        # Retire the oldest pending item: a decoded block, or a stream
+        # trailer whose combined CRC must match the blocks before it.
+        #
+        """
+        kind, crc, res = pending.popleft()
+        if kind == 'eos':
+            if crc != self.combined:
+                raise Fallback()
+            self.combined = 0
+            return []
+
+        try:
+            data = res.get()
+        except Exception:
+            raise Fallback()
+        self.combined = (((self.combined << 1) |
+            (self.combined >> 31)) & 0xffffffff) ^ crc
+        return [data]
+
+    def serial(self, skip):
+        """
+        #
+        # Plain sequential decode of the whole file, dropping the first
+        # 'skip' bytes of output. Raises IOError where bunzip2 fails.
+        #
+        """
+        self.close()
+        self.fd.seek(0)
+        dobj = bz2.BZ2Decompressor()
+        done = False
+        raw = ''
+
+        while True:
+            more = self.fd.read(CHUNK)
+            raw += more
+            if not raw:
+                break
+
+            while raw:
+                if done:
+                    if len(raw) < 4 and more and 'BZh'.startswith(raw[:3]):
+                        break           # next header split across reads
+                    if not raw.startswith('BZh'):
+                        return          # trailing garbage, as bunzip2
+                    dobj = bz2.BZ2Decompressor()
+                    done = False
+
+                data = dobj.decompress(raw)
+                raw = dobj.unused_data
+                try:
+                    dobj.decompress('')
+                except EOFError:
+                    done = True
+
+                if skip:
+                    cut = min(skip, len(data))
+                    data = data[cut:]
+                    skip -= cut
+                if data:
+                    yield data
+
+            if not more:
+                break
+
+        if not done:
+            raise IOError('compressed file ended before the end-of-stream '
+                'marker was reached')
+
+
+class Fallback(Exception):
+    pass
+
+
+# pydoc related
+__version__ = "$Revision: " + pbzip2_ver + " $"
+__status__ = "Experimental"
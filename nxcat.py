@@ -20,6 +20,7 @@ import errno
 import gzip
 from pprint import pprint
 from lib.CText import *
+from lib import GzIndex
 from netaddr import *
 
 
@@ -34,11 +35,23 @@ debug = False
 machid = ''
 
 
+def open_raw(rawfile):
+    """
+    #
+    # Open a raw file of the bundle in 'base'; one that was not
+    # extracted is read from the archived bundle (see lib/GzIndex.py)
+    #
+    """
+    if os.path.exists(rawfile) or not base:
+        return open(rawfile, 'r')
+    return GzIndex.open_file(base, os.path.relpath(rawfile, base))
+
+
 def read_raw_txt(rawfile):
     rawlines = []
 
     try:
-        with open(rawfile, 'r') as f:
+        with open_raw(rawfile) as f:
             for l in f.readlines():
                 pattern = '^#.*$'           # skip comment lines
                 if re.match(pattern, l):
@@ -0,0 +1,28 @@
+--
+-- Ingestions table indexes
+--
+-- NZA_Ingestor records a bundle with a single upsert keyed on its
+-- extraction directory (tarball_fullpath) and upload path, which
+-- needs both columns to be unique. The (current_step, last_updated_at)
+-- index keeps "which ingestions are stuck at step N since when"
+-- queries off a full table scan.
+--
+-- Duplicate rows left behind by the old scan-then-insert code have
+-- to go before the unique indexes can be built; the most recent row
+-- (highest id) of each bundle is the one kept.
+--
+-- Usage: mysql -u root -p cookbook < sql/001-ingestions-indexes.sql
+--
+
+DELETE dup FROM ingestions dup
+    JOIN ingestions keep
+      ON dup.tarball_fullpath = keep.tarball_fullpath AND dup.id < keep.id;
+
+DELETE dup FROM ingestions dup
+    JOIN ingestions keep
+      ON dup.uploaded_fullpath = keep.uploaded_fullpath AND dup.id < keep.id;
+
+ALTER TABLE ingestions
+    ADD UNIQUE INDEX ingestions_tarball_fullpath (tarball_fullpath),
+    ADD UNIQUE INDEX ingestions_uploaded_fullpath (uploaded_fullpath),
+    ADD INDEX ingestions_step_updated (current_step, last_updated_at);
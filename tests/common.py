@@ -0,0 +1,94 @@
+#
+# Shared helpers of the NZA_Ingestor tests
+#
+# Run from the top of the repository with
+#
+#   python -m unittest discover tests
+#
+import grp
+import gzip
+import imp
+import io
+import os
+import pwd
+import sys
+import tarfile
+
+topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if topdir not in sys.path:
+    sys.path.insert(0, topdir)
+
+
+def load_ingestor():
+    """
+    #
+    # NZA_Ingestor.py loaded as a module (once), without its command
+    # line
+    #
+    """
+    if 'NZA_Ingestor' in sys.modules:
+        return sys.modules['NZA_Ingestor']
+    argv = sys.argv
+    sys.argv = ['NZA_Ingestor.py']
+    try:
+        return imp.load_source('NZA_Ingestor',
+            os.path.join(topdir, 'NZA_Ingestor.py'))
+    finally:
+        sys.argv = argv
+
+
+def work_dirs(nza, top):
+    """
+    #
+    # Point the directory globals of 'nza' below 'top' and create them;
+    # what gets ingested there belongs to the user running the tests
+    #
+    """
+    nza.ingown = pwd.getpwuid(os.getuid()).pw_name
+    nza.inggrps = [grp.getgrgid(os.getgid()).gr_name]
+    nza.ingids = None
+    nza.basedir = top
+    nza.uplddir = os.path.join(top, 'upload')
+    nza.ingddir = os.path.join(top, 'ingested')
+    nza.linkdir = os.path.join(nza.ingddir, 'links')
+    nza.trshdir = os.path.join(nza.ingddir, '.trash')
+    nza.casdir = os.path.join(nza.ingddir, '.cas')
+    nza.clardir = os.path.join(top, 'collector_archive')
+    nza.mdxdir = os.path.join(top, '.bundle_index')
+    nza.cidxdir = os.path.join(top, '.content_index')
+    nza.packskp = os.path.join(nza.clardir, '.recompress_skipped')
+    for d in (nza.uplddir, nza.ingddir, nza.linkdir, nza.trshdir,
+              nza.casdir, nza.clardir, nza.mdxdir, nza.cidxdir):
+        os.makedirs(d)
+
+
+STATS = 'License key: ABC-123\nHostname: myhost extra\n' + \
+    'Script started: Mon May 13 11:51:20 2014\n'
+
+
+def make_bundle(path, members):
+    """
+    #
+    # Write gzipped tar 'path' of 'members': (name, data) for files,
+    # (name, None) for directories and (name, '=target') for hard links
+    #
+    """
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tf:
+        for name, data in members:
+            ti = tarfile.TarInfo(name)
+            ti.mtime = 1400000000
+            if data is None:
+                ti.type = tarfile.DIRTYPE
+                ti.mode = 0755
+                tf.addfile(ti)
+            elif data.startswith('='):
+                ti.type = tarfile.LNKTYPE
+                ti.linkname = data[1:]
+                tf.addfile(ti)
+            else:
+                ti.size = len(data)
+                tf.addfile(ti, io.BytesIO(data))
+    with gzip.open(path, 'wb') as f:
+        f.write(buf.getvalue())
+    return buf.getvalue()
@@ -0,0 +1,103 @@
+#
+# NZA_Ingestor.py: the content addressed store of extracted files
+#
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import common
+
+nza = common.load_ingestor()
+
+MTIME = 1400000000
+
+
+class Test_Cas(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        common.work_dirs(nza, self.tmp)
+        nza.casdedup = True
+        self.casbuf = nza.casbuf
+
+    def tearDown(self):
+        nza.casbuf = self.casbuf
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, data, mtime=MTIME):
+        path = os.path.join(self.tmp, name)
+        shared = nza.cas_write(io.BytesIO(data), len(data), path, mtime)
+        return path, shared
+
+    def check_store(self, path, nlink):
+        st = os.stat(path)
+        self.assertEqual(st.st_nlink, nlink)
+        self.assertEqual(st.st_mode & 07777, nza.fmode & ~0222)
+        self.assertEqual(int(st.st_mtime), MTIME)
+
+    def test_shared(self):
+        for casbuf in (8 << 20, 4):
+            nza.casbuf = casbuf
+            a, shared = self.write('a%d' % casbuf, 'same data\n')
+            self.assertFalse(shared)
+            b, shared = self.write('b%d' % casbuf, 'same data\n')
+            self.assertTrue(shared)
+            self.assertEqual(os.stat(a).st_ino, os.stat(b).st_ino)
+            self.check_store(a, 3)
+            with open(b) as f:
+                self.assertEqual(f.read(), 'same data\n')
+            self.assertEqual([f for f in os.listdir(self.tmp)
+                if '.cas-' in f], [])
+            shutil.rmtree(nza.casdir)
+
+    def test_other_attributes(self):
+        for casbuf in (8 << 20, 4):
+            nza.casbuf = casbuf
+            a, shared = self.write('a%d' % casbuf, 'same data\n')
+            b, shared = self.write('b%d' % casbuf, 'same data\n',
+                MTIME + 60)
+            self.assertFalse(shared)
+            self.assertNotEqual(os.stat(a).st_ino, os.stat(b).st_ino)
+            self.check_store(a, 2)
+            st = os.stat(b)
+            self.assertEqual(st.st_nlink, 1)
+            self.assertEqual(st.st_mode & 07777, nza.fmode)
+            self.assertEqual(int(st.st_mtime), MTIME + 60)
+            shutil.rmtree(nza.casdir)
+
+    def test_no_store(self):
+        nza.casdedup = False
+        try:
+            a, shared = self.write('a', 'same data\n')
+        finally:
+            nza.casdedup = True
+        self.assertFalse(shared)
+        self.assertEqual(os.stat(a).st_mode & 07777, nza.fmode)
+        self.assertEqual(os.listdir(nza.casdir), [])
+
+    def test_prune(self):
+        a, shared = self.write('a', 'kept\n')
+        self.write('b', 'kept\n')
+        c, shared = self.write('c', 'pruned\n')
+        os.unlink(c)
+
+        stdout, sys.stdout = sys.stdout, io.BytesIO()
+        try:
+            self.assertEqual(nza.CasPrune('cli'), 0)
+            out = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertTrue('1 entries pruned (7 bytes freed), 1 kept ' +
+            '(5 bytes saved)' in out, out)
+        ents = [os.path.join(d, f) for d, dn, fn in os.walk(nza.casdir)
+            for f in fn]
+        self.assertEqual(len(ents), 1)
+        self.assertEqual(os.stat(ents[0]).st_ino, os.stat(a).st_ino)
+        self.assertEqual(len(os.listdir(nza.casdir)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
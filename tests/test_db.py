@@ -0,0 +1,111 @@
+#
+# NZA_Ingestor.py: the embedded SQLite backend and step updates
+#
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import common
+
+nza = common.load_ingestor()
+
+
+class DB_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        nza.db_file = os.path.join(self.tmp, 'ingestions.db')
+        nza.db_backend('sqlite')
+        nza.db_con = None
+        nza.db_pid = 0
+
+    def tearDown(self):
+        if nza.db_con is not None:
+            nza.db_con.close()
+        nza.db_con = None
+        shutil.rmtree(self.tmp)
+
+    def rows(self):
+        con = sqlite3.connect(nza.db_file)
+        try:
+            return con.execute('SELECT id, uploaded_fullpath, ' +
+                'tarball_fullpath, final_fullpath, current_step FROM ' +
+                'ingestions ORDER BY id;').fetchall()
+        finally:
+            con.close()
+
+
+class Step_Queue(nza.DB_Step_Queue):
+    """
+    #
+    # DB_Step_Queue flushed by the tests only
+    #
+    """
+    def run(self):
+        pass
+
+
+class Test_Step_Queue(DB_Test):
+
+    def setUp(self):
+        DB_Test.setUp(self)
+        con, cur = nza.db_connect(nza.db_user, nza.db_pass, nza.db_name)
+        for n in (1, 2):
+            cur.execute('INSERT INTO ingestions (uploaded_fullpath, ' +
+                'current_step) VALUES (?, 0);', ('u%d' % n,))
+        con.commit()
+        self.q = Step_Queue(3600)
+
+    def test_latest_step(self):
+        for step in (1, 2, 3):
+            self.q.put('ingestions', 1, step)
+        self.q.put('ingestions', 2, 5)
+        self.q.flush()
+        self.assertEqual([r[4] for r in self.rows()], [3, 5])
+
+    def test_failed_flush(self):
+        connect = nza.db_connect
+
+        def failing(*args):
+            self.assertTrue(self.q.flushing.locked())
+            self.q.put('ingestions', 1, 7)      # newer, mid flush
+            raise nza.DB.Error('database is locked')
+
+        self.q.put('ingestions', 1, 3)
+        self.q.put('ingestions', 2, 4)
+        nza.db_connect = failing
+        try:
+            self.assertRaises(nza.DB.Error, self.q.flush)
+        finally:
+            nza.db_connect = connect
+        self.assertEqual([r[4] for r in self.rows()], [0, 0])
+
+        self.q.flush()
+        self.assertEqual([r[4] for r in self.rows()], [7, 4])
+
+
+class Test_Upsert(DB_Test):
+
+    def upsert(self, up, tb, fin):
+        return nza.db_upsert_entry('ingestions', [up, tb, fin,
+            '2014-05-13 11:51:20', '2014-05-14 00:00:00', 0])
+
+    def test_insert_update(self):
+        self.assertEqual(self.upsert('u1', 't1', 'f1'), (1, 'insert'))
+        self.assertEqual(self.upsert('u2', 't2', 'f2'), (2, 'insert'))
+        self.assertEqual(self.upsert('u3', 't1', 'f3'), (1, 'update'))
+        self.assertEqual(self.rows(), [(1, 'u3', 't1', 'f3', 0),
+            (2, 'u2', 't2', 'f2', 0)])
+
+    def test_same_upload_new_ingestion(self):
+        self.upsert('u1', 't1', 'f1')
+        self.upsert('u2', 't2', 'f2')
+        self.assertEqual(self.upsert('u2', 't9', 'f9'), (2, 'update'))
+        self.assertEqual(self.rows(), [(1, 'u1', 't1', 'f1', 0),
+            (2, 'u2', 't9', 'f9', 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
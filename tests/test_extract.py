@@ -0,0 +1,164 @@
+#
+# NZA_Ingestor.py: single pass streaming extraction of bundles
+#
+import bz2
+import gzip
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import common
+
+nza = common.load_ingestor()
+
+class Test_Stream_Extract(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        common.work_dirs(nza, self.tmp)
+        nza.selectv = False
+        self.path = os.path.join(self.tmp, 'upload', 'b.tar.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def extract(self, members):
+        common.make_bundle(self.path, members)
+        return nza.stream_extract(self.path, 'net')
+
+    def read(self, fqtd, name):
+        with open(os.path.join(fqtd, name)) as f:
+            return f.read()
+
+    def members(self, top, stats_first):
+        body = [(top + '/', None), (top + '/zfs/', None),
+            (top + '/zfs/zpool.out', 'pool\n'),
+            (top + '/os/messages', 'boot\n')]
+        stats = [(top + '/collector.stats', common.STATS)]
+        return stats + body if stats_first else body + stats
+
+    def check(self, fqtd, top):
+        self.assertEqual(fqtd, os.path.join(nza.ingddir, '2014-05-13',
+            'collector-h-1'))
+        self.assertEqual(self.read(fqtd, 'collector.stats'), common.STATS)
+        self.assertEqual(self.read(fqtd, 'zfs/zpool.out'), 'pool\n')
+        self.assertEqual(self.read(fqtd, 'os/messages'), 'boot\n')
+        self.assertEqual(nza.tard, 'collector-h-1')
+        if nza.GzIndex.libz() is not None:
+            self.assertNotEqual(nza.bdlidx[0], None)
+        self.assertEqual([n for n in os.listdir(nza.ingddir)
+            if n.startswith('.xtract-')], [])
+
+    def test_stats_first(self):
+        for top, skip in (('var/collector-h-1', 1),
+                          ('var/tmp/collector-h-1', 2)):
+            fqtd = self.extract(self.members(top, True))
+            self.check(fqtd, top)
+            self.assertEqual(nza.tskip, skip)
+            shutil.rmtree(fqtd)
+
+    def test_stats_last(self):
+        for top, skip in (('var/collector-h-1', 1),
+                          ('var/tmp/collector-h-1', 2)):
+            fqtd = self.extract(self.members(top, False))
+            self.check(fqtd, top)
+            self.assertEqual(nza.tskip, skip)
+            shutil.rmtree(fqtd)
+
+    def test_no_dir_entries(self):
+        top = 'var/tmp/collector-h-1'
+        fqtd = self.extract([(top + '/collector.stats', common.STATS),
+            (top + '/zfs/zpool.out', 'pool\n'),
+            (top + '/os/messages', 'boot\n')])
+        self.check(fqtd, top)
+
+    def test_hard_links(self):
+        top = 'var/tmp/collector-h-1'
+        fqtd = self.extract([(top + '/os/messages', 'boot\n'),
+            (top + '/os/early', '=' + top + '/os/messages'),
+            (top + '/collector.stats', common.STATS),
+            (top + '/os/late', '=' + top + '/os/messages')])
+        for name in ('os/early', 'os/late'):
+            self.assertEqual(self.read(fqtd, name), 'boot\n')
+        st = os.stat(os.path.join(fqtd, 'os/messages'))
+        self.assertEqual(os.stat(os.path.join(fqtd, 'os/late')).st_ino,
+            st.st_ino)
+
+    def test_unsafe_members(self):
+        top = 'var/tmp/collector-h-1'
+        fqtd = self.extract([('../evil0', 'x'), ('/tmp/evil1', 'x'),
+            (top + '/collector.stats', common.STATS),
+            (top + '/../../../../evil2', 'x'), ('/' + top + '/evil3', 'x'),
+            (top + '/zfs/zpool.out', 'pool\n')])
+        self.assertEqual(self.read(fqtd, 'zfs/zpool.out'), 'pool\n')
+        for d in (self.tmp, nza.ingddir, os.path.dirname(fqtd), fqtd):
+            self.assertEqual([n for n in os.listdir(d)
+                if n.startswith('evil')], [])
+        self.assertFalse(os.path.exists('/tmp/evil1'))
+
+    def test_truncated(self):
+        top = 'var/tmp/collector-h-1'
+        raw = common.make_bundle(self.path, self.members(top, True) +
+            [(top + '/big.out', 'y' * 100000)])
+        with gzip.open(self.path, 'wb') as f:
+            f.write(raw[:len(raw) - 60000])
+        self.assertEqual(nza.stream_extract(self.path, 'net'), None)
+        self.assertTrue('Cannot extract' in nza.tcpresp, nza.tcpresp)
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) / 2)
+        self.assertEqual(nza.stream_extract(self.path, 'net'), None)
+        self.assertTrue('Cannot extract' in nza.tcpresp, nza.tcpresp)
+
+    def test_not_a_bundle(self):
+        self.assertEqual(self.extract([('var/tmp/x/zpool.out', 'pool\n')]),
+            None)
+        self.assertTrue('not a collector bundle' in nza.tcpresp)
+        self.assertEqual([n for n in os.listdir(nza.ingddir)
+            if n.startswith('.xtract-')], [])
+
+
+class Test_Bundle_Stream(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.bz2jobs = nza.bz2jobs
+        nza.bz2jobs = 4
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        nza.bz2jobs = self.bz2jobs
+
+    def test_peek_is_serial(self):
+        path = os.path.join(self.tmp, 'b.tar.bz2')
+        raw = ''.join('line %d\n' % i for i in xrange(200000))
+        with open(path, 'wb') as f:
+            f.write(bz2.compress(raw, 1))
+
+        bs = nza.Bundle_Stream(path)
+        self.assertEqual(bs.pbz, None)
+        self.assertEqual(bs.read(), raw)
+        bs.close()
+        bs = nza.Bundle_Stream(path, 4)
+        self.assertNotEqual(bs.pbz, None)
+        self.assertEqual(bs.read(), raw)
+        bs.close()
+
+    def test_index_on_request(self):
+        if nza.GzIndex.libz() is None:
+            self.skipTest('no libz')
+        path = os.path.join(self.tmp, 'b.tar.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write('x' * 1000)
+        bs = nza.Bundle_Stream(path)
+        self.assertEqual(bs.gzx, None)
+        bs.close()
+        bs = nza.Bundle_Stream(path, index=True)
+        self.assertNotEqual(bs.gzx, None)
+        self.assertEqual(bs.read(), 'x' * 1000)
+        bs.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#
+# lib/GzIndex.py: random member reads through gzip and bzip2 indexes
+#
+import gzip
+import io
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import common
+from lib import GzIndex
+
+SPAN = 64 << 10
+
+
+def make_tar(names, seed=1):
+    """
+    #
+    # Uncompressed tar of text members 'names' under a collector dir,
+    # and {member: contents}
+    #
+    """
+    r = random.Random(seed)
+    buf = io.BytesIO()
+    files = {}
+    with tarfile.open(fileobj=buf, mode='w') as tf:
+        for n in names:
+            data = ''.join('%s %08x\n' % (n, r.getrandbits(32))
+                for _ in xrange(r.randint(100, 20000)))
+            ti = tarfile.TarInfo('20140513/collector-h-1/' + n)
+            ti.size = len(data)
+            tf.addfile(ti, io.BytesIO(data))
+            files[n] = data
+    return buf.getvalue(), files
+
+
+def tar_members(raw):
+    tf = tarfile.open(fileobj=io.BytesIO(raw))
+    return dict((GzIndex.member_rel(ti.name), [ti.offset_data, ti.size])
+        for ti in tf if ti.isreg())
+
+
+class Test_Index(unittest.TestCase):
+
+    names = ['kernel/messages', 'os/uname.out', 'zfs/zpool-status.out',
+        'network/ifconfig.out', 'disk/iostat.out']
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.raw, self.files = make_tar(self.names)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def check(self, path):
+        for n in reversed(self.names):
+            with GzIndex.open_member(path, n) as f:
+                self.assertEqual(f.read(), self.files[n])
+        data = self.files['zfs/zpool-status.out']
+        with GzIndex.open_member(path, 'zfs/zpool-status.out') as f:
+            f.seek(5000)
+            self.assertEqual(f.read(100), data[5000:5100])
+            f.seek(0)
+            self.assertEqual(f.readline(), data[:data.index('\n') + 1])
+        self.assertRaises(IOError, GzIndex.open_member, path, 'no/such')
+
+    def test_gzip(self):
+        if GzIndex.libz() is None:
+            self.skipTest('no libz')
+        path = os.path.join(self.tmp, 'b.tar.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(self.raw)
+
+        with open(path, 'rb') as f:
+            gzx = GzIndex.Indexer(f, SPAN)
+            out = ''.join(gzx)
+        self.assertEqual(out, self.raw)
+        self.assertTrue(len(gzx.points) > 2)
+        self.assertTrue(gzx.write(path, tar_members(self.raw)))
+        gzx.close()
+        self.assertEqual(GzIndex.Index(path).kind, 'gzip')
+        self.check(path)
+
+    def test_bzip2(self):
+        path = os.path.join(self.tmp, 'b.tar.bz2')
+        with open(path, 'wb') as f:
+            pk = GzIndex.Packer(f, SPAN)
+            for i in xrange(0, len(self.raw), 10000):
+                pk.pack(self.raw[i:i + 10000])
+            pk.close()
+        pk.write(path, tar_members(self.raw))
+        self.assertTrue(len(pk.points) > 2)
+        self.assertEqual(GzIndex.Index(path).kind, 'bzip2')
+        self.check(path)
+
+    def test_stale_index(self):
+        path = os.path.join(self.tmp, 'b.tar.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(self.raw)
+        GzIndex.write_index(path, 'gzip', SPAN, [], {}, None)
+        with open(path, 'ab') as f:
+            f.write('\0' * 512)
+        self.assertRaises(IOError, GzIndex.Index, path)
+        with GzIndex.open_member(path, 'os/uname.out') as f:
+            self.assertEqual(f.read(), self.files['os/uname.out'])
+
+    def test_hard_link(self):
+        path = os.path.join(self.tmp, 'b.tar.gz')
+        tf = tarfile.open(path, 'w:gz')
+        raw = tarfile.open(fileobj=io.BytesIO(self.raw))
+        for ti in raw:
+            tf.addfile(ti, raw.extractfile(ti))
+        ti = tarfile.TarInfo('20140513/collector-h-1/os/uname.lnk')
+        ti.type = tarfile.LNKTYPE
+        ti.linkname = '20140513/collector-h-1/os/uname.out'
+        tf.addfile(ti)
+        tf.close()
+
+        with GzIndex.open_member(path, 'os/uname.lnk') as f:
+            self.assertEqual(f.read(), self.files['os/uname.out'])
+
+    def test_open_file(self):
+        bdir = os.path.join(self.tmp, 'bdir')
+        os.makedirs(os.path.join(bdir, 'os'))
+        with open(os.path.join(bdir, 'os/uname.out'), 'w') as f:
+            f.write('SunOS\n')
+        path = os.path.join(self.tmp, 'b.tar.gz')
+        with open(os.path.join(bdir, '.ingestor_bundle'), 'w') as f:
+            f.write(path + '\n')
+
+        with gzip.open(path, 'wb') as f:
+            f.write(self.raw)
+        with GzIndex.open_file(bdir, 'os/uname.out') as f:
+            self.assertEqual(f.read(), 'SunOS\n')
+        with GzIndex.open_file(bdir, 'kernel/messages') as f:
+            self.assertEqual(f.read(), self.files['kernel/messages'])
+
+        with gzip.open(path, 'wb') as f:
+            f.write(self.raw[:len(self.raw) / 2] + 'x' * 1000)
+        self.assertRaises(IOError, GzIndex.open_file, bdir, 'disk/iostat.out')
+
+
+if __name__ == '__main__':
+    unittest.main()
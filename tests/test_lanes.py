@@ -0,0 +1,114 @@
+#
+# NZA_Ingestor.py: request admission of the daemon's worker lanes
+#
+import os
+import Queue
+import shutil
+import tempfile
+import unittest
+
+import common
+
+nza = common.load_ingestor()
+
+
+class Test_Worker_Lanes(unittest.TestCase):
+
+    def setUp(self):
+        #
+        # No workers: admitted jobs stay pending until finish()ed
+        #
+        self.lanes = nza.Worker_Lanes({'interactive': (0, 4, 0),
+            'ingest': (0, 2, 0), 'bulk': (0, 2, 0)})
+        self.replies = {}
+        self.status = {}
+
+    def tearDown(self):
+        self.lanes.shutdown()
+
+    def reply(self, jid, reply, sts):
+        self.replies[jid] = reply
+        self.status[jid] = sts
+
+    def submit(self, rqst):
+        return self.lanes.submit(rqst, self.reply)
+
+    def pending(self, lane):
+        return len(self.lanes.pools[lane].pending)
+
+    def test_lanes(self):
+        self.assertEqual(self.lanes.lane('peek foo.tar.gz'), 'interactive')
+        self.assertEqual(self.lanes.lane('ingest foo.tar.gz'), 'ingest')
+        self.assertEqual(self.lanes.lane('reingest /a/foo.tar.gz'), 'bulk')
+        self.assertNotEqual(self.submit('peek foo.tar.gz'), None)
+        self.assertEqual(self.pending('interactive'), 1)
+
+    def test_rejected(self):
+        for rqst, why in (('frobnicate foo.tar.gz', 'no such command'),
+                          ('ingest', 'malformed request'),
+                          ('status', 'interactive 0/0 running')):
+            jid = self.submit(rqst)
+            self.assertNotEqual(jid, None)
+            self.assertTrue(why in self.replies[jid], self.replies[jid])
+            self.assertEqual(self.status[jid], int(rqst != 'status'))
+        for lane in nza.lanes:
+            self.assertEqual(self.pending(lane), 0)
+
+    def test_one_per_bundle(self):
+        jid = self.submit('ingest /mnt/upload/foo.tar.gz')
+        self.assertNotEqual(jid, None)
+        for rqst in ('reingest /mnt/archive/2014-05-13/foo.tar.bz2',
+                     'ingest foo.tar.gz'):
+            self.assertEqual(self.submit(rqst), None)
+            self.assertEqual(self.lanes.busy(rqst),
+                'bundle already in progress')
+        self.assertNotEqual(self.submit('ingest bar.tar.gz'), None)
+        self.assertNotEqual(self.submit('peek foo.tar.gz'), None)
+
+        self.lanes.pools['ingest'].finish(jid, 'done', 0)
+        self.assertEqual(self.replies[jid], 'done')
+        self.assertEqual(self.status[jid], 0)
+        self.assertNotEqual(
+            self.submit('reingest /mnt/archive/2014-05-13/foo.tar.bz2'), None)
+
+    def test_lane_full(self):
+        for n in range(2):
+            self.assertNotEqual(self.submit('ingest b%d.tar.gz' % n), None)
+        self.assertEqual(self.submit('ingest b2.tar.gz'), None)
+        self.assertEqual(self.lanes.busy('ingest b2.tar.gz'),
+            'ingest lane full')
+        self.assertNotEqual(self.submit('reingest b2.tar.gz'), None)
+        self.assertEqual(self.submit('ingest b2.tar.gz'), None)
+
+
+class Test_Worker_Status(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        common.work_dirs(nza, self.tmp)
+        self.path = os.path.join(self.tmp, 'upload', 'b.tar.gz')
+        common.make_bundle(self.path,
+            [('var/tmp/collector-h-1/collector.stats', common.STATS)])
+        self.pool = nza.Ingest_Worker_Pool(1, 2)
+        self.replies = Queue.Queue()
+
+    def tearDown(self):
+        self.pool.shutdown()
+        shutil.rmtree(self.tmp)
+
+    def run_job(self, rqst):
+        self.pool.submit(rqst,
+            lambda jid, reply, sts: self.replies.put((reply, sts)))
+        return self.replies.get(timeout=30)
+
+    def test_status(self):
+        reply, sts = self.run_job('peek ' + self.path)
+        self.assertEqual(sts, 0, reply)
+        reply, sts = self.run_job('peek ' + self.path + '.gone')
+        self.assertEqual(sts, 1, reply)
+        reply, sts = self.run_job('frobnicate ' + self.path)
+        self.assertEqual(sts, 1, reply)
+
+
+if __name__ == '__main__':
+    unittest.main()
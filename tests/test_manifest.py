@@ -0,0 +1,80 @@
+#
+# ingestion-scripts/MANIFEST: --selective must extract every bundle
+# member the ingestion scripts read
+#
+import glob
+import os
+import re
+import tarfile
+import unittest
+
+import common
+
+nza = common.load_ingestor()
+
+#
+# Reads the scripts build from a path stem plus a suffix, which the
+# patterns below cannot pick out of the source
+#
+STEMMED = ['appliance/nlm.key', 'disk/scsi_vhci.conf', 'kernel/system',
+    'plugins/tar-czf-opthac.tar.gz', 'plugins/tar-czf-opthac.stats',
+    'fma/fmdump-e.out.gz', 'kernel/modparams.out', 'kernel/messages.1',
+    'system/fmdump-evt-30day.out.gz', 'zfs/zfs-get-p-all.stats']
+
+
+def script_reads():
+    """
+    #
+    # Bundle members named literally in the shell and php scripts,
+    # minus what the scripts themselves write under ingestor/
+    #
+    """
+    reads = set()
+    patts = ['\$\{?BUNDLE_DIR\}?/([^\s"\'`;|)$]+)',
+        '\$BUNDLE_DIR \. "/([^"]+)"']
+    for s in glob.glob(os.path.join(common.topdir, 'ingestion-scripts',
+            'A*')):
+        with open(s) as f:
+            text = f.read()
+        for patt in patts:
+            reads.update(re.findall(patt, text))
+    return sorted(r for r in reads
+        if not r.startswith('ingestor/') and '*' not in r)
+
+
+class Test_Manifest(unittest.TestCase):
+
+    def setUp(self):
+        self.pats = nza.member_manifest()
+
+    def wanted(self, member, skip=1):
+        ti = tarfile.TarInfo('20140513/collector-h-1/' + member)
+        return nza.member_wanted(self.pats, ti, skip, set())
+
+    def test_script_reads(self):
+        reads = script_reads()
+        self.assertTrue('os/.bash_history' in reads)
+        for r in reads + STEMMED:
+            self.assertTrue(self.wanted(r), r)
+
+    def test_unwanted(self):
+        for r in ('os/core.1234', 'kernel/savecore.tar', 'zfs/dump.bin'):
+            self.assertFalse(self.wanted(r), r)
+
+    def test_links(self):
+        ti = tarfile.TarInfo('20140513/collector-h-1/os/hist')
+        ti.type = tarfile.LNKTYPE
+        ti.linkname = '20140513/collector-h-1/os/core.1'
+        self.assertTrue(nza.member_wanted(self.pats, ti, 1, set()))
+        self.assertFalse(nza.member_wanted(self.pats, ti, 2,
+            set([ti.linkname])))
+        ti.type = tarfile.DIRTYPE
+        self.assertTrue(nza.member_wanted(self.pats, ti, 1, set()))
+
+    def test_no_manifest(self):
+        self.assertTrue(nza.member_wanted(None,
+            tarfile.TarInfo('20140513/collector-h-1/os/core.1'), 1, set()))
+
+
+if __name__ == '__main__':
+    unittest.main()
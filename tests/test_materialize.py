@@ -0,0 +1,64 @@
+#
+# NZA_Ingestor.py: --materialize of members a --selective ingestion
+# left out
+#
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import common
+
+nza = common.load_ingestor()
+
+
+class Test_Materialize(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        common.work_dirs(nza, self.tmp)
+        nza.db_enable = False
+        ddir = os.path.join(nza.clardir, '2014-05-13')
+        os.makedirs(ddir)
+        self.path = os.path.join(ddir, 'b.tar.gz')
+        self.stdout, sys.stdout = sys.stdout, io.BytesIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.tmp)
+
+    def materialize(self, member):
+        return nza.Materialize('b.tar.gz', member, 'cli')
+
+    def test_not_a_collector_bundle(self):
+        common.make_bundle(self.path, [('var/tmp/x/os/messages', 'boot\n')])
+        nza.cs_date = None
+        self.assertEqual(self.materialize('os/messages'), 1)
+        self.assertTrue('no collector.stats' in sys.stdout.getvalue())
+
+    def test_not_ingested(self):
+        top = 'var/tmp/collector-h-1'
+        common.make_bundle(self.path, [
+            (top + '/collector.stats', common.STATS),
+            (top + '/os/messages', 'boot\n')])
+        self.assertEqual(self.materialize('os/messages'), 1)
+        self.assertTrue('has not been ingested' in sys.stdout.getvalue())
+
+    def test_member(self):
+        top = 'var/tmp/collector-h-1'
+        common.make_bundle(self.path, [
+            (top + '/collector.stats', common.STATS),
+            (top + '/os/messages', 'boot\n'),
+            (top + '/os/core.1', 'core\n')])
+        fqtd = os.path.join(nza.ingddir, '2014-05-13', 'collector-h-1')
+        os.makedirs(fqtd)
+        self.assertEqual(self.materialize('os/messages'), 0)
+        with open(os.path.join(fqtd, 'os', 'messages')) as f:
+            self.assertEqual(f.read(), 'boot\n')
+        self.assertFalse(os.path.exists(os.path.join(fqtd, 'os', 'core.1')))
+
+
+if __name__ == '__main__':
+    unittest.main()
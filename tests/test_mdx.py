@@ -0,0 +1,63 @@
+#
+# NZA_Ingestor.py: the persistent per-bundle metadata index
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+
+nza = common.load_ingestor()
+
+
+class Test_Bundle_Index(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        common.work_dirs(nza, self.tmp)
+        nza.db_enable = False
+        self.path = os.path.join(nza.uplddir, 'b.tar.gz')
+
+    def tearDown(self):
+        os.chdir(common.topdir)
+        shutil.rmtree(self.tmp)
+
+    def test_store_load(self):
+        common.make_bundle(self.path, [])
+        self.assertEqual(nza.mdx_load(self.path), None)
+        nza.mdx_store(self.path, tard='collector-h-1', tskip=2,
+            cs_date='Mon May 13 11:51:20 2014')
+        self.assertEqual(nza.mdx_stats(self.path), 'collector-h-1')
+        self.assertEqual(nza.tskip, 2)
+
+        os.utime(self.path, (0, 0))
+        self.assertEqual(nza.mdx_load(self.path), None)
+
+    def test_move(self):
+        common.make_bundle(self.path, [])
+        nza.mdx_store(self.path, tard='collector-h-1', tskip=1,
+            cs_date='Mon May 13 11:51:20 2014')
+        new = os.path.join(nza.clardir, 'b.tar.gz')
+        os.rename(self.path, new)
+        nza.mdx_move(self.path, new)
+        self.assertEqual(nza.mdx_load(new)['tard'], 'collector-h-1')
+        self.assertEqual(nza.mdx_load(new)['path'], os.path.realpath(new))
+        self.assertEqual(len(os.listdir(nza.mdxdir)), 1)
+
+    def test_archived_bundle_hits(self):
+        top = 'var/tmp/collector-h-1'
+        common.make_bundle(self.path, [
+            (top + '/collector.stats', common.STATS),
+            (top + '/os/messages', 'boot\n')])
+        self.assertNotEqual(nza.extract_bundle('b.tar.gz', 'net'), None)
+
+        arch = os.path.join(nza.clardir, '2014-05-13', 'b.tar.gz')
+        md = nza.mdx_load(arch)
+        self.assertNotEqual(md, None)
+        self.assertEqual(md['tard'], 'collector-h-1')
+        self.assertEqual(nza.derive_xdir(arch, 'net'), 'collector-h-1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+#
+# NZA_Ingestor.py: background recompression of the collector archive
+#
+import bz2
+import errno
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import unittest
+
+import common
+from lib import GzIndex
+from lib import PBzip2
+
+nza = common.load_ingestor()
+
+
+def make_tar(seed):
+    r = random.Random(seed)
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tf:
+        for n in ('collector.stats', 'kernel/messages', 'zfs/zpool.out'):
+            data = ''.join('%s %08x ONLINE\n' % (n, r.getrandbits(12))
+                for _ in xrange(40000))
+            ti = tarfile.TarInfo('20140513/collector-h-%d/%s' % (seed, n))
+            ti.size = len(data)
+            tf.addfile(ti, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def pack_pass():
+    """
+    #
+    # A single pack_worker() pass, run in a daemonic process as the
+    # daemon runs it
+    #
+    """
+    nza.bz2jobs = 4
+    time.sleep = lambda secs: sys.exit(0)
+    sys.stdout = open(os.devnull, 'w')
+    nza.pack_worker()
+
+
+class Test_Packer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        common.work_dirs(nza, self.tmp)
+        nza.db_enable = False
+        nza.packmin = 0
+        nza.idxspan = 256 << 10
+
+        ddir = os.path.join(nza.clardir, '2014-05-13')
+        os.makedirs(ddir)
+        self.raws = {}
+        self.bundles = []
+        for seed, ext in ((1, 'bz2'), (2, 'gz'), (3, 'gz')):
+            path = os.path.join(ddir, 'b%d.tar.%s' % (seed, ext))
+            raw = self.raws[nza.pack_name(path)] = make_tar(seed)
+            if ext == 'bz2':
+                with open(path, 'wb') as f:
+                    f.write(bz2.compress(raw, 1))
+            else:
+                with gzip.open(path, 'wb', 1) as f:
+                    f.write(raw)
+            self.bundles.append(path)
+        self.bad = os.path.join(ddir, 'a0.tar.gz')
+        with open(self.bad, 'wb') as f:
+            f.write('not a bundle' * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def pack_archive(self, **patches):
+        #
+        # One PackArchive() pass, quietly and at the test's priority,
+        # with the functions of nza in 'patches' swapped in
+        #
+        patches.setdefault('print_warn', lambda *args: None)
+        patches.setdefault('idle_priority', lambda: None)
+        saved = dict((n, getattr(nza, n)) for n in patches)
+        stdout, sys.stdout = sys.stdout, io.BytesIO()
+        for n, fn in patches.items():
+            setattr(nza, n, fn)
+        try:
+            nza.PackArchive('cli')
+        finally:
+            for n, fn in saved.items():
+                setattr(nza, n, fn)
+            sys.stdout = stdout
+
+    def skipped(self):
+        with open(nza.packskp) as f:
+            return set(l.rstrip('\n') for l in f)
+
+    def check_packed(self, path):
+        new = nza.pack_name(path)
+        self.assertFalse(os.path.exists(path) and path != new)
+        self.assertEqual(GzIndex.Index(new).kind, 'bzip2')
+        with GzIndex.open_member(new, 'kernel/messages') as f:
+            self.assertTrue(f.read(100) in self.raws[new])
+        with open(new, 'rb') as f:
+            data = ''.join(PBzip2.Reader(f, 1).serial(0))
+        self.assertTrue(data == self.raws[new])
+
+    def test_daemon_pass(self):
+        p = multiprocessing.Process(target=pack_pass)
+        p.daemon = True
+        p.start()
+        p.join(120)
+        self.assertEqual(p.exitcode, 0)
+        for path in self.bundles:
+            self.check_packed(path)
+        self.assertEqual(self.skipped(), set([self.bad]))
+
+    def test_bundle_failure(self):
+        pack_bundle = nza.pack_bundle
+
+        def failing(fqbn):
+            if fqbn == self.bundles[1]:
+                raise tarfile.ReadError('boom')
+            return pack_bundle(fqbn)
+
+        self.pack_archive(pack_bundle=failing)
+        self.check_packed(self.bundles[0])
+        self.check_packed(self.bundles[2])
+        self.assertEqual(self.skipped(), set([self.bad, self.bundles[1]]))
+
+    def test_transient_failure(self):
+        pack_bundle = nza.pack_bundle
+
+        def failing(fqbn):
+            if fqbn == self.bundles[1]:
+                raise IOError(errno.ENOSPC, 'No space left on device')
+            return pack_bundle(fqbn)
+
+        self.pack_archive(pack_bundle=failing)
+        self.assertEqual(self.skipped(), set([self.bad]))
+        self.assertTrue(os.path.exists(self.bundles[1]))
+        self.pack_archive()
+        self.check_packed(self.bundles[1])
+
+    def test_relink_failure(self):
+        old = self.bundles[1]
+        new = nza.pack_name(old)
+        ldir = os.path.join(nza.clardir, '2014-05-14')
+        os.makedirs(ldir)
+        link = os.path.join(ldir, 'c2.tar.gz')
+        os.symlink(old, link)
+        cidx = os.path.join(nza.cidxdir, 'c2.json')
+        with open(cidx, 'w') as f:
+            json.dump({'archive': old}, f)
+        nza.mdx_store(old, tard='collector-h-2', tskip=1)
+
+        def failing(fqbn, **kw):
+            raise IOError(errno.ENOSPC, 'No space left on device')
+
+        self.pack_archive(mdx_store=failing)
+        self.assertTrue(os.path.isfile(old))
+        self.assertFalse(os.path.lexists(new))
+        self.assertEqual(os.readlink(link), old)
+        self.assertFalse(os.path.lexists(nza.pack_name(link)))
+        with open(cidx) as f:
+            self.assertEqual(json.load(f)['archive'], old)
+        self.assertFalse(old in self.skipped())
+
+        self.pack_archive()
+        self.check_packed(old)
+        self.assertFalse(os.path.lexists(link))
+        self.assertEqual(os.readlink(nza.pack_name(link)), new)
+        with open(cidx) as f:
+            self.assertEqual(json.load(f)['archive'], new)
+        self.assertEqual(nza.mdx_load(new)['tard'], 'collector-h-2')
+
+    def test_archived_bundle(self):
+        self.pack_archive()
+        self.assertEqual(nza.archived_bundle('b2.tar.gz'),
+            nza.pack_name(self.bundles[1]))
+        self.assertEqual(nza.archived_bundle('b9.tar.gz'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+#
+# lib/PBzip2.py: parallel decoding must give what bunzip2 gives
+#
+import bz2
+import io
+import os
+import random
+import unittest
+
+import common
+from lib import PBzip2
+
+
+def sample(n, seed=1):
+    r = random.Random(seed)
+    words = ['zpool', 'ONLINE', 'c0t0d0', 'scsi', 'nfs', '\n', ' ', '0x']
+    return ''.join(r.choice(words) for _ in xrange(n))
+
+
+class Test_Reader(unittest.TestCase):
+
+    def decode(self, data, nproc):
+        return ''.join(PBzip2.Reader(io.BytesIO(data), nproc))
+
+    def test_single_stream(self):
+        raw = sample(300000)
+        comp = bz2.compress(raw, 1)
+        for nproc in (1, 4):
+            self.assertEqual(self.decode(comp, nproc), raw)
+
+    def test_multi_stream(self):
+        raws = [sample(200000, s) for s in range(3)]
+        comp = ''.join(bz2.compress(r, 1) for r in raws)
+        self.assertEqual(self.decode(comp, 3), ''.join(raws))
+
+    def test_incompressible(self):
+        raw = os.urandom(250000)
+        self.assertEqual(self.decode(bz2.compress(raw, 1), 2), raw)
+
+    def test_serial_skip(self):
+        raw = sample(100000)
+        rd = PBzip2.Reader(io.BytesIO(bz2.compress(raw)), 1)
+        self.assertEqual(''.join(rd.serial(1000)), raw[1000:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#
+# NZA_Ingestor.py: --reingest --incremental of an archived bundle
+#
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import common
+
+nza = common.load_ingestor()
+
+TOP = 'var/tmp/collector-h-1'
+
+SCRIPTS = {
+    'A1-count.sh': '#!/bin/sh\n# requires: os/messages\n' +
+        '# produces: ingestor/count\n' +
+        'mkdir -p "$1/ingestor"\necho x >> "$1/ingestor/count"\n',
+    'A2-plain.sh': '#!/bin/sh\necho x >> "$1/plain"\n',
+}
+
+
+class Test_Reingest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        common.work_dirs(nza, self.tmp)
+        nza.db_enable = False
+        nza.pyinproc = False
+        nza.incrmtl = False
+        self.scrpdir = nza.scrpdir
+        nza.scrpdir = os.path.join(self.tmp, 'scripts')
+        os.mkdir(nza.scrpdir)
+        self.write(SCRIPTS)
+
+        self.warns = []
+        self.warn = nza.print_warn
+        nza.print_warn = lambda msg, *args: self.warns.append(msg)
+        self.stdout, sys.stdout = sys.stdout, io.BytesIO()
+
+        common.make_bundle(os.path.join(nza.uplddir, 'b.tar.gz'), [
+            (TOP + '/collector.stats', common.STATS),
+            (TOP + '/os/messages', 'boot\n')])
+        self.assertEqual(nza.Ingest('b.tar.gz', 'net'), 0)
+        self.fqtd = os.path.join(nza.ingddir, '2014-05-13', 'collector-h-1')
+        self.arch = os.path.join(nza.clardir, '2014-05-13', 'b.tar.gz')
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        nza.print_warn = self.warn
+        nza.scrpdir = self.scrpdir
+        nza.incrmtl = False
+        os.chdir(common.topdir)
+        shutil.rmtree(self.tmp)
+
+    def write(self, scripts):
+        for s, body in scripts.items():
+            path = os.path.join(nza.scrpdir, s)
+            with open(path, 'w') as f:
+                f.write(body)
+            os.chmod(path, 0755)
+
+    def lines(self, name):
+        with open(os.path.join(self.fqtd, name)) as f:
+            return len(f.readlines())
+
+    def reingest(self):
+        extract = nza.stream_extract
+        nza.stream_extract = lambda *args: self.fail('bundle extracted')
+        nza.incrmtl = True
+        try:
+            return nza.Reingest(self.arch, 'net')
+        finally:
+            nza.stream_extract = extract
+
+    def test_no_extraction(self):
+        self.assertEqual(self.lines('ingestor/count'), 1)
+        self.assertEqual(self.reingest(), 0)
+        self.assertEqual(self.lines('ingestor/count'), 1)
+        self.assertEqual(self.lines('plain'), 1)
+        self.assertTrue(os.path.islink(os.path.join(nza.linkdir,
+            'collector-h-1')))
+
+    def test_no_outputs_declared(self):
+        self.write({'A2-plain.sh': SCRIPTS['A2-plain.sh'] + '# v2\n'})
+        self.assertEqual(self.reingest(), 0)
+        self.assertEqual(self.lines('ingestor/count'), 1)
+        self.assertEqual(self.lines('plain'), 2)
+        self.assertTrue([w for w in self.warns
+            if 'A2-plain.sh declares no outputs' in w], self.warns)
+
+    def test_no_fingerprints(self):
+        os.unlink(os.path.join(self.fqtd, '.ingestor_fingerprints'))
+        nza.incrmtl = True
+        self.assertEqual(nza.Reingest(self.arch, 'net'), 0)
+        self.assertEqual(self.lines('ingestor/count'), 1)
+        self.assertTrue([w for w in self.warns
+            if 'No usable fingerprints' in w], self.warns)
+
+
+if __name__ == '__main__':
+    unittest.main()
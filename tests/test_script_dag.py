@@ -0,0 +1,111 @@
+#
+# NZA_Ingestor.py: ingestion script dependency graph and scheduling
+#
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import common
+
+nza = common.load_ingestor()
+
+SCRIPTS = {
+    'A1-links.sh': '# produces: links/\n',
+    'A2-pool.sh': '# requires: links/zpool\n# produces: warnings/pool\n',
+    'A2-tiered.sh': 'echo no headers\n',
+    'A3-json.py': '#!/usr/bin/env python\n# requires: kernel/messages\n',
+    'A9-diag.sh': '#!/bin/bash\n# requires: warnings/pool links/\n',
+}
+
+
+class Test_Script_Dag(unittest.TestCase):
+
+    def setUp(self):
+        self.scrpdir = nza.scrpdir
+        self.tmp = nza.scrpdir = tempfile.mkdtemp()
+        self.write(SCRIPTS)
+        self.scripts = sorted(SCRIPTS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        nza.scrpdir = self.scrpdir
+        nza.scrcost.clear()
+
+    def write(self, scripts):
+        for s, body in scripts.items():
+            with open(os.path.join(nza.scrpdir, s), 'w') as f:
+                f.write(body)
+
+    def test_headers(self):
+        self.assertEqual(nza.script_headers('A2-pool.sh'),
+            (['links/zpool'], ['warnings/pool']))
+        self.assertEqual(nza.script_headers('A2-tiered.sh'), (None, []))
+
+    def test_dag(self):
+        deps = nza.script_dag(self.scripts)
+        self.assertEqual(deps['A1-links.sh'], set())
+        self.assertEqual(deps['A2-pool.sh'], set(['A1-links.sh']))
+        self.assertEqual(deps['A2-tiered.sh'], set(['A1-links.sh']))
+        self.assertEqual(deps['A3-json.py'], set())
+        self.assertEqual(deps['A9-diag.sh'],
+            set(['A1-links.sh', 'A2-pool.sh']))
+
+    def test_cycle(self):
+        self.write({'A2-pool.sh': '# requires: warnings/diag\n' +
+            '# produces: warnings/pool\n', 'A9-diag.sh':
+            '# requires: warnings/pool\n# produces: warnings/diag\n'})
+        self.assertEqual(nza.script_dag(self.scripts), None)
+        warn, nza.print_warn = nza.print_warn, lambda *args: None
+        try:
+            deps = nza.script_deps(self.scripts)
+        finally:
+            nza.print_warn = warn
+        self.assertEqual(deps['A2-pool.sh'], set(['A1-links.sh']))
+        self.assertEqual(deps['A9-diag.sh'], set(self.scripts[:-1]))
+
+    def test_critical_path(self):
+        nza.scrcost.update({'A1-links.sh': 2.0, 'A2-pool.sh': 5.0,
+            'A3-json.py': 3.0, 'A9-diag.sh': 1.0})
+        deps = nza.script_dag(self.scripts)
+        prio = nza.critical_path(self.scripts, deps)
+        self.assertEqual(prio['A9-diag.sh'], 1.0)
+        self.assertEqual(prio['A2-pool.sh'], 6.0)
+        self.assertEqual(prio['A2-tiered.sh'], 1.0)
+        self.assertEqual(prio['A1-links.sh'], 8.0)
+        self.assertEqual(prio['A3-json.py'], 3.0)
+        order = sorted(self.scripts, key=lambda s: -prio[s])
+        self.assertEqual(order[:2], ['A1-links.sh', 'A2-pool.sh'])
+
+    def test_script_files(self):
+        self.write({'A3-json.pyc': '', 'A2-pool.sh~': '',
+            'A1-links.sh.orig': '', 'A2-lic.php': '', 'README': ''})
+        self.assertEqual(nza.get_ingestor_scripts(),
+            sorted(self.scripts + ['A2-lic.php']))
+
+    def test_no_bytecode(self):
+        self.write({'helper.py': 'X = 1\n', 'A4-exit.py':
+            'import sys\nimport helper\n\ndef main(bdir):\n' +
+            '    sys.exit(helper.X + 2)\n'})
+        argv, path = sys.argv, sys.path[:]
+        dwb = sys.dont_write_bytecode
+        try:
+            code = nza.py_main(os.path.join(self.tmp, 'A4-exit.py'), '/')
+        finally:
+            sys.argv, sys.path[:] = argv, path
+            sys.dont_write_bytecode = dwb
+            sys.modules.pop('helper', None)
+        self.assertEqual(code, 3)
+        self.assertEqual([f for f in os.listdir(self.tmp)
+            if f.endswith('.pyc')], [])
+
+    def test_shipped_scripts(self):
+        nza.scrpdir = self.scrpdir
+        scripts = nza.get_ingestor_scripts()
+        deps = nza.script_dag(scripts)
+        self.assertNotEqual(deps, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#
+# NZA_Ingestor.py: the upload watcher's quiet period and resubmission
+#
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import common
+
+nza = common.load_ingestor()
+
+QUIET = 0.05
+
+
+class Fake_Pool(object):
+    """
+    #
+    # Worker pool that takes jobs while 'full' is False and keeps
+    # their completion callbacks
+    #
+    """
+    def __init__(self):
+        self.full = False
+        self.jobs = []
+
+    def submit(self, rqst, callback):
+        if self.full:
+            return None
+        self.jobs.append((rqst, callback))
+        return len(self.jobs)
+
+
+class Test_Upload_Watcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.w = nza.Upload_Watcher(self.tmp, QUIET)
+        self.w.pool = self.pool = Fake_Pool()
+        self.stdout, sys.stdout = sys.stdout, io.BytesIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        os.close(self.w.ino.fileno())
+        shutil.rmtree(self.tmp)
+
+    def upload(self, name, data='x' * 100):
+        with open(os.path.join(self.tmp, name), 'ab') as f:
+            f.write(data)
+        self.w.note(name)
+        return os.path.join(self.tmp, name)
+
+    def settle(self):
+        time.sleep(QUIET * 1.5)
+        return self.w.settle()
+
+    def submitted(self):
+        return [rqst for rqst, cb in self.pool.jobs]
+
+    def test_quiet_period(self):
+        fqbn = self.upload('b.tar.gz')
+        wait = self.w.settle()
+        self.assertTrue(0 < wait <= QUIET, wait)
+        self.assertEqual(self.submitted(), [])
+
+        self.assertEqual(self.settle(), None)
+        self.assertEqual(self.submitted(), ['ingest ' + fqbn])
+        self.assertEqual(self.w.pending, {})
+
+    def test_ignored(self):
+        for name in ('.b.tar.gz', 'notes.txt'):
+            self.upload(name)
+        self.assertEqual(self.w.pending, {})
+        self.assertEqual(self.settle(), None)
+        self.assertEqual(self.submitted(), [])
+
+    def test_resumed_upload(self):
+        fqbn = self.upload('b.tar.gz')
+        with open(fqbn, 'ab') as f:             # no event seen for it
+            f.write('y' * 100)
+        self.assertEqual(self.settle(), QUIET)
+        self.assertEqual(self.submitted(), [])
+        self.assertEqual(self.settle(), None)
+        self.assertEqual(self.submitted(), ['ingest ' + fqbn])
+
+    def test_gone(self):
+        fqbn = self.upload('b.tar.gz')
+        os.unlink(fqbn)
+        self.assertEqual(self.settle(), None)
+        self.assertEqual(self.w.pending, {})
+        self.assertEqual(self.submitted(), [])
+
+    def test_busy_retry(self):
+        self.pool.full = True
+        fqbn = self.upload('b.tar.gz')
+        self.assertEqual(self.settle(), 1.0)
+        self.assertTrue(fqbn in self.w.pending)
+        self.assertEqual(self.w.inflight, set())
+
+        self.pool.full = False
+        self.assertEqual(self.w.settle(), None)
+        self.assertEqual(self.submitted(), ['ingest ' + fqbn])
+        self.assertEqual(self.w.inflight, set([fqbn]))
+
+        #
+        # Uploaded again while the first one is still being ingested:
+        # held back until that completes
+        #
+        self.upload('b.tar.gz')
+        self.assertEqual(self.settle(), 1.0)
+        self.assertEqual(len(self.pool.jobs), 1)
+        self.pool.jobs[0][1](1, 'done', 0)
+        self.assertEqual(self.w.inflight, set())
+        self.assertEqual(self.w.settle(), None)
+        self.assertEqual(self.submitted(), ['ingest ' + fqbn] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
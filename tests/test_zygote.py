@@ -0,0 +1,93 @@
+#
+# NZA_Ingestor.py: warm Script_Zygote workers for Python ingestion
+# scripts
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+
+nza = common.load_ingestor()
+
+SCRIPTS = {
+    'A1-leak.py': 'import os\nimport sys\n\nseen = []\n\n' +
+        'def main(bdir):\n    import functions\n' +
+        '    if functions.runs or "NZA_LEAK" in os.environ:\n' +
+        '        sys.exit(3)\n    functions.runs.append(1)\n' +
+        '    os.environ["NZA_LEAK"] = "1"\n    os.chdir("/")\n',
+    'A1-exit.py': 'import os\n\ndef main(bdir):\n    os._exit(7)\n',
+    'A1-kill.py': 'import os\nimport signal\n\ndef main(bdir):\n' +
+        '    os.kill(os.getpid(), signal.SIGKILL)\n',
+    'A1-cwd.py': 'import os\nimport sys\n\ndef main(bdir):\n' +
+        '    sys.exit(0 if os.getcwd() == bdir else 4)\n',
+    'A1-nice.py': 'import os\nimport sys\n\ndef main(bdir):\n' +
+        '    sys.exit(os.nice(0))\n',
+    'functions.py': 'runs = []\n',
+}
+
+
+class Test_Script_Zygote(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        common.work_dirs(nza, self.tmp)
+        self.scrpdir = nza.scrpdir
+        nza.scrpdir = os.path.join(self.tmp, 'scripts')
+        os.mkdir(nza.scrpdir)
+        for s, body in SCRIPTS.items():
+            with open(os.path.join(nza.scrpdir, s), 'w') as f:
+                f.write(body)
+        self.zygote = nza.Script_Zygote(os.path.join(self.tmp, 'zygote'),
+            1, 64)
+        self.zygote.start()
+
+    def tearDown(self):
+        self.zygote.stop()
+        nza.scrpdir = self.scrpdir
+        shutil.rmtree(self.tmp)
+
+    def run_script(self, s, cwd=None):
+        cwd = cwd or self.tmp
+        here = os.getcwd()
+        os.chdir(cwd)
+        try:
+            conn = self.zygote.submit(os.path.join(nza.scrpdir, s), cwd)
+        finally:
+            os.chdir(here)
+        self.assertNotEqual(conn, None)
+        return nza.zygote_reply(conn)
+
+    def test_no_leaks(self):
+        for n in range(3):
+            self.assertEqual(self.run_script('A1-leak.py')[0], 0)
+            self.assertEqual(self.run_script('A1-cwd.py', nza.ingddir)[0],
+                0)
+
+    def test_status(self):
+        self.assertEqual(self.run_script('A1-exit.py')[0], 7)
+        self.assertEqual(self.run_script('A1-kill.py')[0], -9)
+        self.assertEqual(self.run_script('A1-cwd.py')[0], 0)
+
+    def test_nice(self):
+        base = os.nice(0)
+        self.assertEqual(self.run_script('A1-nice.py')[0], base)
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                os.nice(5)
+                code = self.run_script('A1-nice.py')[0] - base
+            finally:
+                os._exit(code)
+        self.assertEqual(os.WEXITSTATUS(os.waitpid(pid, 0)[1]), 5)
+
+    def test_rusage(self):
+        sts, ru = self.run_script('A1-cwd.py')
+        self.assertEqual(sts, 0)
+        self.assertTrue(ru.ru_maxrss > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()